@@ -0,0 +1,284 @@
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import multiprocessing as mp
+import os
+import sys
+import time
+from collections import Counter, defaultdict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import face_db
+from face_batch import IMAGE_EXTENSIONS
+
+log = logging.getLogger(__name__)
+
+MANIFEST_FIELDS = ("contact", "age", "gender", "address", "occupation")
+
+# One image to enroll; details holds the manifest's extra columns
+EnrollItem = namedtuple("EnrollItem", ["name", "path", "details"])
+
+# Worker output: encoding is a float32 array, or None with error set
+EncodeResult = namedtuple("EncodeResult", ["path", "encoding", "error"])
+
+
+# -----------------------
+# Inputs
+# -----------------------
+def items_from_directory(root):
+    # root/<person>/<images...>; underscores in folder names become spaces
+    items = []
+    for person in sorted(os.listdir(root)):
+        folder = os.path.join(root, person)
+        if not os.path.isdir(folder):
+            continue
+        name = person.replace("_", " ").strip()
+        for dirpath, _, files in os.walk(folder):
+            for f in sorted(files):
+                if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS:
+                    items.append(EnrollItem(name, os.path.join(dirpath, f), {}))
+    return items
+
+
+def items_from_manifest(path):
+    # CSV with name and image columns plus optional MANIFEST_FIELDS; image
+    # paths are relative to the manifest
+    base = os.path.dirname(os.path.abspath(path))
+    items = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for line, row in enumerate(csv.DictReader(f), 2):
+            name, image = (row.get("name") or "").strip(), (row.get("image") or "").strip()
+            if not name or not image:
+                log.warning("%s:%d: missing name or image, skipped", path, line)
+                continue
+            details = {field: row[field] for field in MANIFEST_FIELDS if row.get(field)}
+            items.append(EnrollItem(name, os.path.join(base, image), details))
+    return items
+
+
+def content_hash(path, block=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(block), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+# -----------------------
+# Workers
+# -----------------------
+_options = None
+
+
+def _init_worker(options):
+    global _options
+    _options = options
+
+
+def encode_image(path):
+    # Encodes the largest face in the image. Large photos are scaled down
+    # for detection and encoding; enrollment shots are close-ups, so this
+    # costs no accuracy and saves most of the HOG time.
+    import cv2
+    import face_recognition
+
+    image = cv2.imread(path)
+    if image is None:
+        return EncodeResult(path, None, "unreadable image")
+    max_size = _options["max_size"]
+    if max_size and max(image.shape[:2]) > max_size:
+        scale = max_size / max(image.shape[:2])
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    boxes = face_recognition.face_locations(rgb, _options["upsample"], _options["model"])
+    if not boxes:
+        return EncodeResult(path, None, "no face found")
+    if len(boxes) > 1 and _options["single_face"]:
+        return EncodeResult(path, None, f"{len(boxes)} faces found")
+    box = max(boxes, key=lambda b: (b[2] - b[0]) * (b[1] - b[3]))
+    encodings = face_recognition.face_encodings(rgb, [box], num_jitters=_options["jitters"])
+    if not encodings:
+        return EncodeResult(path, None, "encoding failed")
+    return EncodeResult(path, encodings[0].astype("float32"), None)
+
+
+# -----------------------
+# Driver
+# -----------------------
+def plan(items, per_person, retry_failed=False):
+    # Hashes every image and checks the cache. Returns (to_encode, reuse,
+    # spare, stats, failures): items needing a worker, (item, hash, blob)
+    # whose encoding is cached, each person's over-limit candidates as
+    # (item, hash, blob or None) in order, and what was skipped or failed
+    # up front. Spares fill the slots of images that fail to encode.
+    stats = Counter()
+    failures = []
+    hashes = {}
+    for item in items:
+        try:
+            hashes[item.path] = content_hash(item.path)
+        except OSError as e:
+            failures.append((item.path, item.name, f"unreadable file: {e.strerror}"))
+    cached = face_db.get_cached_encodings(set(hashes.values()))
+
+    to_encode, reuse = [], []
+    spare = defaultdict(deque)
+    taken = Counter()
+    seen = set()
+    for item in items:
+        h = hashes.get(item.path)
+        if h is None:
+            continue
+        if h in seen:
+            stats["duplicate"] += 1
+            continue
+        seen.add(h)
+        blob, error, enrolled = cached.get(h, (None, None, False))
+        if enrolled:
+            stats["already_enrolled"] += 1
+            taken[item.name] += 1
+            continue
+        over_limit = per_person and taken[item.name] >= per_person
+        if error and not retry_failed:
+            # Known to fail; only reported if it would have been used
+            if over_limit:
+                stats["over_limit"] += 1
+            else:
+                stats["cached_failure"] += 1
+                failures.append((item.path, item.name, error))
+            continue
+        if over_limit:
+            spare[item.name].append((item, h, blob))
+            continue
+        taken[item.name] += 1
+        if blob is not None:
+            reuse.append((item, h, blob))
+        else:
+            to_encode.append((item, h))
+    return to_encode, reuse, spare, stats, failures
+
+
+def enroll(items, workers=None, per_person=5, batch_size=200, retry_failed=False, dry_run=False,
+           model="hog", upsample=1, jitters=1, max_size=1024, single_face=False):
+    start = time.perf_counter()
+    to_encode, reuse, spare, stats, failures = plan(items, per_person, retry_failed)
+    stats["images"] = len(items)
+    stats["cached_encoding"] = len(reuse)
+    log.info("%d images: %d to encode, %d cached, %d already enrolled",
+             len(items), len(to_encode), len(reuse), stats["already_enrolled"])
+    if dry_run:
+        stats["over_limit"] += sum(len(candidates) for candidates in spare.values())
+        return stats, failures
+
+    pending = [(h, item.name, blob, dict(item.details, image_path=item.path)) for item, h, blob in reuse]
+
+    def flush():
+        if pending:
+            stats["enrolled"] += len(face_db.enroll_known_faces(pending))
+            pending.clear()
+
+    def refill(name, retry):
+        # A failed image frees its slot for the person's next spare: cached
+        # encodings are enrolled directly, the rest go to the next round
+        if spare[name]:
+            item, h, blob = spare[name].popleft()
+            if blob is None:
+                retry.append((item, h))
+            else:
+                stats["cached_encoding"] += 1
+                pending.append((h, item.name, blob, dict(item.details, image_path=item.path)))
+
+    if to_encode:
+        workers = workers or os.cpu_count() or 1
+        for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ.setdefault(var, "1")
+        options = {"model": model, "upsample": upsample, "jitters": jitters,
+                   "max_size": max_size, "single_face": single_face}
+        new_failures = []
+        with ProcessPoolExecutor(workers, mp_context=mp.get_context("spawn"), initializer=_init_worker,
+                                 initargs=(options,)) as pool:
+            # Rounds until every failed slot is refilled or its person has
+            # no spares left
+            while to_encode:
+                retry = []
+                paths = [item.path for item, _ in to_encode]
+                results = pool.map(encode_image, paths, chunksize=max(1, min(16, len(paths) // (workers * 4))))
+                for done, ((item, h), result) in enumerate(zip(to_encode, results), 1):
+                    if result.error:
+                        failures.append((item.path, item.name, result.error))
+                        new_failures.append((h, result.error))
+                        refill(item.name, retry)
+                    else:
+                        pending.append((h, item.name, face_db.encode_encoding(result.encoding),
+                                        dict(item.details, image_path=item.path)))
+                    if len(pending) >= batch_size:
+                        flush()
+                    if done % 500 == 0:
+                        log.info("Encoded %d/%d images", done, len(to_encode))
+                if retry:
+                    log.info("Encoding %d spare images for failed slots", len(retry))
+                to_encode = retry
+        if new_failures:
+            face_db.cache_encoding_failures(new_failures)
+    flush()
+
+    stats["over_limit"] += sum(len(candidates) for candidates in spare.values())
+    stats["failed"] = len(failures)
+    stats["seconds"] = round(time.perf_counter() - start, 2)
+    return stats, failures
+
+
+def print_summary(stats, failures, failures_path=None, out=sys.stderr):
+    print(json.dumps(dict(stats)), file=out)
+    if not failures:
+        return
+    print(f"{len(failures)} images failed:", file=out)
+    for reason, count in Counter(error for _, _, error in failures).most_common():
+        print(f"  {count:>6}  {reason}", file=out)
+    people = Counter(name for _, name, _ in failures)
+    print(f"  across {len(people)} people, most affected: "
+          + ", ".join(f"{name} ({n})" for name, n in people.most_common(5)), file=out)
+    if failures_path:
+        with open(failures_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(("image", "name", "error"))
+            writer.writerows(failures)
+        print(f"  full list written to {failures_path}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Enroll known faces in bulk from image folders or a CSV manifest.")
+    parser.add_argument("source", help="directory with one folder per person, or a CSV manifest "
+                                       "(columns: name, image, optional " + ", ".join(MANIFEST_FIELDS) + ")")
+    parser.add_argument("--db", default=face_db.DB_PATH)
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--per-person", type=int, default=5, help="encodings kept per person (0 = all)")
+    parser.add_argument("--batch-size", type=int, default=200, help="known faces per transaction")
+    parser.add_argument("--model", default="hog", choices=("hog", "cnn"))
+    parser.add_argument("--upsample", type=int, default=1)
+    parser.add_argument("--jitters", type=int, default=1, help="re-samples per encoding (slower, more stable)")
+    parser.add_argument("--max-size", type=int, default=1024, help="scale larger images down to this side")
+    parser.add_argument("--single-face", action="store_true", help="reject images with more than one face")
+    parser.add_argument("--retry-failed", action="store_true", help="encode images that failed before again")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be done")
+    parser.add_argument("--failures", help="write failed images to this CSV")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s", stream=sys.stderr)
+    face_db.DB_PATH = args.db
+    face_db.init_db()
+    if os.path.isdir(args.source):
+        items = items_from_directory(args.source)
+    else:
+        items = items_from_manifest(args.source)
+    stats, failures = enroll(
+        items, args.workers, args.per_person, args.batch_size, args.retry_failed, args.dry_run,
+        args.model, args.upsample, args.jitters, args.max_size, args.single_face)
+    print_summary(stats, failures, args.failures)
+    return 1 if failures and not stats["enrolled"] and not args.dry_run else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+import json
+import logging
+import threading
+import time
+import urllib.request
+from collections import deque, namedtuple
+
+log = logging.getLogger(__name__)
+
+# count > 1 means this alert stands for several merged sightings
+Alert = namedtuple("Alert", ["name", "image_path", "timestamp", "count", "extra"])
+
+
+def alert_to_dict(alert):
+    data = {"name": alert.name, "image_path": alert.image_path,
+            "timestamp": alert.timestamp, "count": alert.count}
+    data.update(alert.extra)
+    return data
+
+
+# -----------------------
+# Sinks
+# -----------------------
+class CallbackSink:
+    # Wraps an old-style send_alert(name, image_path) callback
+    def __init__(self, callback):
+        self.callback = callback
+
+    def send_batch(self, alerts):
+        for alert in alerts:
+            self.callback(alert.name, alert.image_path)
+
+
+class LogFileSink:
+    def __init__(self, path):
+        self.path = path
+
+    def send_batch(self, alerts):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for alert in alerts:
+                f.write(json.dumps(alert_to_dict(alert)) + "\n")
+
+
+class LoggingSink:
+    # Emits each alert as a log record; the alert fields go in record.alert
+    def __init__(self, logger=log):
+        self.logger = logger
+
+    def send_batch(self, alerts):
+        for alert in alerts:
+            self.logger.warning("%s detected", alert.name, extra={"alert": alert_to_dict(alert)})
+
+
+class WebhookSink:
+    # POSTs each batch as one JSON array
+    def __init__(self, url, timeout=5.0, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+
+    def send_batch(self, alerts):
+        body = json.dumps([alert_to_dict(a) for a in alerts]).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, headers=self.headers, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if response.status >= 300:
+                raise IOError(f"Webhook returned HTTP {response.status}")
+
+
+class QueueSink:
+    # Hands alerts to a local message queue (queue.Queue or multiprocessing.Queue)
+    def __init__(self, target):
+        self.target = target
+
+    def send_batch(self, alerts):
+        for alert in alerts:
+            self.target.put_nowait(alert_to_dict(alert))
+
+
+# -----------------------
+# Dispatch
+# -----------------------
+class SinkWorker(threading.Thread):
+    # Delivers to one sink from a bounded buffer, in batches, retrying with
+    # exponential backoff. When the sink lags and the buffer is full, either
+    # the oldest or the incoming alert is dropped.
+    def __init__(self, sink, max_queue=1000, batch_size=50, batch_delay=0.5,
+                 max_retries=5, backoff=0.5, max_backoff=30.0, drop="oldest"):
+        super().__init__(daemon=True)
+        self.sink = sink
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.drop = drop
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def offer(self, alert):
+        with self._cond:
+            if len(self._buffer) >= self.max_queue:
+                self.dropped += 1
+                if self.drop == "newest":
+                    return False
+                self._buffer.popleft()
+            self._buffer.append(alert)
+            self._cond.notify()
+            return True
+
+    def depth(self):
+        with self._cond:
+            return len(self._buffer)
+
+    def _next_batch(self):
+        with self._cond:
+            # Wait for the first alert, then give the batch a moment to fill
+            self._cond.wait_for(lambda: self._buffer or self._stopping)
+            if self._buffer and len(self._buffer) < self.batch_size and not self._stopping:
+                self._cond.wait_for(lambda: len(self._buffer) >= self.batch_size or self._stopping,
+                                    self.batch_delay)
+            n = min(self.batch_size, len(self._buffer))
+            return [self._buffer.popleft() for _ in range(n)]
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self._stopping:
+                    return
+                continue
+            self._deliver(batch)
+
+    def _deliver(self, batch):
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.sink.send_batch(batch)
+                self.sent += len(batch)
+                return
+            except Exception as e:
+                if attempt == self.max_retries or self._stopping:
+                    self.failed += len(batch)
+                    log.error("Alert sink %s failed: %s", type(self.sink).__name__, e)
+                    return
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+
+class AlertDispatcher:
+    # Drop-in replacement for the send_alert callback: never blocks the frame
+    # loop. Repeat alerts for the same face (same name and crop) inside the
+    # cooldown window are merged into one follow-up alert carrying a count.
+    def __init__(self, sinks, cooldown=60.0, **worker_options):
+        self.cooldown = cooldown
+        self.workers = [SinkWorker(sink, **worker_options) for sink in sinks]
+        self._windows = {}  # key -> [window start, merged alert or None]
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._janitor = threading.Thread(target=self._flush_windows_loop, daemon=True)
+        self.merged = 0
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        self._janitor.start()
+        return self
+
+    def __call__(self, name, image_path, **extra):
+        self.submit(name, image_path, **extra)
+
+    def submit(self, name, image_path, **extra):
+        now = time.time()
+        key = (name, image_path)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and now - window[0] < self.cooldown:
+                merged = window[1]
+                count = merged.count + 1 if merged else 1
+                window[1] = Alert(name, image_path, now, count, extra)
+                self.merged += 1
+                return
+            self._windows[key] = [now, None]
+        self._fan_out(Alert(name, image_path, now, 1, extra))
+
+    def _fan_out(self, alert):
+        for worker in self.workers:
+            worker.offer(alert)
+
+    def _flush_windows(self, force=False):
+        now = time.time()
+        due = []
+        with self._lock:
+            for key, (start, merged) in list(self._windows.items()):
+                if force or now - start >= self.cooldown:
+                    del self._windows[key]
+                    if merged is not None:
+                        due.append(merged)
+        for alert in due:
+            self._fan_out(alert)
+
+    def _flush_windows_loop(self):
+        while not self._stopping.wait(1.0):
+            self._flush_windows()
+
+    def queue_depths(self):
+        return {type(w.sink).__name__: w.depth() for w in self.workers}
+
+    def stop(self, timeout=5.0):
+        # Sends what is still buffered, then stops the workers
+        self._stopping.set()
+        self._flush_windows(force=True)
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.join(timeout)
@@ -0,0 +1,250 @@
+import argparse
+import os
+
+import numpy as np
+
+from face_file_lock import load_or_build as load_or_build_index
+from face_gallery import ENCODING_DIM, as_matrix, pairwise_distances, squared_norms, top_k
+
+ASSIGN_CHUNK = 65536
+# Distances held at once by the recall check (64 MiB of float32)
+RECALL_CELLS = 1 << 24
+
+
+def index_path_for(db_path):
+    # The index file sits next to the database it was built from
+    return os.path.splitext(db_path)[0] + ".ivf.npz"
+
+
+def default_n_lists(n):
+    return int(np.clip(4 * np.sqrt(n), 1, max(n, 1)))
+
+
+def assign(vectors, centroids):
+    # Nearest centroid for every vector, chunked to bound memory
+    centroid_sq = squared_norms(centroids)
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        chunk = vectors[start:start + ASSIGN_CHUNK]
+        labels[start:start + len(chunk)] = pairwise_distances(chunk, centroids, centroid_sq).argmin(axis=1)
+    return labels
+
+
+def kmeans(vectors, k, iters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iters):
+        labels = assign(vectors, centroids)
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        # Per-list sums via one sorted pass instead of a scatter-add
+        order = np.argsort(labels, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[~empty]
+        sums = np.add.reduceat(vectors[order].astype(np.float64), starts, axis=0)
+        centroids[~empty] = (sums / counts[~empty, None]).astype(np.float32)
+        # Re-seed empty lists from random points so no list stays dead
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    # Inverted-file index: a k-means coarse quantizer splits the gallery into
+    # lists, a query only scans the n_probe nearest lists, and the shortlist
+    # is re-ranked with exact distances on the stored vectors.
+    def __init__(self, n_lists=None, n_probe=8, dim=ENCODING_DIM, train_sample=100000, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.dim = dim
+        self.train_sample = train_sample
+        self.seed = seed
+        self.centroids = None
+        self._reset_lists(0)
+
+    def _reset_lists(self, n_lists):
+        self.list_ids = [np.empty(0, dtype=np.int64) for _ in range(n_lists)]
+        self.list_vectors = [np.empty((0, self.dim), dtype=np.float32) for _ in range(n_lists)]
+        self._list_of = {}  # face id -> list number
+
+    def __len__(self):
+        return len(self._list_of)
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def matches(self, ids):
+        # True when the index holds exactly these ids. Lists trained on far
+        # fewer rows (e.g. an index grown from an empty gallery) no longer
+        # match, so the index is rebuilt with the default list count.
+        if not self.is_trained or len(ids) != len(self):
+            return False
+        if self.n_lists is None and 4 * len(self.centroids) < default_n_lists(len(ids)):
+            return False
+        return all(int(i) in self._list_of for i in ids)
+
+    def train(self, vectors):
+        vectors = as_matrix(vectors, self.dim)
+        n_lists = self.n_lists or default_n_lists(len(vectors))
+        n_lists = max(1, min(n_lists, len(vectors)))
+        rng = np.random.default_rng(self.seed)
+        if len(vectors) > self.train_sample:
+            vectors = vectors[rng.choice(len(vectors), self.train_sample, replace=False)]
+        self.centroids = kmeans(vectors, n_lists, seed=self.seed)
+        self._reset_lists(n_lists)
+
+    def build(self, ids, vectors):
+        vectors = as_matrix(vectors, self.dim)
+        if len(vectors) == 0:
+            self.centroids = None
+            self._reset_lists(0)
+            return
+        self.train(vectors)
+        self.add(ids, vectors)
+
+    def add(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = as_matrix(vectors, self.dim)
+        if not self.is_trained:
+            # Built from an empty gallery: the first faces added train it
+            self.train(vectors)
+        self.remove([i for i in ids if int(i) in self._list_of])
+        labels = assign(vectors, self.centroids)
+        for lst in np.unique(labels):
+            members = labels == lst
+            self.list_ids[lst] = np.concatenate([self.list_ids[lst], ids[members]])
+            self.list_vectors[lst] = np.concatenate([self.list_vectors[lst], vectors[members]])
+            for face_id in ids[members]:
+                self._list_of[int(face_id)] = int(lst)
+
+    def remove(self, ids):
+        by_list = {}
+        for face_id in ids:
+            lst = self._list_of.pop(int(face_id), None)
+            if lst is not None:
+                by_list.setdefault(lst, []).append(int(face_id))
+        for lst, removed in by_list.items():
+            keep = ~np.isin(self.list_ids[lst], removed)
+            self.list_ids[lst] = self.list_ids[lst][keep]
+            self.list_vectors[lst] = self.list_vectors[lst][keep]
+
+    def search(self, queries, k, n_probe=None):
+        # Returns (ids, distances), both (n_queries, k), nearest first;
+        # missing slots are padded with id -1 and distance inf.
+        queries = as_matrix(queries, self.dim)
+        out_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        out_dists = np.full((len(queries), k), np.inf, dtype=np.float32)
+        if not self.is_trained or len(self) == 0:
+            return out_ids, out_dists
+
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        probes = top_k(pairwise_distances(queries, self.centroids), n_probe)
+        for q, lists in enumerate(probes):
+            cand_ids = np.concatenate([self.list_ids[lst] for lst in lists])
+            if len(cand_ids) == 0:
+                continue
+            cand_vectors = np.concatenate([self.list_vectors[lst] for lst in lists])
+            dists = pairwise_distances(queries[q:q + 1], cand_vectors)
+            best = top_k(dists, k)[0]
+            out_ids[q, :len(best)] = cand_ids[best]
+            out_dists[q, :len(best)] = dists[0, best]
+        return out_ids, out_dists
+
+    def save(self, path):
+        sizes = np.array([len(ids) for ids in self.list_ids], dtype=np.int64)
+        # Per-process temp name: several recognizers may save at once
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids if self.is_trained else np.empty((0, self.dim), np.float32),
+            sizes=sizes,
+            ids=np.concatenate(self.list_ids) if self.list_ids else np.empty(0, np.int64),
+            vectors=np.concatenate(self.list_vectors) if self.list_vectors else np.empty((0, self.dim), np.float32),
+            n_probe=self.n_probe,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(n_probe=int(data["n_probe"]), dim=data["centroids"].shape[1])
+            if len(data["centroids"]):
+                index.centroids = data["centroids"]
+            index._reset_lists(len(data["centroids"]))
+            bounds = np.concatenate([[0], np.cumsum(data["sizes"])])
+            ids, vectors = data["ids"], data["vectors"]
+            for lst in range(len(data["sizes"])):
+                index.list_ids[lst] = ids[bounds[lst]:bounds[lst + 1]]
+                index.list_vectors[lst] = vectors[bounds[lst]:bounds[lst + 1]]
+                for face_id in index.list_ids[lst]:
+                    index._list_of[int(face_id)] = lst
+        return index
+
+
+def load_or_build(ids, vectors, path, **kwargs):
+    def build():
+        index = IVFIndex(**kwargs)
+        index.build(ids, vectors)
+        return index
+    return load_or_build_index(IVFIndex, ids, build, path)
+
+
+def measure_recall(index, ids, vectors, queries, tolerance, n_probe=None):
+    # Share of exact within-tolerance neighbours the index also returns, and
+    # how often both agree on the nearest row.
+    # Ground truth is computed a few queries at a time, so the exact
+    # distances never span every query against the whole gallery.
+    ids = np.asarray(ids, dtype=np.int64)
+    vectors = as_matrix(vectors, index.dim)
+    vector_sq = squared_norms(vectors)
+    step = max(1, RECALL_CELLS // max(1, len(vectors)))
+    found = expected = 0
+    top1 = 0
+    for start in range(0, len(queries), step):
+        chunk = queries[start:start + step]
+        exact = pairwise_distances(chunk, vectors, vector_sq)
+        k = max(1, int((exact <= tolerance).sum(axis=1).max()))
+        ann_ids, ann_dists = index.search(chunk, k, n_probe)
+        for q in range(len(chunk)):
+            truth = set(ids[exact[q] <= tolerance].tolist())
+            got = set(ann_ids[q][ann_dists[q] <= tolerance].tolist())
+            found += len(truth & got)
+            expected += len(truth)
+            top1 += ann_ids[q, 0] == ids[exact[q].argmin()]
+    return {
+        "tolerance": tolerance,
+        "recall": found / expected if expected else 1.0,
+        "top1_agreement": float(top1) / len(queries),
+        "queries": len(queries),
+    }
+
+
+if __name__ == "__main__":
+    import face_db
+    from face_db import decode_encoding, get_known_encodings
+
+    parser = argparse.ArgumentParser(description="Build the known-face ANN index and check its recall.")
+    parser.add_argument("--db", default=face_db.DB_PATH)
+    parser.add_argument("--lists", type=int, default=None, help="number of IVF lists (default 4*sqrt(N))")
+    parser.add_argument("--probe", type=int, default=8, help="lists scanned per query")
+    parser.add_argument("--queries", type=int, default=1000, help="sampled queries for the recall check")
+    parser.add_argument("--noise", type=float, default=0.02, help="per-dimension noise added to sampled queries")
+    args = parser.parse_args()
+
+    face_db.DB_PATH = args.db
+    rows = get_known_encodings()
+    ids = [face_id for face_id, _, _ in rows]
+    vectors = as_matrix([decode_encoding(blob) for _, _, blob in rows]) if rows else np.empty((0, ENCODING_DIM))
+
+    index = IVFIndex(n_lists=args.lists, n_probe=args.probe)
+    index.build(ids, vectors)
+    path = index_path_for(args.db)
+    index.save(path)
+    print(f"[INFO] Indexed {len(index)} encodings in {len(index.list_ids)} lists -> {path}")
+
+    if len(vectors):
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.integers(0, len(vectors), args.queries)]
+        queries = sample + rng.normal(0, args.noise, sample.shape).astype(np.float32)
+        for tolerance in (0.6, 0.5):
+            print(measure_recall(index, ids, vectors, queries, tolerance))
@@ -0,0 +1,264 @@
+import argparse
+import csv
+import json
+import logging
+import multiprocessing as mp
+import multiprocessing.util
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+import face_db
+
+log = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+
+# kind is "video" (frames start..stop of source) or "images" (paths)
+Chunk = namedtuple("Chunk", ["kind", "source", "start", "stop", "paths"])
+
+# One row per face; timestamp is seconds into the video (None for stills)
+BatchRow = namedtuple("BatchRow", ["source", "frame", "timestamp", "top", "right", "bottom", "left",
+                                   "name", "distance"])
+
+
+# -----------------------
+# Planning
+# -----------------------
+def video_info(path):
+    cap = cv2.VideoCapture(path)
+    try:
+        return int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), cap.get(cv2.CAP_PROP_FPS) or 25.0
+    finally:
+        cap.release()
+
+
+def plan_video_chunks(path, stride=1, chunk_frames=None, workers=1):
+    # Frame ranges aligned to the stride; by default about four chunks per
+    # worker so a slow chunk does not leave the other workers idle at the end
+    total, _ = video_info(path)
+    if total <= 0:
+        return [Chunk("video", path, 0, None, None)]
+    if chunk_frames is None:
+        chunk_frames = max(stride, -(-total // (workers * 4)))
+    chunk_frames = max(stride, chunk_frames - chunk_frames % stride)
+    return [Chunk("video", path, start, min(start + chunk_frames, total), None)
+            for start in range(0, total, chunk_frames)]
+
+
+def list_images(directory):
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, f) for f in files if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS)
+    return sorted(paths)
+
+
+def plan_image_shards(directory, stride=1, shard_size=64):
+    paths = list_images(directory)[::stride]
+    return [Chunk("images", directory, i, i + len(paths[i:i + shard_size]), paths[i:i + shard_size])
+            for i in range(0, len(paths), shard_size)]
+
+
+def plan_chunks(inputs, stride=1, chunk_frames=None, shard_size=64, workers=1):
+    chunks = []
+    for source in inputs:
+        if os.path.isdir(source):
+            chunks.extend(plan_image_shards(source, stride, shard_size))
+        else:
+            chunks.extend(plan_video_chunks(source, stride, chunk_frames, workers))
+    return chunks
+
+
+# -----------------------
+# Workers
+# -----------------------
+_recognizer = None
+_gallery_blocks = None
+
+
+def _init_worker(db_path, gallery_spec, recognizer_kwargs):
+    # Runs once per pool process: maps the shared gallery and builds a
+    # recognizer around it
+    global _recognizer, _gallery_blocks
+    from face_multicam import attach_gallery
+    from face_recognizer import FaceRecognizerDL
+
+    face_db.DB_PATH = db_path
+    gallery, _gallery_blocks = attach_gallery(gallery_spec)
+    # A batch matches against the known faces as they were when it started;
+    # syncing would copy the shared gallery into every worker on an edit
+    recognizer_kwargs = dict(recognizer_kwargs, known_sync_interval=0)
+    _recognizer = FaceRecognizerDL([], [], gallery=gallery, **recognizer_kwargs)
+    # Pool processes skip atexit; this flushes buffered unknown rows on exit
+    mp.util.Finalize(_recognizer, _recognizer.close, exitpriority=10)
+
+
+def _ignore_alert(name, image_path):
+    pass
+
+
+def _face_rows(source, frame_number, timestamp, frame):
+    return [BatchRow(source, frame_number, timestamp, *face.box, face.name, round(float(face.distance), 4))
+            for face in _recognizer.recognize(frame, _ignore_alert)]
+
+
+def process_chunk(chunk, stride=1):
+    rows = []
+    frames = 0
+    if chunk.kind == "images":
+        for index, path in zip(range(chunk.start, chunk.stop), chunk.paths):
+            frame = cv2.imread(path)
+            if frame is None:
+                log.warning("Could not read %s", path)
+                continue
+            rows.extend(_face_rows(path, index, None, frame))
+            frames += 1
+        return chunk, rows, frames
+
+    cap = cv2.VideoCapture(chunk.source)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    if chunk.start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, chunk.start)
+    position = chunk.start
+    try:
+        while chunk.stop is None or position < chunk.stop:
+            # Skipped frames are only grabbed, not decoded
+            if (position - chunk.start) % stride:
+                if not cap.grab():
+                    break
+                position += 1
+                continue
+            ret, frame = cap.read()
+            if not ret:
+                break
+            rows.extend(_face_rows(chunk.source, position, round(position / fps, 3), frame))
+            frames += 1
+            position += 1
+    finally:
+        cap.release()
+    return chunk, rows, frames
+
+
+# -----------------------
+# Output
+# -----------------------
+class CsvResultWriter:
+    def __init__(self, f):
+        self.f = f
+        self.writer = csv.writer(f)
+        self.writer.writerow(BatchRow._fields)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.f.flush()
+
+
+class JsonlResultWriter:
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, rows):
+        for row in rows:
+            self.f.write(json.dumps(row._asdict()) + "\n")
+        self.f.flush()
+
+
+def open_result_writer(path):
+    # Format follows the extension; "-" streams JSON lines to stdout
+    if path == "-":
+        return JsonlResultWriter(sys.stdout), None
+    f = open(path, "w", newline="", encoding="utf-8")
+    if path.lower().endswith(".csv"):
+        return CsvResultWriter(f), f
+    return JsonlResultWriter(f), f
+
+
+# -----------------------
+# Driver
+# -----------------------
+def run_batch(inputs, out="-", workers=None, stride=1, chunk_frames=None, shard_size=64,
+              names=None, known_only=False, recognizer_kwargs=None):
+    # Results are written as chunks finish, so rows from different chunks
+    # interleave; sort on (source, frame) afterwards if order matters
+    from face_multicam import load_gallery_arrays, publish_gallery
+
+    workers = workers or os.cpu_count() or 1
+    chunks = plan_chunks(inputs, stride, chunk_frames, shard_size, workers)
+    # Tracking needs consecutive frames, so every sampled frame is detected
+    recognizer_kwargs = dict({"unknown_dir": "unknown_faces", "record_unknowns": False},
+                             **(recognizer_kwargs or {}))
+    recognizer_kwargs["tracking"] = False
+
+    # One BLAS/OpenMP thread per process; the pool provides the parallelism
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(var, "1")
+
+    blocks, gallery_spec = publish_gallery(load_gallery_arrays())
+    writer, f = open_result_writer(out)
+    stats = {"chunks": len(chunks), "frames": 0, "faces": 0, "rows": 0}
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(workers, mp_context=mp.get_context("spawn"), initializer=_init_worker,
+                                 initargs=(face_db.DB_PATH, gallery_spec, recognizer_kwargs)) as pool:
+            futures = [pool.submit(process_chunk, chunk, 1 if chunk.kind == "images" else stride)
+                       for chunk in chunks]
+            for done, future in enumerate(as_completed(futures), 1):
+                chunk, rows, frames = future.result()
+                stats["frames"] += frames
+                stats["faces"] += len(rows)
+                if known_only:
+                    rows = [r for r in rows if r.name != "Unknown"]
+                if names:
+                    rows = [r for r in rows if r.name in names]
+                writer.write(rows)
+                stats["rows"] += len(rows)
+                log.info("Chunk %d/%d done: %s [%s:%s] %d frames, %d rows",
+                         done, len(chunks), chunk.source, chunk.start, chunk.stop, frames, len(rows))
+    finally:
+        if f is not None:
+            f.close()
+        for block in blocks:
+            block.close()
+    stats["seconds"] = round(time.perf_counter() - start, 2)
+    stats["fps"] = round(stats["frames"] / stats["seconds"], 2) if stats["seconds"] else 0.0
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search video files and image folders for known faces.")
+    parser.add_argument("inputs", nargs="+", help="video files and/or image directories")
+    parser.add_argument("-o", "--out", default="-", help="output .csv or .jsonl file (default: JSON lines on stdout)")
+    parser.add_argument("--db", default=face_db.DB_PATH)
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--stride", type=int, default=1, help="process every Nth frame / image")
+    parser.add_argument("--chunk-frames", type=int, default=None, help="frames per video chunk")
+    parser.add_argument("--shard-size", type=int, default=64, help="images per shard")
+    parser.add_argument("--name", action="append", dest="names", help="only report this identity (repeatable)")
+    parser.add_argument("--known-only", action="store_true", help="drop Unknown faces from the output")
+    parser.add_argument("--tolerance", type=float, default=0.6)
+    parser.add_argument("--detection-scale", type=float, default=1.0)
+    parser.add_argument("--detection-model", default="hog", choices=("hog", "cnn"))
+    parser.add_argument("--record-unknowns", action="store_true",
+                        help="save unknown faces to the database as the live pipeline does")
+    parser.add_argument("--unknown-dir", default="unknown_faces")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s", stream=sys.stderr)
+    face_db.DB_PATH = args.db
+    face_db.init_db()
+    stats = run_batch(
+        args.inputs, args.out, args.workers, max(1, args.stride), args.chunk_frames, args.shard_size,
+        names=set(args.names) if args.names else None, known_only=args.known_only,
+        recognizer_kwargs={"unknown_dir": args.unknown_dir, "tolerance": args.tolerance,
+                           "detection_scale": args.detection_scale, "detection_model": args.detection_model,
+                           "record_unknowns": args.record_unknowns},
+    )
+    log.info("Done: %s", json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
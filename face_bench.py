@@ -0,0 +1,296 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import cv2
+import face_recognition
+import numpy as np
+
+import face_db
+from face_gallery import ENCODING_DIM, KnownGallery, UnknownGallery
+from face_recognizer import FaceResult, draw_results
+
+# Per-stage timings of the recognition hot path on synthetic data. Results
+# are written as JSON; --compare prints the change against an earlier report
+# and exits non-zero if a stage got slower than --threshold allows.
+
+
+def random_encodings(n, rng, chunk=100000):
+    # Unit-length float32 rows, generated in chunks to bound peak memory
+    out = np.empty((n, ENCODING_DIM), dtype=np.float32)
+    for start in range(0, n, chunk):
+        block = rng.standard_normal((min(chunk, n - start), ENCODING_DIM), dtype=np.float32)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        out[start:start + len(block)] = block
+    return out
+
+
+def synthetic_gallery(size, rng, faces_per_person=5, spread=None):
+    # With spread, each identity's samples scatter around its own centre
+    # (like real enrollments) instead of being unrelated random rows
+    matrix = random_encodings(size, rng)
+    if spread is not None:
+        centres = random_encodings(-(-size // faces_per_person), rng) * 0.6
+        matrix *= spread
+        matrix += np.repeat(centres, faces_per_person, axis=0)[:size]
+    ids = np.arange(1, size + 1, dtype=np.int64)
+    label_ids = np.arange(size, dtype=np.int64) // faces_per_person
+    labels = [f"person_{i}" for i in range(int(label_ids[-1]) + 1 if size else 0)]
+    return KnownGallery.from_arrays(ids, label_ids, labels, matrix)
+
+
+def synthetic_frame(height, width, n_faces, rng):
+    # Noise plus bright face-sized blocks; boxes in (top, right, bottom, left)
+    frame = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    side = min(height, width) // 5
+    boxes = []
+    for i in range(n_faces):
+        top = (i * side) % max(1, height - side)
+        left = (i * 2 * side) % max(1, width - side)
+        frame[top:top + side, left:left + side] = 200
+        boxes.append((top, left + side, top + side, left))
+    return frame, boxes
+
+
+def time_stage(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(stage, samples, gallery_size=None, **extra):
+    ms = np.asarray(samples) * 1000.0
+    record = {
+        "stage": stage,
+        "gallery_size": gallery_size,
+        "repeat": len(samples),
+        "median_ms": round(float(np.median(ms)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "mean_ms": round(float(ms.mean()), 4),
+        "min_ms": round(float(ms.min()), 4),
+    }
+    record.update(extra)
+    return record
+
+
+def bench_frame_stages(args, rng):
+    frame, boxes = synthetic_frame(args.height, args.width, args.faces, rng)
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    results = []
+
+    results.append(summarize("bgr_to_rgb", time_stage(lambda: cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), args.repeat)))
+
+    # Detection and encoding are far slower than the rest; fewer repeats
+    slow_repeat = max(3, args.repeat // 10)
+    for scale in args.detection_scales:
+        small = rgb if scale >= 1.0 else cv2.resize(rgb, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        samples = time_stage(lambda: face_recognition.face_locations(small, 1, "hog"), slow_repeat)
+        results.append(summarize("hog_detect", samples, scale=scale))
+    samples = time_stage(lambda: face_recognition.face_encodings(rgb, boxes), slow_repeat)
+    results.append(summarize("encode", samples, faces=len(boxes)))
+
+    faces = [FaceResult(box, "person_0", 0.4, None) for box in boxes]
+    canvas = frame.copy()
+    results.append(summarize("draw_overlay", time_stage(lambda: draw_results(canvas, faces), args.repeat),
+                             faces=len(faces)))
+    return results
+
+
+def bench_known_match(args, rng, size):
+    gallery = synthetic_gallery(size, rng, args.faces_per_person)
+    # Queries near existing rows, so voting sees real matches
+    picks = rng.integers(0, size, args.faces)
+    queries = gallery.matrix[picks] + rng.normal(0, 0.02, (args.faces, ENCODING_DIM)).astype(np.float32)
+    repeat = max(3, args.repeat // max(1, size // 10000))
+    results = [summarize("known_match", time_stage(lambda: gallery.match(queries, 0.6, 5), repeat),
+                         gallery_size=size, faces=args.faces)]
+
+    if args.ann and size >= 1000:
+        from face_ann import IVFIndex
+        index = IVFIndex(n_probe=args.ann_probe)
+        start = time.perf_counter()
+        index.build(gallery.ids, gallery.matrix)
+        build_s = time.perf_counter() - start
+        gallery.index = index
+        results.append(summarize("known_match_ann", time_stage(lambda: gallery.match(queries, 0.6, 5), repeat),
+                                 gallery_size=size, faces=args.faces, probe=args.ann_probe,
+                                 build_s=round(build_s, 3)))
+        gallery.index = None
+
+    if args.quantized:
+        from face_quant import QuantizedIndex
+        index = QuantizedIndex()
+        start = time.perf_counter()
+        index.build(gallery.ids, gallery.matrix)
+        build_s = time.perf_counter() - start
+        gallery.index = index
+        results.append(summarize("known_match_q8", time_stage(lambda: gallery.match(queries, 0.6, 5), repeat),
+                                 gallery_size=size, faces=args.faces, build_s=round(build_s, 3),
+                                 index_mib=round(index.nbytes / 2**20, 2)))
+        gallery.index = None
+
+    if args.prototypes:
+        # Prototypes only pay off when samples cluster per identity, so this
+        # pair of stages runs on a gallery where they do
+        from face_prototypes import IdentityPrototypes
+        gallery = synthetic_gallery(size, rng, args.faces_per_person, spread=0.1)
+        queries = gallery.matrix[picks] + rng.normal(0, 0.02, (args.faces, ENCODING_DIM)).astype(np.float32)
+        results.append(summarize("known_match_clustered",
+                                 time_stage(lambda: gallery.match(queries, 0.6, 5), repeat),
+                                 gallery_size=size, faces=args.faces))
+        gallery.prototypes = IdentityPrototypes(args.prototypes)
+        start = time.perf_counter()
+        gallery.match(queries[:1])
+        build_s = time.perf_counter() - start
+        results.append(summarize("known_match_proto", time_stage(lambda: gallery.match(queries, 0.6, 5), repeat),
+                                 gallery_size=size, faces=args.faces, prototypes=args.prototypes,
+                                 build_s=round(build_s, 3)))
+    return results
+
+
+def bench_unknown_lookup(args, rng):
+    unknowns = UnknownGallery(args.unknowns)
+    for face_id, encoding in enumerate(random_encodings(args.unknowns, rng), 1):
+        unknowns.add(face_id, encoding, None, float(face_id))
+    queries = random_encodings(args.faces, rng)
+    return [summarize("unknown_lookup", time_stage(lambda: unknowns.nearest(queries), args.repeat),
+                      gallery_size=args.unknowns, faces=args.faces)]
+
+
+def bench_db_insert(args, rng):
+    # Per-row transaction (insert_unknown_face) against batched writes through
+    # the write-behind buffer, on a scratch database
+    from face_write_behind import WriteBehindBuffer
+
+    blob = face_db.encode_encoding(random_encodings(1, rng)[0])
+    saved_path = face_db.DB_PATH
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        face_db.DB_PATH = os.path.join(tmp, "bench.db")
+        face_db.init_db()
+        try:
+            samples = time_stage(lambda: face_db.insert_unknown_face("bench.jpg", blob), args.db_rows)
+            results.append(summarize("db_insert", samples))
+
+            writer = WriteBehindBuffer(max_rows=args.db_rows + 1, max_delay=3600)
+            samples = time_stage(lambda: writer.add_unknown("bench.jpg", blob), args.db_rows)
+            start = time.perf_counter()
+            writer.flush()
+            flush_s = time.perf_counter() - start
+            writer.close()
+            # Enqueue cost per row plus the batch flush spread over its rows
+            per_row = [s + flush_s / len(samples) for s in samples]
+            results.append(summarize("db_insert_batched", per_row, batch=len(samples),
+                                     flush_ms=round(flush_s * 1000, 3)))
+        finally:
+            face_db.get_pool().close_all()
+            face_db.DB_PATH = saved_path
+    return results
+
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    results = bench_frame_stages(args, rng)
+    for size in args.sizes:
+        print(f"[INFO] Known gallery of {size} encodings", file=sys.stderr)
+        results.extend(bench_known_match(args, rng, size))
+    results.extend(bench_unknown_lookup(args, rng))
+    results.extend(bench_db_insert(args, rng))
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+
+
+def result_key(record):
+    extra = tuple(sorted((k, v) for k, v in record.items()
+                         if k in ("scale", "faces", "probe", "prototypes")))
+    return record["stage"], record["gallery_size"], extra
+
+
+def result_label(record):
+    label = record["stage"]
+    if record["gallery_size"]:
+        label += f" @{record['gallery_size']}"
+    if "scale" in record:
+        label += f" x{record['scale']}"
+    return label
+
+
+def compare(baseline, report, threshold, min_delta_ms=0.05):
+    # Prints median change per stage; returns the stages slower than
+    # threshold (changes under min_delta_ms are treated as noise)
+    base = {result_key(r): r for r in baseline["results"]}
+    regressions = []
+    for record in report["results"]:
+        old = base.get(result_key(record))
+        if old is None or not old["median_ms"]:
+            continue
+        ratio = record["median_ms"] / old["median_ms"]
+        flag = ""
+        if ratio > 1.0 + threshold and record["median_ms"] - old["median_ms"] > min_delta_ms:
+            flag = "  REGRESSION"
+            regressions.append(record)
+        print(f"{result_label(record):<32} {old['median_ms']:>10.3f} -> {record['median_ms']:>10.3f} ms"
+              f"  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the recognition hot path.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000],
+                        help="known gallery sizes (e.g. 1000 100000 1000000)")
+    parser.add_argument("--unknowns", type=int, default=10000, help="resident unknown gallery size")
+    parser.add_argument("--faces", type=int, default=4, help="faces per synthetic frame")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--detection-scales", type=float, nargs="+", default=[1.0, 0.5])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--db-rows", type=int, default=200)
+    parser.add_argument("--ann", action="store_true", help="also time IVF matching")
+    parser.add_argument("--ann-probe", type=int, default=8)
+    parser.add_argument("--quantized", action="store_true", help="also time matching through int8 codes")
+    parser.add_argument("--faces-per-person", type=int, default=5, help="samples per synthetic identity")
+    parser.add_argument("--prototypes", type=int, default=0, help="also time matching through N prototypes per identity")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--out", default="bench.json")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown before flagging (0.15 = 15%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="ignore slowdowns smaller than this")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[INFO] Wrote {args.out}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.threshold, args.min_delta_ms):
+            return 1
+    else:
+        for record in report["results"]:
+            print(f"{result_label(record):<32} median {record['median_ms']:>10.3f} ms  p95 {record['p95_ms']:>10.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import argparse
+import json
+import logging
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import face_db
+from face_gallery import ENCODING_DIM, as_matrix, squared_norms
+
+log = logging.getLogger(__name__)
+
+BLOCK_ROWS = 4096
+
+# ids: member unknown ids, nearest to the cluster centre first (ids[0] is
+# the representative); spread: mean member distance to the centre
+Cluster = namedtuple("Cluster", ["ids", "image_path", "spread"])
+
+
+def load_unknown_arrays():
+    # (ids, matrix, image_paths) of every unknown face
+    ids, rows, paths = [], [], []
+    for face_id, blob, image_path in face_db.iter_unknown_encodings():
+        ids.append(face_id)
+        rows.append(face_db.decode_encoding(blob))
+        paths.append(image_path)
+    matrix = as_matrix(rows) if rows else np.empty((0, ENCODING_DIM), np.float32)
+    return np.asarray(ids, dtype=np.int64), matrix, paths
+
+
+def neighbor_pairs(matrix, eps, block=BLOCK_ROWS):
+    # (i, j) index pairs with i < j and distance <= eps. Distances are
+    # computed for one block x block tile of the upper triangle at a time,
+    # so memory stays bounded however large the set is. The test
+    # |a|^2 + |b|^2 - 2 a.b <= eps^2 is rearranged to work on the GEMM output
+    # in place: a.b - |b|^2/2 >= (|a|^2 - eps^2)/2, no sqrt per pair.
+    sq = squared_norms(matrix)
+    half_sq = sq / 2
+    row_limits = (sq - eps * eps) / 2
+    left, right = [], []
+    for row in range(0, len(matrix), block):
+        queries = matrix[row:row + block]
+        limits = row_limits[row:row + block, None]
+        for col in range(row, len(matrix), block):
+            scores = queries @ matrix[col:col + block].T
+            scores -= half_sq[None, col:col + block]
+            # flatnonzero + divmod is much faster than a 2-D nonzero
+            i, j = np.divmod(np.flatnonzero(scores >= limits), scores.shape[1])
+            i += row
+            j += col
+            upper = j > i
+            left.append(i[upper].astype(np.int64))
+            right.append(j[upper].astype(np.int64))
+    if not left:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    return np.concatenate(left), np.concatenate(right)
+
+
+def connected_components(n, i, j):
+    # Union-find over an edge list, vectorized: every round hooks each
+    # edge's two roots onto the smaller one, then pointer jumping flattens
+    # the forest. Edges already inside one component drop out, so rounds get
+    # cheaper. Returns the root (smallest member index) for every node.
+    parent = np.arange(n, dtype=np.int64)
+    while len(i):
+        pi, pj = parent[i], parent[j]
+        split = pi != pj
+        if not split.any():
+            break
+        i, j, pi, pj = i[split], j[split], pi[split], pj[split]
+        low = np.minimum(pi, pj)
+        np.minimum.at(parent, pi, low)
+        np.minimum.at(parent, pj, low)
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+    return parent
+
+
+def dbscan_labels(matrix, eps, min_samples):
+    # DBSCAN on the eps-neighbour graph: core rows (at least min_samples
+    # rows within eps, counting themselves) are joined through core-core
+    # edges, border rows attach to a core neighbour, and the rest stay
+    # alone. Returns a root index per row.
+    i, j = neighbor_pairs(matrix, eps)
+    counts = 1 + np.bincount(i, minlength=len(matrix)) + np.bincount(j, minlength=len(matrix))
+    core = counts >= min_samples
+    both = core[i] & core[j]
+    labels = connected_components(len(matrix), i[both], j[both])
+
+    # Border rows take the cluster of their lowest-index core neighbour
+    border_i = np.concatenate([i[core[j] & ~core[i]], j[core[i] & ~core[j]]])
+    border_core = np.concatenate([j[core[j] & ~core[i]], i[core[i] & ~core[j]]])
+    if len(border_i):
+        order = np.lexsort((border_core, border_i))
+        border_i, border_core = border_i[order], border_core[order]
+        first = np.ones(len(border_i), dtype=bool)
+        first[1:] = border_i[1:] != border_i[:-1]
+        labels[border_i[first]] = labels[border_core[first]]
+    return labels
+
+
+def centroids_of(matrix, labels):
+    # (unique labels, centroid per label, inverse index per row)
+    uniq, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    sums = np.zeros((len(uniq), matrix.shape[1]), dtype=np.float64)
+    np.add.at(sums, inverse, matrix)
+    return uniq, (sums / counts[:, None]).astype(np.float32), inverse
+
+
+def merge_close_clusters(matrix, labels, merge_distance, min_size):
+    # Joins clusters whose centres are within merge_distance: the same
+    # person split by a gap in the graph (lighting, pose). Only clusters of
+    # at least min_size rows take part, so noise cannot bridge two people.
+    uniq, centres, inverse = centroids_of(matrix, labels)
+    sizes = np.bincount(inverse)
+    big = np.flatnonzero(sizes >= min_size)
+    if len(big) < 2:
+        return labels
+    i, j = neighbor_pairs(centres[big], merge_distance)
+    roots = connected_components(len(big), i, j)
+    mapping = uniq.copy()
+    mapping[big] = uniq[big[roots]]
+    return mapping[inverse]
+
+
+def cluster_unknowns(ids, matrix, image_paths, eps=0.4, min_samples=3, merge_distance=0.45, min_size=2):
+    # Groups unknown faces that look like the same person. Returns clusters
+    # of at least min_size rows, largest first.
+    if len(matrix) == 0:
+        return []
+    labels = dbscan_labels(matrix, eps, min_samples)
+    if merge_distance:
+        labels = merge_close_clusters(matrix, labels, merge_distance, min_size)
+
+    # Order members by distance to their cluster centre; the nearest one is
+    # the representative crop
+    uniq, centres, inverse = centroids_of(matrix, labels)
+    to_centre = np.linalg.norm(matrix - centres[inverse], axis=1)
+    order = np.lexsort((to_centre, inverse))
+    bounds = np.flatnonzero(np.diff(inverse[order])) + 1
+    clusters = []
+    for members in np.split(order, bounds):
+        if len(members) < min_size:
+            continue
+        clusters.append(Cluster([int(x) for x in ids[members]], image_paths[members[0]],
+                                float(to_centre[members].mean())))
+    clusters.sort(key=lambda c: (-len(c.ids), c.ids[0]))
+    return clusters
+
+
+def find_unknown_clusters(**kwargs):
+    start = time.perf_counter()
+    ids, matrix, image_paths = load_unknown_arrays()
+    loaded = time.perf_counter()
+    clusters = cluster_unknowns(ids, matrix, image_paths, **kwargs)
+    log.info("Clustered %d unknown faces into %d groups (load %.2fs, cluster %.2fs)",
+             len(ids), len(clusters), loaded - start, time.perf_counter() - loaded)
+    return clusters
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Group unknown faces that belong to the same person.")
+    parser.add_argument("--db", default=face_db.DB_PATH)
+    parser.add_argument("--eps", type=float, default=0.4, help="neighbour distance")
+    parser.add_argument("--min-samples", type=int, default=3, help="neighbours that make a core face")
+    parser.add_argument("--merge-distance", type=float, default=0.45, help="join clusters with centres this close")
+    parser.add_argument("--min-size", type=int, default=2)
+    parser.add_argument("--json", action="store_true", help="print clusters as JSON lines")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s", stream=sys.stderr)
+    face_db.DB_PATH = args.db
+    face_db.init_db()
+    clusters = find_unknown_clusters(eps=args.eps, min_samples=args.min_samples,
+                                     merge_distance=args.merge_distance, min_size=args.min_size)
+    for cluster in clusters:
+        if args.json:
+            print(json.dumps(cluster._asdict()))
+        else:
+            print(f"{len(cluster.ids):>5} faces  spread {cluster.spread:.3f}  {cluster.image_path}  ids {cluster.ids[:10]}")
+
+
+if __name__ == "__main__":
+    main()
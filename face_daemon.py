@@ -0,0 +1,231 @@
+import argparse
+import json
+import logging
+import signal
+import sys
+import threading
+import time
+
+import face_db
+from face_alerts import AlertDispatcher, LogFileSink, LoggingSink, WebhookSink
+from face_db import init_db
+from face_metrics import Metrics, MetricsDumper, MetricsServer
+
+log = logging.getLogger("face_daemon")
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line; fields passed with extra={...} are merged in
+    FIELDS = ("alert", "stats", "camera", "source", "faces")
+
+    def format(self, record):
+        data = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in self.FIELDS:
+            if hasattr(record, field):
+                data[field] = getattr(record, field)
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+def setup_logging(level="INFO", json_logs=True):
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if json_logs else logging.Formatter("[%(levelname)s] %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+
+def build_alert_dispatcher(args):
+    sinks = [LoggingSink(log)]
+    if args.alert_log:
+        sinks.append(LogFileSink(args.alert_log))
+    if args.webhook:
+        sinks.append(WebhookSink(args.webhook))
+    return AlertDispatcher(sinks, cooldown=args.cooldown).start()
+
+
+def recognizer_options(args):
+    return dict(
+        cooldown_second=args.cooldown,
+        tolerance=args.tolerance,
+        unknown_tolerance=args.unknown_tolerance,
+        use_ann=args.ann,
+        use_quantized=args.quantized,
+        use_prototypes=args.prototypes,
+        use_snapshot=args.snapshot,
+        detection_scale=args.detection_scale,
+        detection_model=args.detection_model,
+        tracking=args.tracking,
+        detect_every=args.detect_every,
+    )
+
+
+def run_single(args, stop_event, alerts, metrics):
+    # One source: capture and recognition threads in this process
+    from face_recognizer import FaceRecognizerDL
+    from face_worker import FrameGrabber, RecognitionWorker
+
+    recognizer = FaceRecognizerDL([], [], args.unknown_dir, metrics=metrics, **recognizer_options(args))
+    grabber = FrameGrabber(args.sources[0], loop=args.loop)
+    worker = RecognitionWorker(recognizer, alerts)
+    grabber.start()
+    worker.start()
+    metrics.gauge("capture_dropped", lambda: grabber.frames.dropped)
+    metrics.gauge("recognition_dropped", lambda: worker.dropped)
+    log.info("Started", extra={"source": str(args.sources[0])})
+
+    next_stats = time.monotonic() + args.stats_interval
+    last_processed = 0
+    last_seq = 0
+    try:
+        while not stop_event.is_set() and not grabber.finished.is_set():
+            captured = grabber.frames.take(timeout=0.1)[0]
+            if captured is not None:
+                frame_time, frame = captured
+                worker.submit(frame, frame_time)
+
+            faces, seq, frame_time = worker.results()
+            if seq != last_seq:
+                last_seq = seq
+                if faces:
+                    log.debug("Recognized", extra={"faces": [
+                        {"name": f.name, "distance": round(float(f.distance), 4), "box": list(f.box)} for f in faces]})
+
+            now = time.monotonic()
+            if args.stats_interval and now >= next_stats:
+                log.info("Stats", extra={"stats": {
+                    "fps": round((worker.processed - last_processed) / args.stats_interval, 2),
+                    "processed": worker.processed,
+                    "frames_dropped": worker.dropped + grabber.frames.dropped,
+                    "last_recognition_ms": round(worker.last_duration * 1000, 1),
+                    "unknown_rows_pending": recognizer.writer.pending(),
+                    "alert_queues": alerts.queue_depths(),
+                    "stages": metrics.snapshot()["stages"],
+                }})
+                last_processed = worker.processed
+                next_stats = now + args.stats_interval
+    finally:
+        worker.stop()
+        grabber.stop()
+        worker.join(timeout=5)
+        grabber.join(timeout=5)
+        recognizer.close()
+
+
+def run_multi(args, stop_event, alerts, metrics):
+    # Several sources: one worker process per stream. Stage timings stay
+    # inside the camera processes; only the manager's own numbers are exported
+    from face_multicam import MultiCameraManager
+
+    manager = MultiCameraManager(args.sources, unknown_dir=args.unknown_dir, loop_files=args.loop,
+                                 recognizer_kwargs=recognizer_options(args))
+    manager.start()
+    for index, source in enumerate(args.sources):
+        log.info("Started", extra={"camera": index, "source": str(source)})
+
+    reported_dead = set()
+    metrics.gauge("cameras_alive", lambda: len(args.sources) - len(reported_dead))
+    next_stats = time.monotonic() + args.stats_interval
+    try:
+        while not stop_event.wait(0.1):
+            for camera, _, name, image_path in manager.drain_alerts():
+                alerts(name, image_path, camera=camera)
+
+            for index in range(len(args.sources)):
+                if index not in reported_dead and not manager.is_alive(index):
+                    reported_dead.add(index)
+                    log.error("Camera process exited", extra={"camera": index, "source": str(args.sources[index])})
+            if len(reported_dead) == len(args.sources):
+                break
+
+            now = time.monotonic()
+            if args.stats_interval and now >= next_stats:
+                log.info("Stats", extra={"stats": {
+                    "cameras_alive": len(args.sources) - len(reported_dead),
+                    "alert_queues": alerts.queue_depths(),
+                }})
+                next_stats = now + args.stats_interval
+    finally:
+        manager.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless face recognition: capture, recognize and alert.")
+    parser.add_argument("sources", nargs="*", default=["0"],
+                        help="camera index, video file or stream URL (default: camera 0)")
+    parser.add_argument("--db", default=face_db.DB_PATH)
+    parser.add_argument("--unknown-dir", default="unknown_faces")
+    parser.add_argument("--tolerance", type=float, default=0.6)
+    parser.add_argument("--unknown-tolerance", type=float, default=0.5)
+    parser.add_argument("--cooldown", type=float, default=60, help="seconds between repeat alerts for a face")
+    parser.add_argument("--ann", action="store_true", help="match through the IVF index")
+    parser.add_argument("--quantized", action="store_true", help="scan int8 codes, re-rank with exact vectors")
+    parser.add_argument("--prototypes", action="store_true",
+                        help="match identities through a few prototypes each (nearest identity wins)")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="memory-map known encodings from a snapshot file instead of loading them from the database")
+    parser.add_argument("--detection-scale", type=float, default=1.0)
+    parser.add_argument("--detection-model", default="hog", choices=("hog", "cnn"))
+    parser.add_argument("--tracking", action="store_true")
+    parser.add_argument("--detect-every", type=int, default=5)
+    parser.add_argument("--loop", action="store_true", help="loop video files instead of exiting at the end")
+    parser.add_argument("--alert-log", help="append alerts as JSON lines to this file")
+    parser.add_argument("--webhook", help="POST alert batches to this URL")
+    parser.add_argument("--stats-interval", type=float, default=30.0, help="seconds between stats records (0 = off)")
+    parser.add_argument("--metrics", action="store_true", help="collect per-stage timings")
+    parser.add_argument("--metrics-port", type=int, help="serve metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-dump", help="rewrite this JSON file with the metrics every --stats-interval")
+    parser.add_argument("--log-level", default="INFO")
+    parser.add_argument("--plain-logs", action="store_true", help="human-readable logs instead of JSON")
+    args = parser.parse_args(argv)
+
+    setup_logging(args.log_level.upper(), json_logs=not args.plain_logs)
+    face_db.DB_PATH = args.db
+    init_db()
+
+    # SIGINT/SIGTERM only set the event; the loops notice it and everything
+    # is flushed and closed on the way out
+    stop_event = threading.Event()
+
+    def request_stop(signum, _frame):
+        log.info("Stopping on %s", signal.Signals(signum).name)
+        stop_event.set()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, request_stop)
+
+    metrics = Metrics(enabled=bool(args.metrics or args.metrics_port or args.metrics_dump))
+    server = MetricsServer(metrics, port=args.metrics_port).start() if args.metrics_port else None
+    dumper = MetricsDumper(metrics, args.metrics_dump, args.stats_interval or 10.0) if args.metrics_dump else None
+    if dumper:
+        dumper.start()
+
+    alerts = build_alert_dispatcher(args)
+    metrics.gauge("alert_queues", alerts.queue_depths)
+    try:
+        if len(args.sources) > 1:
+            run_multi(args, stop_event, alerts, metrics)
+        else:
+            run_single(args, stop_event, alerts, metrics)
+    except Exception:
+        log.exception("Daemon failed")
+        return 1
+    finally:
+        alerts.stop()
+        if server:
+            server.stop()
+        if dumper:
+            dumper.stop()
+        face_db.get_pool().close_all()
+        log.info("Stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,39 +1,563 @@
+import pickle
 import sqlite3
+import struct
+import threading
+import weakref
+from contextlib import contextmanager
 from datetime import datetime
 
+import numpy as np
+
 DB_PATH = "face_records.db"
 
+# Rows of known_faces_changes kept by prune_known_changes
+KNOWN_CHANGES_KEPT = 10000
+
+# Encoding BLOB format, version 1:
+#   magic "FENC" | version (u8) | dtype code (char) | dimension (u16) | raw little-endian values
+# Older rows hold pickled ndarrays; decode_encoding reads both.
+ENCODING_MAGIC = b"FENC"
+ENCODING_VERSION = 1
+_ENCODING_HEADER = struct.Struct("<4sBcH")
+_ENCODING_DTYPES = {b"f": np.dtype("<f4"), b"d": np.dtype("<f8")}
+_ENCODING_CODES = {dtype: code for code, dtype in _ENCODING_DTYPES.items()}
+
+def encode_encoding(encoding, dtype=np.float32):
+    values = np.ascontiguousarray(encoding, dtype=np.dtype(dtype).newbyteorder("<")).ravel()
+    header = _ENCODING_HEADER.pack(ENCODING_MAGIC, ENCODING_VERSION,
+                                   _ENCODING_CODES[values.dtype], values.size)
+    return header + values.tobytes()
+
+def is_legacy_encoding(blob):
+    return bytes(blob[:len(ENCODING_MAGIC)]) != ENCODING_MAGIC
+
+def decode_encoding(blob):
+    if is_legacy_encoding(blob):
+        return pickle.loads(blob)
+    magic, version, code, dim = _ENCODING_HEADER.unpack_from(blob)
+    if version != ENCODING_VERSION or code not in _ENCODING_DTYPES:
+        raise ValueError(f"Unsupported encoding format (version {version}, dtype {code!r})")
+    # Read-only view over the BLOB, no copy
+    return np.frombuffer(blob, dtype=_ENCODING_DTYPES[code], count=dim, offset=_ENCODING_HEADER.size)
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA foreign_keys=ON",
+)
+
+def _open_connection(db_path, check_same_thread=True):
+    # isolation_level=None: reads never hold a transaction open; writes go
+    # through explicit BEGIN IMMEDIATE blocks (see ConnectionPool.transaction).
+    conn = sqlite3.connect(db_path, timeout=30.0, isolation_level=None,
+                           check_same_thread=check_same_thread, cached_statements=256)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
 def connect_db():
-    conn = sqlite3.connect(DB_PATH)
+    # Standalone connection for scripts; the app itself goes through the pool
+    conn = _open_connection(DB_PATH)
+    conn.isolation_level = ""
     return conn
 
+
+class _ThreadConnection:
+    # Held only by the pool's thread-local, so it is dropped when its thread
+    # exits and its finalizer closes the connection
+    def __init__(self, conn):
+        self.conn = conn
+
+
+class ConnectionPool:
+    # One long-lived connection per thread. With WAL, the recognizer thread
+    # and the GUI can read while the other writes. A thread's connection is
+    # closed when the thread exits, or earlier by release().
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def connection(self):
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            conn = _open_connection(self.db_path, check_same_thread=False)
+            holder = self._local.holder = _ThreadConnection(conn)
+            weakref.finalize(holder, self._close, conn)
+            with self._lock:
+                self._connections.append(conn)
+        return holder.conn
+
+    def _close(self, conn):
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+
+    def release(self):
+        # Closes the calling thread's connection, e.g. at the end of a job on
+        # a reused pool thread; the next query opens a new one
+        holder = getattr(self._local, "holder", None)
+        if holder is not None:
+            del self._local.holder
+            self._close(holder.conn)
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.db_path != DB_PATH:
+            # Connections to the previous database are not reused
+            if _pool is not None:
+                _pool.close_all()
+            _pool = ConnectionPool(DB_PATH)
+        return _pool
+
+
 def init_db():
-    conn = connect_db()
-    c = conn.cursor()
-
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS known_faces (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            contact TEXT,
-            age TEXT,
-            gender TEXT,
-            address TEXT,
-            occupation TEXT,
-            image_path TEXT,
-            encoding BLOB NOT NULL,
-            date_added TEXT NOT NULL
-        )
-    ''')
+    with get_pool().transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS known_faces (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                contact TEXT,
+                age TEXT,
+                gender TEXT,
+                address TEXT,
+                occupation TEXT,
+                image_path TEXT,
+                encoding BLOB NOT NULL,
+                date_added TEXT NOT NULL
+            )
+        ''')
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS unknown_faces (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                image_path TEXT NOT NULL,
+                encoding BLOB NOT NULL,
+                date_detected TEXT NOT NULL
+            )
+        ''')
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS unknown_sightings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                unknown_id INTEGER NOT NULL,
+                seen_at TEXT NOT NULL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_unknown_sightings_unknown ON unknown_sightings (unknown_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_unknown_faces_detected ON unknown_faces (date_detected, id)")
+        # Crops are content-addressed, so rows can share one; these back the
+        # check before a crop is deleted (see image_in_use)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_unknown_faces_image ON unknown_faces (image_path)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_known_faces_image ON known_faces (image_path)")
 
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS unknown_faces (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            image_path TEXT NOT NULL,
-            encoding BLOB NOT NULL,
-            date_detected TEXT NOT NULL
-        )
+        # Encodings of enrolled image files by content hash, so bulk
+        # enrollment never encodes the same picture twice. error is set
+        # (and encoding NULL) for images without a usable face; known_id
+        # is the known_faces row made from the image, if any.
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS encoding_cache (
+                content_hash TEXT PRIMARY KEY,
+                encoding BLOB,
+                error TEXT,
+                known_id INTEGER,
+                created TEXT NOT NULL
+            )
+        ''')
+
+        # Change log for known_faces, kept by triggers so every writer (GUI,
+        # scripts, other processes) is covered. Recognizers remember the
+        # last version they applied and fetch only newer changes.
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS known_faces_changes (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                face_id INTEGER NOT NULL,
+                op TEXT NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS known_faces_log_insert AFTER INSERT ON known_faces
+            BEGIN
+                INSERT INTO known_faces_changes (face_id, op) VALUES (NEW.id, 'I');
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS known_faces_log_update AFTER UPDATE OF name, encoding ON known_faces
+            BEGIN
+                INSERT INTO known_faces_changes (face_id, op) VALUES (NEW.id, 'U');
+            END
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_known_faces_name ON known_faces (name COLLATE NOCASE, id)")
+        _init_known_search(conn)
+
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS known_faces_log_delete AFTER DELETE ON known_faces
+            BEGIN
+                INSERT INTO known_faces_changes (face_id, op) VALUES (OLD.id, 'D');
+            END
+        ''')
+        # Highest version dropped by prune_known_changes; readers behind it
+        # reload instead of replaying
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS known_faces_changes_pruned (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        ''')
+    # The change log only has to cover running recognizers, which poll it
+    # every few seconds; it is trimmed on every start
+    prune_known_changes()
+
+SEARCH_COLUMNS = ("name", "contact", "occupation")
+
+def _init_known_search(conn):
+    # Full-text index over SEARCH_COLUMNS as an external-content FTS5 table
+    # kept in step by triggers. Builds without FTS5 fall back to LIKE.
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'known_faces_fts'").fetchone()
+    if exists:
+        return
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE known_faces_fts USING fts5(
+                name, contact, occupation,
+                content='known_faces', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2')
+        """)
+    except sqlite3.OperationalError:
+        return
+    conn.execute("INSERT INTO known_faces_fts (known_faces_fts) VALUES ('rebuild')")
+    conn.execute('''
+        CREATE TRIGGER known_faces_fts_insert AFTER INSERT ON known_faces BEGIN
+            INSERT INTO known_faces_fts (rowid, name, contact, occupation)
+            VALUES (NEW.id, NEW.name, NEW.contact, NEW.occupation);
+        END
     ''')
+    conn.execute('''
+        CREATE TRIGGER known_faces_fts_delete AFTER DELETE ON known_faces BEGIN
+            INSERT INTO known_faces_fts (known_faces_fts, rowid, name, contact, occupation)
+            VALUES ('delete', OLD.id, OLD.name, OLD.contact, OLD.occupation);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER known_faces_fts_update AFTER UPDATE OF name, contact, occupation ON known_faces BEGIN
+            INSERT INTO known_faces_fts (known_faces_fts, rowid, name, contact, occupation)
+            VALUES ('delete', OLD.id, OLD.name, OLD.contact, OLD.occupation);
+            INSERT INTO known_faces_fts (rowid, name, contact, occupation)
+            VALUES (NEW.id, NEW.name, NEW.contact, NEW.occupation);
+        END
+    ''')
+
+def _has_known_search(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'known_faces_fts'").fetchone() is not None
+
+def _fts_query(text):
+    # Every word must match as a prefix: 'jo sm' -> "jo"* AND "sm"*
+    return " ".join(f'"{w}"*' for w in text.split())
+
+def _known_search_sql(conn, text, columns):
+    # (sql, params) selecting columns of the known faces matching text
+    text = (text or "").replace('"', " ").strip()
+    if not text:
+        return f"SELECT {columns} FROM known_faces k ORDER BY k.name COLLATE NOCASE, k.id", ()
+    if _has_known_search(conn):
+        return (f"SELECT {columns} FROM known_faces_fts f JOIN known_faces k ON k.id = f.rowid "
+                "WHERE known_faces_fts MATCH ? ORDER BY f.rank, k.id", (_fts_query(text),))
+    like = f"%{text}%"
+    where = " OR ".join(f"k.{c} LIKE ?" for c in SEARCH_COLUMNS)
+    return (f"SELECT {columns} FROM known_faces k WHERE {where} ORDER BY k.name COLLATE NOCASE, k.id",
+            (like,) * len(SEARCH_COLUMNS))
+
+# -----------------------
+# Repository API
+# -----------------------
+def get_known_encodings():
+    return get_pool().connection().execute(
+        "SELECT id, name, encoding FROM known_faces").fetchall()
+
+def iter_known_labels():
+    # (id, name) of every known face, without the encodings, streamed from one cursor
+    return get_pool().connection().execute("SELECT id, name FROM known_faces")
+
+def list_known_faces():
+    return get_pool().connection().execute(
+        "SELECT id, name, contact, occupation, image_path FROM known_faces").fetchall()
+
+def search_known_faces(text, limit=200, offset=0):
+    # Page of (id, name, contact, occupation, image_path); best matches
+    # first, or alphabetical when text is empty
+    conn = get_pool().connection()
+    sql, params = _known_search_sql(conn, text, "k.id, k.name, k.contact, k.occupation, k.image_path")
+    return conn.execute(f"{sql} LIMIT ? OFFSET ?", params + (limit, offset)).fetchall()
+
+def count_known_faces(text=""):
+    conn = get_pool().connection()
+    sql, params = _known_search_sql(conn, text, "1")
+    return conn.execute(f"SELECT COUNT(*) FROM ({sql})", params).fetchone()[0]
+
+def get_known_face(face_id):
+    return get_pool().connection().execute(
+        "SELECT name, contact, occupation, image_path FROM known_faces WHERE id = ?",
+        (face_id,)).fetchone()
+
+KNOWN_DETAIL_FIELDS = ("contact", "age", "gender", "address", "occupation", "image_path")
+
+def _known_details(details):
+    unexpected = set(details) - set(KNOWN_DETAIL_FIELDS)
+    if unexpected:
+        raise TypeError(f"Unknown known_faces fields: {sorted(unexpected)}")
+    return {field: details.get(field) for field in KNOWN_DETAIL_FIELDS}
+
+def insert_known_face(name, encoding_blob, **details):
+    with get_pool().transaction() as conn:
+        return _insert_known_face(conn, name, encoding_blob, **_known_details(details))
+
+def _insert_known_face(conn, name, encoding_blob, contact, age, gender, address, occupation, image_path):
+    cursor = conn.execute("""
+        INSERT INTO known_faces (name, contact, age, gender, address, occupation, image_path, encoding, date_added)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (name, contact, age, gender, address, occupation, image_path, encoding_blob,
+          datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    return cursor.lastrowid
+
+def get_cached_encodings(content_hashes, chunk=500):
+    # {content_hash: (encoding, error, enrolled)}; enrolled is True while the
+    # known_faces row made from the image still exists
+    conn = get_pool().connection()
+    cached = {}
+    content_hashes = list(content_hashes)
+    for start in range(0, len(content_hashes), chunk):
+        part = content_hashes[start:start + chunk]
+        rows = conn.execute(f"""
+            SELECT c.content_hash, c.encoding, c.error, k.id IS NOT NULL
+            FROM encoding_cache c LEFT JOIN known_faces k ON k.id = c.known_id
+            WHERE c.content_hash IN ({",".join("?" * len(part))})
+        """, part).fetchall()
+        cached.update((h, (blob, error, bool(enrolled))) for h, blob, error, enrolled in rows)
+    return cached
+
+def cache_encoding_failures(failures):
+    # failures: (content_hash, error) rows
+    now = datetime.now().isoformat()
+    with get_pool().transaction() as conn:
+        conn.executemany("""
+            INSERT INTO encoding_cache (content_hash, encoding, error, created) VALUES (?, NULL, ?, ?)
+            ON CONFLICT (content_hash) DO UPDATE SET encoding = NULL, error = excluded.error
+        """, [(h, error, now) for h, error in failures])
+
+def enroll_known_faces(rows):
+    # rows: (content_hash, name, encoding_blob, details) with details as for
+    # insert_known_face. Inserts the known faces and records them in
+    # encoding_cache in one transaction; returns the new known ids.
+    now = datetime.now().isoformat()
+    known_ids = []
+    with get_pool().transaction() as conn:
+        for content_hash, name, encoding_blob, details in rows:
+            known_id = _insert_known_face(conn, name, encoding_blob, **_known_details(details))
+            conn.execute("""
+                INSERT INTO encoding_cache (content_hash, encoding, error, known_id, created) VALUES (?, ?, NULL, ?, ?)
+                ON CONFLICT (content_hash) DO UPDATE SET
+                    encoding = excluded.encoding, error = NULL, known_id = excluded.known_id
+            """, (content_hash, encoding_blob, known_id, now))
+            known_ids.append(known_id)
+    return known_ids
+
+def update_known_face(face_id, name, contact, occupation):
+    with get_pool().transaction() as conn:
+        conn.execute("UPDATE known_faces SET name = ?, contact = ?, occupation = ? WHERE id = ?",
+                     (name, contact, occupation, face_id))
+
+def delete_known_face(face_id):
+    with get_pool().transaction() as conn:
+        conn.execute("DELETE FROM known_faces WHERE id = ?", (face_id,))
+
+def get_known_version():
+    return get_pool().connection().execute(
+        "SELECT COALESCE(MAX(version), 0) FROM known_faces_changes").fetchone()[0]
+
+def get_known_changes(since_version):
+    # Net effect of every change after since_version, one row per face:
+    # (face_id, version, name, encoding), name/encoding None if the face is
+    # gone. Rows are read as they are now, so replaying is idempotent.
+    # None when changes after since_version were pruned: reload everything.
+    conn = get_pool().connection()
+    changes = conn.execute("""
+        SELECT c.face_id, MAX(c.version), k.name, k.encoding
+        FROM known_faces_changes c LEFT JOIN known_faces k ON k.id = c.face_id
+        WHERE c.version > ?
+        GROUP BY c.face_id
+        ORDER BY MAX(c.version)
+    """, (since_version,)).fetchall()
+    # Checked after the read, so a prune racing with it is noticed
+    pruned = conn.execute("SELECT version FROM known_faces_changes_pruned").fetchone()
+    if pruned is not None and since_version < pruned[0]:
+        return None
+    return changes
+
+def prune_known_changes(keep=KNOWN_CHANGES_KEPT):
+    # Drops all but the newest keep rows of the change log; one always
+    # stays, so get_known_version never goes back. Returns the count.
+    with get_pool().transaction() as conn:
+        cutoff = conn.execute("SELECT version FROM known_faces_changes ORDER BY version DESC LIMIT 1 OFFSET ?",
+                              (max(1, keep),)).fetchone()
+        if cutoff is None:
+            return 0
+        deleted = conn.execute("DELETE FROM known_faces_changes WHERE version <= ?", cutoff).rowcount
+        conn.execute("INSERT OR REPLACE INTO known_faces_changes_pruned (id, version) VALUES (1, ?)", cutoff)
+        return deleted
+
+def get_unknown_encodings(limit=-1):
+    # Most recent first
+    return get_pool().connection().execute(
+        "SELECT id, encoding, image_path FROM unknown_faces ORDER BY id DESC LIMIT ?",
+        (limit,)).fetchall()
+
+def list_unknown_faces():
+    return get_pool().connection().execute(
+        "SELECT id, image_path, encoding FROM unknown_faces ORDER BY date_detected DESC").fetchall()
+
+def iter_unknown_encodings():
+    # (id, encoding, image_path) for every unknown row, streamed from one cursor
+    return get_pool().connection().execute(
+        "SELECT id, encoding, image_path FROM unknown_faces ORDER BY id")
+
+def count_unknown_faces():
+    return get_pool().connection().execute("SELECT COUNT(*) FROM unknown_faces").fetchone()[0]
+
+def list_unknown_page(after=None, limit=500):
+    # Newest first, without encodings. after is the (date_detected, id) of
+    # the last row of the previous page (keyset paging, no OFFSET scans).
+    conn = get_pool().connection()
+    if after is None:
+        return conn.execute(
+            "SELECT id, image_path, date_detected FROM unknown_faces "
+            "ORDER BY date_detected DESC, id DESC LIMIT ?", (limit,)).fetchall()
+    return conn.execute(
+        "SELECT id, image_path, date_detected FROM unknown_faces WHERE (date_detected, id) < (?, ?) "
+        "ORDER BY date_detected DESC, id DESC LIMIT ?", (after[0], after[1], limit)).fetchall()
+
+def get_unknown_encoding(face_id):
+    row = get_pool().connection().execute(
+        "SELECT encoding FROM unknown_faces WHERE id = ?", (face_id,)).fetchone()
+    return row[0] if row else None
+
+def get_unknown_image_path(face_id):
+    row = get_pool().connection().execute(
+        "SELECT image_path FROM unknown_faces WHERE id = ?", (face_id,)).fetchone()
+    return row[0] if row else None
+
+def insert_unknown_face(image_path, encoding_blob):
+    with get_pool().transaction() as conn:
+        cursor = conn.execute(
+            "INSERT INTO unknown_faces (image_path, encoding, date_detected) VALUES (?, ?, ?)",
+            (image_path, encoding_blob, datetime.now().isoformat()))
+        return cursor.lastrowid
+
+def reserve_unknown_ids(count):
+    # Claims a block of unknown_faces ids by advancing the AUTOINCREMENT
+    # counter, so rows can be written later (and by several processes)
+    # with ids that are already known. Returns the first id of the block.
+    with get_pool().transaction() as conn:
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'unknown_faces'").fetchone()
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM unknown_faces").fetchone()[0]
+        start = max(row[0] if row else 0, max_id) + 1
+        if row:
+            conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'unknown_faces'", (start + count - 1,))
+        else:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('unknown_faces', ?)", (start + count - 1,))
+        return start
+
+def write_unknown_batch(unknowns, sightings):
+    # unknowns: (id, image_path, encoding_blob, date_detected) rows
+    # sightings: (unknown_id, seen_at) rows
+    with get_pool().transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO unknown_faces (id, image_path, encoding, date_detected) VALUES (?, ?, ?, ?)",
+            unknowns)
+        conn.executemany("INSERT INTO unknown_sightings (unknown_id, seen_at) VALUES (?, ?)", sightings)
+
+def delete_unknown_face(face_id):
+    with get_pool().transaction() as conn:
+        conn.execute("DELETE FROM unknown_faces WHERE id = ?", (face_id,))
+        conn.execute("DELETE FROM unknown_sightings WHERE unknown_id = ?", (face_id,))
+
+def _image_in_use(conn, image_path):
+    return conn.execute(
+        "SELECT 1 FROM unknown_faces WHERE image_path = ? UNION ALL "
+        "SELECT 1 FROM known_faces WHERE image_path = ? LIMIT 1", (image_path, image_path)).fetchone() is not None
+
+def image_in_use(image_path):
+    # True while any known or unknown row still references the crop;
+    # identical crops share one file (see face_image_store)
+    return _image_in_use(get_pool().connection(), image_path)
+
+def promote_unknown_face(face_id, name, encoding_blob=None, **details):
+    # Moves an unknown row into known_faces in a single transaction and
+    # returns the new known id (None if the unknown row no longer exists).
+    # details: contact, age, gender, address, occupation, image_path; the
+    # unknown's crop is kept as image_path unless one is passed explicitly.
+    with get_pool().transaction() as conn:
+        row = conn.execute("SELECT image_path, encoding FROM unknown_faces WHERE id = ?",
+                           (face_id,)).fetchone()
+        if row is None:
+            return None
+        details.setdefault("image_path", row[0])
+        known_id = _insert_known_face(conn, name, encoding_blob or row[1], **_known_details(details))
+        conn.execute("DELETE FROM unknown_faces WHERE id = ?", (face_id,))
+        conn.execute("DELETE FROM unknown_sightings WHERE unknown_id = ?", (face_id,))
+        return known_id
 
-    conn.commit()
-    conn.close()
+def promote_unknown_cluster(face_ids, name, max_samples=None, **details):
+    # Promotes unknown rows of one person (e.g. a cluster from
+    # face_clustering) in a single transaction. The first max_samples rows
+    # still present become known encodings, each keeping its own crop unless
+    # image_path is passed; the rest are deleted. Returns (known ids,
+    # crops of the deleted rows that no row references any more) so the
+    # caller can remove them.
+    details = _known_details(details)
+    known_ids, dropped_paths = [], []
+    with get_pool().transaction() as conn:
+        for face_id in face_ids:
+            row = conn.execute("SELECT image_path, encoding FROM unknown_faces WHERE id = ?",
+                               (face_id,)).fetchone()
+            if row is None:
+                continue
+            if max_samples is None or len(known_ids) < max_samples:
+                row_details = dict(details)
+                row_details["image_path"] = details["image_path"] or row[0]
+                known_ids.append(_insert_known_face(conn, name, row[1], **row_details))
+            else:
+                dropped_paths.append(row[0])
+            conn.execute("DELETE FROM unknown_faces WHERE id = ?", (face_id,))
+            conn.execute("DELETE FROM unknown_sightings WHERE unknown_id = ?", (face_id,))
+        dropped_paths = [path for path in dict.fromkeys(dropped_paths) if not _image_in_use(conn, path)]
+    return known_ids, dropped_paths
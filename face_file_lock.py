@@ -0,0 +1,54 @@
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows: rebuilds are not serialized, renames keep them safe
+    fcntl = None
+
+
+class FileLock:
+    # Exclusive lock on <path>.lock held across processes. Guards the
+    # rebuild-and-save of files next to the database (ANN and int8 indexes
+    # through load_or_build, the gallery snapshot), so recognizers starting
+    # together build them once and the rest load the result.
+    def __init__(self, path):
+        self.path = path + ".lock"
+
+    def __enter__(self):
+        self.f = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+def load_matching(cls, path, ids):
+    # The index saved at path if it covers exactly these ids, else None
+    if os.path.exists(path):
+        try:
+            index = cls.load(path)
+        except (OSError, ValueError):
+            return None
+        if index.matches(ids):
+            return index
+    return None
+
+
+def load_or_build(cls, ids, build_fn, path):
+    # Reuses the index saved at path when it still covers exactly these ids,
+    # otherwise saves build_fn()'s index there. Builds are serialized across
+    # processes; whoever waited loads the result, and so does the builder,
+    # so every process holds the index the same way (e.g. memory-mapped).
+    index = load_matching(cls, path, ids)
+    if index is not None:
+        return index
+    with FileLock(path):
+        index = load_matching(cls, path, ids)
+        if index is None:
+            build_fn().save(path)
+            index = cls.load(path)
+    return index
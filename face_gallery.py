@@ -0,0 +1,448 @@
+from collections import namedtuple
+
+import numpy as np
+
+ENCODING_DIM = 128
+
+# name: voted identity ("Unknown" if nothing within tolerance)
+# distance: best distance to the voted identity (or to the nearest row)
+# candidates: top-k identities as (name, distance to its nearest row),
+# nearest first
+FaceMatch = namedtuple("FaceMatch", ["name", "distance", "candidates"])
+
+
+def as_matrix(encodings, dim=ENCODING_DIM):
+    matrix = np.asarray(encodings, dtype=np.float32)
+    return np.ascontiguousarray(matrix.reshape(-1, dim))
+
+
+def squared_norms(matrix):
+    return np.einsum("ij,ij->i", matrix, matrix)
+
+
+def pairwise_distances(queries, matrix, matrix_sq=None):
+    # Euclidean distances between every query row and every gallery row,
+    # computed as |q|^2 + |g|^2 - 2 q.g so the heavy part is one GEMM.
+    queries = as_matrix(queries, matrix.shape[1])
+    if matrix_sq is None:
+        matrix_sq = squared_norms(matrix)
+    d2 = squared_norms(queries)[:, None] + matrix_sq[None, :]
+    d2 -= 2.0 * (queries @ matrix.T)
+    np.maximum(d2, 0.0, out=d2)
+    return np.sqrt(d2, out=d2)
+
+
+def top_k(distances, k):
+    # Indices of the k smallest distances per row, nearest first.
+    k = min(k, distances.shape[1])
+    if k == 0:
+        return np.empty((distances.shape[0], 0), dtype=np.intp)
+    if k < distances.shape[1]:
+        idx = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.broadcast_to(np.arange(k), distances.shape).copy()
+    order = np.take_along_axis(distances, idx, axis=1).argsort(axis=1, kind="stable")
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def first_per_label(rows, labels, k):
+    # The first k entries of rows (ordered nearest first) with a label not
+    # seen before, i.e. the nearest row of each of the k nearest labels
+    _, first = np.unique(labels, return_index=True)
+    return rows[np.sort(first)[:k]]
+
+
+def top_k_labels(distances, label_ids, k):
+    # Per query, the nearest row of each of the k nearest labels, nearest
+    # first. The shortlist is widened until it holds k labels, so one label
+    # with many rows cannot fill every slot.
+    n = distances.shape[1]
+    nearest = []
+    for q in range(len(distances)):
+        width = k
+        while True:
+            width = min(n, 4 * width)
+            rows = top_k(distances[q:q + 1], width)[0]
+            best = first_per_label(rows, label_ids[rows], k)
+            if len(best) >= k or width == n:
+                break
+        nearest.append(best)
+    return nearest
+
+
+def vote(matches, label_ids):
+    # For every query row pick the label with the most matching gallery rows.
+    # Ties go to the label whose first matching row comes first, which is
+    # what the old dict-based vote did. Returns -1 where nothing matched.
+    n_queries = matches.shape[0]
+    winners = np.full(n_queries, -1, dtype=np.int64)
+    rows, cols = np.nonzero(matches)
+    if rows.size == 0:
+        return winners
+
+    # label_ids is per gallery column, or per (query, column) for shortlists
+    labels = label_ids[cols] if label_ids.ndim == 1 else label_ids[rows, cols]
+    n_labels = int(labels.max()) + 1
+    keys = rows.astype(np.int64) * n_labels + labels
+    uniq, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    query_of = uniq // n_labels
+    order = np.lexsort((first, -counts, query_of))
+    uniq, query_of = uniq[order], query_of[order]
+    head = np.ones(len(uniq), dtype=bool)
+    head[1:] = query_of[1:] != query_of[:-1]
+    winners[query_of[head]] = uniq[head] % n_labels
+    return winners
+
+
+class RowLookup:
+    # face id -> row for a mostly stable id array, without a per-row dict: a
+    # sorted copy of the ids (16 bytes per row, built on first use) plus a
+    # small dict of rows placed since. Hits are checked against the live
+    # ids, so entries left behind by removals simply miss.
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._sorted_ids = self._sorted_rows = None
+        self._placed = {}
+
+    def place(self, face_id, row):
+        self._placed[int(face_id)] = row
+
+    def forget(self, face_id):
+        self._placed.pop(int(face_id), None)
+
+    def find(self, ids, face_ids):
+        # Row of each face id in ids, -1 where absent
+        face_ids = np.asarray(face_ids, dtype=np.int64)
+        if len(ids) == 0 or face_ids.size == 0:
+            return np.full(face_ids.shape, -1, dtype=np.int64)
+        if self._sorted_ids is None or len(self._placed) > max(1024, len(ids) // 8):
+            order = np.argsort(ids, kind="stable")
+            self._sorted_ids, self._sorted_rows = ids[order], order
+            self._placed = {}
+        rows = np.full(face_ids.shape, -1, dtype=np.int64)
+        if len(self._sorted_ids):
+            pos = np.searchsorted(self._sorted_ids, face_ids)
+            rows = self._sorted_rows[np.minimum(pos, len(self._sorted_ids) - 1)]
+        if self._placed:
+            flat = rows.reshape(-1)
+            for i, face_id in enumerate(face_ids.reshape(-1).tolist()):
+                flat[i] = self._placed.get(face_id, flat[i])
+        rows = np.where(rows < len(ids), rows, -1)
+        return np.where((rows >= 0) & (ids[np.maximum(rows, 0)] == face_ids), rows, -1)
+
+
+class KnownGallery:
+    # Known encodings in one contiguous float32 matrix. Rows are kept in
+    # growable buffers so single faces can be added or removed without a
+    # full reload. An optional ANN index (see face_ann) replaces the exact
+    # scan for large galleries; optional per-identity prototypes (see
+    # face_prototypes) replace it for identities with many samples. Without
+    # keep_vectors only ids and labels are held and every match goes
+    # through the index, which keeps its own vectors (e.g. face_quant's
+    # int8 codes with memory-mapped float32 rows).
+    def __init__(self, dim=ENCODING_DIM, index=None, vote_k=50, prototypes=None, keep_vectors=True):
+        self.dim = dim
+        self.keep_vectors = keep_vectors
+        self.index = index
+        self.vote_k = vote_k
+        self.prototypes = prototypes
+        # known_faces_changes version the rows reflect (see face_db)
+        self.version = 0
+        self.clear()
+
+    def clear(self):
+        self._reserve(0, reset=True)
+        self.size = 0
+        self.labels = []
+        self._label_index = {}
+        self._lookup = RowLookup()
+        self._borrowed = False
+        self._invalidate()
+
+    def _invalidate(self, label_id=None):
+        if self.prototypes is not None:
+            self.prototypes.invalidate(label_id)
+
+    def _reserve(self, capacity, reset=False):
+        if not reset and capacity <= len(self._matrix):
+            return
+        old = 0 if reset else self.size
+        matrix = np.empty((capacity, self.dim if self.keep_vectors else 0), dtype=np.float32)
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        ids = np.empty(capacity, dtype=np.int64)
+        label_ids = np.empty(capacity, dtype=np.int64)
+        if old:
+            matrix[:old] = self._matrix[:old]
+            sq_norms[:old] = self._sq_norms[:old]
+            ids[:old] = self._ids[:old]
+            label_ids[:old] = self._label_ids[:old]
+        self._matrix, self._sq_norms, self._ids, self._label_ids = matrix, sq_norms, ids, label_ids
+
+    @property
+    def matrix(self):
+        return self._matrix[:self.size]
+
+    @property
+    def sq_norms(self):
+        return self._sq_norms[:self.size]
+
+    @property
+    def ids(self):
+        return self._ids[:self.size]
+
+    @property
+    def label_ids(self):
+        return self._label_ids[:self.size]
+
+    def rows_of(self, face_ids):
+        # Row of each face id, -1 where absent
+        return self._lookup.find(self.ids, face_ids)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, face_id):
+        return self.rows_of([face_id])[0] >= 0
+
+    @property
+    def names(self):
+        return [self.labels[i] for i in self.label_ids]
+
+    def _label_id(self, name):
+        if name not in self._label_index:
+            self._label_index[name] = len(self.labels)
+            self.labels.append(name)
+        return self._label_index[name]
+
+    def load(self, ids, names, encodings=None):
+        # encodings may be None when vectors are not kept
+        self.clear()
+        self._ids = np.asarray(ids, dtype=np.int64)
+        self._label_ids = np.array([self._label_id(n) for n in names], dtype=np.int64)
+        self.size = len(self._ids)
+        matrix = None
+        if encodings is not None:
+            matrix = as_matrix(encodings, self.dim) if len(encodings) else np.empty((0, self.dim), np.float32)
+        if self.keep_vectors:
+            self._matrix = matrix
+            self._sq_norms = squared_norms(matrix)
+        else:
+            self._matrix = np.empty((self.size, 0), dtype=np.float32)
+            self._sq_norms = np.zeros(self.size, dtype=np.float32)
+        self._lookup.reset()
+        self._invalidate()
+        if self.index is not None and not self.index.matches(self.ids):
+            self.index.build(self.ids, matrix)
+
+    @classmethod
+    def from_arrays(cls, ids, label_ids, labels, matrix, sq_norms=None, **kwargs):
+        gallery = cls(dim=matrix.shape[1], **kwargs)
+        gallery.borrow(ids, label_ids, labels, matrix, sq_norms)
+        return gallery
+
+    def borrow(self, ids, label_ids, labels, matrix, sq_norms=None):
+        # Wraps existing arrays without copying them (e.g. shared memory or
+        # memory-mapped files). add()/remove() copy into private buffers.
+        # The index is left as it is; the caller keeps it in step.
+        self._matrix = matrix
+        self._sq_norms = squared_norms(matrix) if sq_norms is None else sq_norms
+        self._ids = ids
+        self._label_ids = label_ids
+        self.size = len(matrix)
+        self.labels = list(labels)
+        self._label_index = {name: i for i, name in enumerate(self.labels)}
+        self._lookup.reset()
+        self._borrowed = True
+        self._invalidate()
+
+    def _own(self):
+        # Copy borrowed arrays into private buffers before the first change
+        if self._borrowed:
+            self._reserve(self.size + 16)
+            self._borrowed = False
+
+    def add(self, face_id, name, encoding):
+        self._own()
+        if face_id in self:
+            self.remove(face_id)
+        if self.size == len(self._matrix):
+            self._reserve(max(16, 2 * self.size))
+        row = self.size
+        vector = np.asarray(encoding, dtype=np.float32).reshape(1, self.dim)
+        # Index first: if it fails, the gallery is left as it was
+        if self.index is not None:
+            self.index.add([face_id], vector)
+        if self.keep_vectors:
+            self._matrix[row] = vector[0]
+        self._sq_norms[row] = vector[0] @ vector[0]
+        self._ids[row] = face_id
+        self._label_ids[row] = self._label_id(name)
+        self._lookup.place(face_id, row)
+        self.size += 1
+        self._invalidate(self._label_ids[row])
+
+    def remove(self, face_id):
+        # Swap-remove: the last row moves into the hole
+        row = int(self.rows_of([face_id])[0])
+        if row < 0:
+            return False
+        self._own()
+        self._lookup.forget(face_id)
+        self._invalidate(self._label_ids[row])
+        last = self.size - 1
+        if row != last:
+            self._matrix[row] = self._matrix[last]
+            self._sq_norms[row] = self._sq_norms[last]
+            self._ids[row] = self._ids[last]
+            self._label_ids[row] = self._label_ids[last]
+            self._lookup.place(self._ids[row], row)
+        self.size = last
+        if self.index is not None:
+            self.index.remove([face_id])
+        return True
+
+    def match(self, encodings, tolerance=0.6, k=5):
+        queries = as_matrix(encodings, self.dim)
+        if len(queries) == 0:
+            return []
+        if self.size == 0:
+            return [FaceMatch("Unknown", float("inf"), []) for _ in range(len(queries))]
+        if self.prototypes is not None:
+            return self.prototypes.match(self, queries, tolerance, k)
+        if self.index is not None:
+            return self._match_index(queries, tolerance, k)
+        if not self.keep_vectors:
+            raise RuntimeError("KnownGallery without vectors needs an index to match")
+
+        distances = pairwise_distances(queries, self.matrix, self.sq_norms)
+        nearest = top_k_labels(distances, self.label_ids, k)
+        winners = vote(distances <= tolerance, self.label_ids)
+
+        results = []
+        for q, label in enumerate(winners):
+            candidates = [(self.labels[self.label_ids[i]], float(distances[q, i])) for i in nearest[q]]
+            if label < 0:
+                results.append(FaceMatch("Unknown", candidates[0][1], candidates))
+                continue
+            best = float(distances[q, self.label_ids == label].min())
+            results.append(FaceMatch(self.labels[label], best, candidates))
+        return results
+
+    def _match_index(self, queries, tolerance, k):
+        # Vote among the ANN shortlist instead of the whole gallery
+        cand_ids, distances = self.index.search(queries, max(k, self.vote_k))
+        rows = self.rows_of(cand_ids)
+        valid = rows >= 0
+        labels = np.where(valid, self._label_ids[np.maximum(rows, 0)], -1)
+        winners = vote(valid & (distances <= tolerance), labels)
+
+        results = []
+        for q, label in enumerate(winners):
+            candidates = self._index_candidates(queries[q], k, labels[q], distances[q])
+            if label < 0:
+                nearest = candidates[0][1] if candidates else float("inf")
+                results.append(FaceMatch("Unknown", nearest, candidates))
+                continue
+            best = float(distances[q, labels[q] == label].min())
+            results.append(FaceMatch(self.labels[label], best, candidates))
+        return results
+
+    def _index_candidates(self, query, k, labels, distances):
+        # One candidate per identity from the shortlist; when a few
+        # identities fill it, the search is widened until k are found
+        width = len(labels)
+        while True:
+            shortlist = np.flatnonzero(labels >= 0)
+            picked = first_per_label(shortlist, labels[shortlist], k)
+            if len(picked) >= k or len(shortlist) < width or width >= self.size:
+                break
+            width = min(self.size, 4 * width)
+            cand_ids, found = self.index.search(query[None, :], width)
+            rows = self.rows_of(cand_ids[0])
+            labels = np.where(rows >= 0, self._label_ids[np.maximum(rows, 0)], -1)
+            distances = found[0]
+        return [(self.labels[labels[j]], float(distances[j])) for j in picked]
+
+
+class UnknownGallery:
+    # Resident, bounded index of unknown faces. Rows live in preallocated
+    # slots; when full, the least recently seen unknown is evicted.
+    def __init__(self, capacity=10000, dim=ENCODING_DIM):
+        self.capacity = capacity
+        self.dim = dim
+        self.matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self.sq_norms = np.zeros(capacity, dtype=np.float32)
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.last_seen = np.full(capacity, -np.inf)
+        self.image_paths = [None] * capacity
+        self._slots = {}
+        self._free = list(range(capacity - 1, -1, -1))
+        self._high = 0  # slots at or past this index have never been used
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, face_id):
+        return face_id in self._slots
+
+    def load(self, rows):
+        # rows: iterable of (id, encoding, image_path, last_seen)
+        for face_id, encoding, image_path, seen_at in rows:
+            self.add(face_id, encoding, image_path, seen_at)
+
+    def _free_slot(self):
+        if self._free:
+            slot = self._free.pop()
+            self._high = max(self._high, slot + 1)
+            return slot
+        slot = int(np.argmin(self.last_seen))
+        del self._slots[int(self.ids[slot])]
+        return slot
+
+    def add(self, face_id, encoding, image_path=None, seen_at=0.0):
+        slot = self._slots.get(face_id)
+        if slot is None:
+            slot = self._free_slot()
+            self._slots[face_id] = slot
+        self.matrix[slot] = encoding
+        self.sq_norms[slot] = self.matrix[slot] @ self.matrix[slot]
+        self.ids[slot] = face_id
+        self.last_seen[slot] = seen_at
+        self.image_paths[slot] = image_path
+
+    def remove(self, face_id):
+        slot = self._slots.pop(face_id, None)
+        if slot is None:
+            return
+        self.ids[slot] = -1
+        self.last_seen[slot] = -np.inf
+        self.image_paths[slot] = None
+        self._free.append(slot)
+
+    def touch(self, face_id, seen_at):
+        slot = self._slots.get(face_id)
+        if slot is not None:
+            self.last_seen[slot] = seen_at
+
+    def image_path(self, face_id):
+        slot = self._slots.get(face_id)
+        return None if slot is None else self.image_paths[slot]
+
+    def nearest(self, encodings):
+        # Returns (ids, distances) of the closest resident unknown for every
+        # query; id is -1 and distance inf when the gallery is empty.
+        queries = as_matrix(encodings, self.dim)
+        ids = np.full(len(queries), -1, dtype=np.int64)
+        dists = np.full(len(queries), np.inf)
+        if not self._slots or len(queries) == 0:
+            return ids, dists
+
+        used = slice(0, self._high)
+        distances = pairwise_distances(queries, self.matrix[used], self.sq_norms[used])
+        distances[:, self.ids[used] < 0] = np.inf
+        best = distances.argmin(axis=1)
+        ids[:] = self.ids[best]
+        dists[:] = distances[np.arange(len(queries)), best]
+        return ids, dists
@@ -1,76 +1,231 @@
 import sys
-import sqlite3
-import pickle
+import logging
+import math
+import time
 import cv2
 import os
-from datetime import datetime
+from collections import OrderedDict
 
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel, QVBoxLayout,
-    QTabWidget, QGridLayout, QPushButton, QScrollArea,
-    QDialog, QLineEdit, QTableWidget, QTableWidgetItem,
-    QMessageBox
+    QTabWidget, QGridLayout, QPushButton,
+    QDialog, QLineEdit, QTableView,
+    QMessageBox, QCheckBox, QListView, QListWidget, QListWidgetItem, QHBoxLayout
+)
+from PyQt5.QtGui import QPixmap, QImage, QIcon, QColor
+from PyQt5.QtCore import (
+    Qt, QTimer, QSize, QAbstractListModel, QAbstractTableModel, QModelIndex, QObject, QRunnable, QThreadPool, pyqtSignal
 )
-from PyQt5.QtGui import QPixmap, QImage, QIcon
-from PyQt5.QtCore import Qt, QTimer
 
-from face_recognizer import FaceRecognizerDL
-from face_db import connect_db, init_db
+from face_recognizer import FaceRecognizerDL, draw_results
+from face_worker import FrameGrabber, RecognitionWorker
+from face_multicam import MultiCameraManager
+from face_alerts import AlertDispatcher, CallbackSink, LogFileSink, WebhookSink
+from face_clustering import find_unknown_clusters
+from face_metrics import Metrics, MetricsDumper, MetricsServer
+from face_db import (
+    init_db, decode_encoding, search_known_faces, count_known_faces, list_unknown_page, count_unknown_faces,
+    get_pool, get_unknown_encoding, get_unknown_image_path, promote_unknown_face, promote_unknown_cluster
+)
 
 # -- Constants --
 DB_PATH = 'face_records.db'
 UNKNOWN_DIR = 'unknown_faces'
+ALERT_LOG_PATH = None      # e.g. 'alerts.jsonl'
+ALERT_WEBHOOK_URL = None   # e.g. 'http://localhost:8000/alerts'
+METRICS_ENABLED = False    # collect timings from the start (the overlay checkbox also turns them on)
+METRICS_PORT = None        # e.g. 9108 -> http://127.0.0.1:9108/metrics
+METRICS_DUMP_PATH = None   # e.g. 'metrics.json', rewritten every 10 s
+CLUSTER_SAMPLES = 10       # encodings kept per promoted cluster (nearest its centre first)
+
+# The database and the shared recognizer are set up in __main__ so that
+# camera worker processes (spawned, re-importing this module) skip them
+recognizer = None
+metrics = Metrics(enabled=False)
+
+def build_alert_dispatcher(callback):
+    # Alerts leave the recognition loop through a non-blocking dispatcher
+    sinks = [CallbackSink(callback)]
+    if ALERT_LOG_PATH:
+        sinks.append(LogFileSink(ALERT_LOG_PATH))
+    if ALERT_WEBHOOK_URL:
+        sinks.append(WebhookSink(ALERT_WEBHOOK_URL))
+    return AlertDispatcher(sinks, cooldown=recognizer.cooldown_second).start()
+
+def thumbnail_image(path, size):
+    # Pre-scaled thumbnail from the shared cache (decoded at most once per
+    # file); QImage is safe to build off the GUI thread, QPixmap is not
+    thumb = recognizer.thumbnails.get(recognizer.image_store.open_path(path), size)
+    if thumb is None:
+        return QImage()
+    h, w = thumb.shape[:2]
+    return QImage(thumb.data, w, h, 3 * w, QImage.Format_RGB888).rgbSwapped()
+
+class ThumbnailJob(QRunnable):
+    def __init__(self, face_id, path, size, signals):
+        super().__init__()
+        self.face_id = face_id
+        self.path = path
+        self.size = size
+        self.signals = signals
 
-# -- Initialize database --
-init_db()
+    def run(self):
+        self.signals.loaded.emit(self.face_id, thumbnail_image(self.path, self.size))
 
-# -- Initialize face recognizer --
-known_encodings = []
-known_names = []
-recognizer = FaceRecognizerDL(known_encodings, known_names, UNKNOWN_DIR)
+class ThumbnailSignals(QObject):
+    loaded = pyqtSignal(int, QImage)
+
+class ClusterJob(QRunnable):
+    # Runs the clustering pass off the GUI thread
+    def __init__(self, signals):
+        super().__init__()
+        self.signals = signals
+
+    def run(self):
+        try:
+            clusters = find_unknown_clusters()
+        finally:
+            # Pool threads are reused; don't keep a connection per thread
+            get_pool().release()
+        self.signals.finished.emit(clusters)
+
+class ClusterSignals(QObject):
+    finished = pyqtSignal(list)
 
 # -----------------------
 # Unknown Faces Tab
 # -----------------------
+class UnknownFacesModel(QAbstractListModel):
+    # Rows are paged in from SQLite as the view scrolls (no encodings), and
+    # thumbnails are decoded on a thread pool the first time the view asks
+    # for one, i.e. only for items that are actually shown.
+    FaceRole = Qt.UserRole
+
+    def __init__(self, page_size=500, thumb_size=100, cache_size=2000, parent=None):
+        super().__init__(parent)
+        self.page_size = page_size
+        self.thumb_size = thumb_size
+        self.cache_size = cache_size
+        self.rows = []  # (id, image_path, date_detected)
+        self.row_of = {}
+        self.exhausted = False
+        self.icons = OrderedDict()  # face id -> QIcon, least recently used first
+        self.pending = set()
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max(2, QThreadPool.globalInstance().maxThreadCount() // 2))
+        self.signals = ThumbnailSignals()
+        self.signals.loaded.connect(self.on_thumbnail_loaded)
+        placeholder = QPixmap(thumb_size, thumb_size)
+        placeholder.fill(QColor("#dddddd"))
+        self.placeholder = QIcon(placeholder)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted:
+            return
+        after = (self.rows[-1][2], self.rows[-1][0]) if self.rows else None
+        page = list_unknown_page(after, self.page_size)
+        self.exhausted = len(page) < self.page_size
+        if not page:
+            return
+        start = len(self.rows)
+        self.beginInsertRows(QModelIndex(), start, start + len(page) - 1)
+        for i, row in enumerate(page, start):
+            self.row_of[row[0]] = i
+        self.rows.extend(page)
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        face_id, path, detected = self.rows[index.row()]
+        if role == Qt.DecorationRole:
+            icon = self.icons.get(face_id)
+            if icon is not None:
+                self.icons.move_to_end(face_id)
+                return icon
+            self.request_thumbnail(face_id, path)
+            return self.placeholder
+        if role == Qt.ToolTipRole:
+            return f"#{face_id} detected {detected}"
+        if role == self.FaceRole:
+            return face_id, path
+        return None
+
+    def request_thumbnail(self, face_id, path):
+        if face_id in self.pending:
+            return
+        self.pending.add(face_id)
+        self.pool.start(ThumbnailJob(face_id, path, self.thumb_size, self.signals))
+
+    def on_thumbnail_loaded(self, face_id, image):
+        self.pending.discard(face_id)
+        self.icons[face_id] = QIcon(QPixmap.fromImage(image)) if not image.isNull() else self.placeholder
+        while len(self.icons) > self.cache_size:
+            self.icons.popitem(last=False)
+        row = self.row_of.get(face_id)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def reload(self):
+        # Thumbnails stay cached by face id across reloads
+        self.beginResetModel()
+        self.rows, self.row_of, self.exhausted = [], {}, False
+        self.endResetModel()
+
 class UnknownFacesTab(QWidget):
     def __init__(self, known_faces_tab):
         super().__init__()
         self.known_faces_tab = known_faces_tab
         layout = QVBoxLayout()
 
-        scroll = QScrollArea()
-        scroll.setWidgetResizable(True)
-        content = QWidget()
-        self.grid = QGridLayout()
-
-        conn = connect_db()
-        c = conn.cursor()
-        c.execute("SELECT id, image_path, encoding FROM unknown_faces ORDER BY date_detected DESC")
-        self.faces = c.fetchall()
-        conn.close()
-
-        for i, (face_id, path, encoding_blob) in enumerate(self.faces):
-            btn = QPushButton()
-            pixmap = QPixmap(path).scaled(100, 100, Qt.KeepAspectRatio)
-            btn.setIcon(QIcon(pixmap))
-            btn.setIconSize(pixmap.size())
-            btn.setFixedSize(120, 120)
-            btn.clicked.connect(lambda _, p=path, e=encoding_blob, id=face_id: self.show_face_detail(p, e, id))
-            self.grid.addWidget(btn, i // 4, i % 4)
-
-        content.setLayout(self.grid)
-        scroll.setWidget(content)
-        layout.addWidget(scroll)
+        header = QHBoxLayout()
+        self.count_label = QLabel()
+        self.group_button = QPushButton("Group similar faces")
+        self.group_button.clicked.connect(self.group_faces)
+        self.cluster_signals = ClusterSignals()
+        self.cluster_signals.finished.connect(self.show_clusters)
+        header.addWidget(self.count_label)
+        header.addStretch()
+        header.addWidget(self.group_button)
+        layout.addLayout(header)
+
+        self.model = UnknownFacesModel(parent=self)
+        self.view = QListView()
+        self.view.setViewMode(QListView.IconMode)
+        self.view.setIconSize(QSize(100, 100))
+        self.view.setGridSize(QSize(120, 120))
+        self.view.setUniformItemSizes(True)
+        self.view.setResizeMode(QListView.Adjust)
+        self.view.setMovement(QListView.Static)
+        self.view.setLayoutMode(QListView.Batched)
+        self.view.setModel(self.model)
+        self.view.activated.connect(self.open_face)
+        self.view.clicked.connect(self.open_face)
+        layout.addWidget(self.view)
         self.setLayout(layout)
+        self.update_count()
+
+    def update_count(self):
+        self.count_label.setText(f"{count_unknown_faces()} unknown faces")
+
+    def open_face(self, index):
+        face_id, path = index.data(UnknownFacesModel.FaceRole)
+        self.show_face_detail(path, face_id)
 
-    def show_face_detail(self, image_path, encoding_blob, face_id):
+    def show_face_detail(self, image_path, face_id):
         dialog = QDialog(self)
         dialog.setWindowTitle("Promote to Known")
         layout = QVBoxLayout()
 
         image_label = QLabel()
-        pixmap = QPixmap(image_path).scaled(250, 250, Qt.KeepAspectRatio)
-        image_label.setPixmap(pixmap)
+        image_label.setPixmap(QPixmap.fromImage(thumbnail_image(image_path, 250)))
         layout.addWidget(image_label)
 
         # Input fields
@@ -106,18 +261,20 @@ class UnknownFacesTab(QWidget):
 
                 return
 
-            conn = connect_db()
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO known_faces (name, contact, age, gender, address, occupation, image_path, encoding, date_added)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                name, contact, age, gender, address, occupation, image_path, encoding_blob,
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            ))
-            cursor.execute("DELETE FROM unknown_faces WHERE id = ?", (face_id,))
-            conn.commit()
-            conn.close()
+            encoding_blob = get_unknown_encoding(face_id)
+            if encoding_blob is None:
+                QMessageBox.warning(dialog, "Error", "This face no longer exists.")
+                self.refresh_unknown_faces_tab()
+                dialog.reject()
+                return
+
+            known_id = promote_unknown_face(
+                face_id, name, encoding_blob, contact=contact, age=age, gender=gender,
+                address=address, occupation=occupation, image_path=image_path
+            )
+            recognizer.forget_unknown(face_id)
+            if known_id is not None:
+                recognizer.add_known_face(known_id, name, decode_encoding(encoding_blob))
 
             QMessageBox.information(dialog, "Success", "Promoted to known faces!")
             
@@ -131,28 +288,24 @@ class UnknownFacesTab(QWidget):
         dialog.exec_()
 
 
+    def group_faces(self):
+        self.group_button.setEnabled(False)
+        self.group_button.setText("Grouping...")
+        QThreadPool.globalInstance().start(ClusterJob(self.cluster_signals))
+
+    def show_clusters(self, clusters):
+        self.group_button.setEnabled(True)
+        self.group_button.setText("Group similar faces")
+        if not clusters:
+            QMessageBox.information(self, "Group similar faces", "No repeated unknown faces found.")
+            return
+        ClusterDialog(clusters, self).exec_()
+        self.refresh_unknown_faces_tab()
+        self.known_faces_tab.load_known_faces()
+
     def refresh_unknown_faces_tab(self):
-    # Clear the current grid layout
-        for i in reversed(range(self.grid.count())):
-            widget = self.grid.itemAt(i).widget()
-            if widget is not None:
-                widget.deleteLater()
-
-        # Reload faces from database
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT id, image_path, encoding FROM unknown_faces ORDER BY date_detected DESC")
-        self.faces = c.fetchall()
-        conn.close()
-
-        for i, (face_id, path, encoding_blob) in enumerate(self.faces):
-            btn = QPushButton()
-            pixmap = QPixmap(path).scaled(100, 100, Qt.KeepAspectRatio)
-            btn.setIcon(QIcon(pixmap))
-            btn.setIconSize(pixmap.size())
-            btn.setFixedSize(120, 120)
-            btn.clicked.connect(lambda _, p=path, e=encoding_blob, id=face_id: self.show_face_detail(p, e, id))
-            self.grid.addWidget(btn, i // 4, i % 4)
+        self.model.reload()
+        self.update_count()
 
 
     def show_toast(self, message, duration=2000):
@@ -175,11 +328,101 @@ class UnknownFacesTab(QWidget):
 
         QTimer.singleShot(duration, toast.deleteLater)
 
+class ClusterDialog(QDialog):
+    # Unknown faces grouped by face_clustering, largest group first; a whole
+    # group is promoted as one person in one transaction
+    MAX_PREVIEW = 24
+
+    def __init__(self, clusters, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Similar unknown faces")
+        self.resize(800, 500)
+        self.clusters = clusters
+
+        self.cluster_list = QListWidget()
+        for cluster in clusters:
+            self.cluster_list.addItem(f"{len(cluster.ids)} faces (spread {cluster.spread:.2f})")
+        self.cluster_list.currentRowChanged.connect(self.show_cluster)
+
+        self.image_label = QLabel()
+        self.image_label.setAlignment(Qt.AlignCenter)
+        self.members = QListWidget()
+        self.members.setViewMode(QListWidget.IconMode)
+        self.members.setIconSize(QSize(60, 60))
+        self.members.setMovement(QListWidget.Static)
+        self.members.setResizeMode(QListWidget.Adjust)
+
+        self.name_input = QLineEdit()
+        self.name_input.setPlaceholderText("Full Name")
+        self.contact_input = QLineEdit()
+        self.contact_input.setPlaceholderText("Contact")
+        self.occupation_input = QLineEdit()
+        self.occupation_input.setPlaceholderText("Occupation")
+        self.promote_button = QPushButton("Promote group to Known")
+        self.promote_button.clicked.connect(self.promote)
+
+        details = QVBoxLayout()
+        for widget in [self.image_label, self.members, self.name_input, self.contact_input,
+                       self.occupation_input, self.promote_button]:
+            details.addWidget(widget)
+        layout = QHBoxLayout()
+        layout.addWidget(self.cluster_list, 1)
+        layout.addLayout(details, 2)
+        self.setLayout(layout)
+        self.cluster_list.setCurrentRow(0)
+
+    def show_cluster(self, row):
+        self.members.clear()
+        if row < 0:
+            self.image_label.clear()
+            return
+        cluster = self.clusters[row]
+        self.image_label.setPixmap(QPixmap.fromImage(thumbnail_image(cluster.image_path, 250)))
+        # Members come nearest the centre first, so the preview shows the
+        # crops that are kept as samples
+        for face_id in cluster.ids[:self.MAX_PREVIEW]:
+            path = get_unknown_image_path(face_id)
+            if path is None:
+                continue
+            item = QListWidgetItem(QIcon(QPixmap.fromImage(thumbnail_image(path, 60))), "")
+            item.setToolTip(f"#{face_id}")
+            self.members.addItem(item)
+
+    def promote(self):
+        row = self.cluster_list.currentRow()
+        name = self.name_input.text().strip()
+        if row < 0 or not name:
+            QMessageBox.warning(self, "Missing Info", "Select a group and enter a name.")
+            return
+        cluster = self.clusters[row]
+        known_ids, dropped_paths = promote_unknown_cluster(
+            cluster.ids, name, max_samples=CLUSTER_SAMPLES,
+            contact=self.contact_input.text(), occupation=self.occupation_input.text())
+        for face_id in cluster.ids:
+            recognizer.forget_unknown(face_id)
+        for path in dropped_paths:
+            recognizer.image_store.delete(path)
+        recognizer.sync_known_faces()
+        if not known_ids:
+            QMessageBox.warning(self, "Error", "These faces no longer exist.")
+        else:
+            QMessageBox.information(self, "Success", f"Promoted {name} with {len(known_ids)} samples.")
+
+        del self.clusters[row]
+        self.cluster_list.blockSignals(True)
+        self.cluster_list.takeItem(row)
+        self.cluster_list.blockSignals(False)
+        self.show_cluster(self.cluster_list.currentRow())
+        for widget in (self.name_input, self.contact_input, self.occupation_input):
+            widget.clear()
+        if not self.clusters:
+            self.accept()
+
 # -----------------------
 # Live Feed Tab
 # -----------------------
 class LiveFeedTab(QWidget):
-    def __init__(self):
+    def __init__(self, source=0):
         super().__init__()
         self.layout = QVBoxLayout()
 
@@ -187,112 +430,306 @@ class LiveFeedTab(QWidget):
         self.feed_label.setAlignment(Qt.AlignCenter)
         self.layout.addWidget(self.feed_label)
 
+        self.metrics_checkbox = QCheckBox("Show metrics")
+        self.metrics_checkbox.setChecked(metrics.enabled)
+        self.metrics_checkbox.toggled.connect(self.toggle_metrics)
+        self.layout.addWidget(self.metrics_checkbox)
+
         self.setLayout(self.layout)
 
-        self.cap = cv2.VideoCapture(0)
+        # Capture and recognition run on their own threads; the GUI thread
+        # only shows the newest frame with the latest recognition overlays
+        self.alerts = build_alert_dispatcher(self.send_alert_gui)
+        self.grabber = FrameGrabber(source)
+        self.worker = RecognitionWorker(recognizer, self.alerts)
+        self.grabber.start()
+        self.worker.start()
+
+        metrics.gauge("capture_dropped", lambda: self.grabber.frames.dropped)
+        metrics.gauge("recognition_dropped", lambda: self.worker.dropped)
+        metrics.gauge("alert_queues", self.alerts.queue_depths)
+
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_frame)
         self.timer.start(30)
 
     def update_frame(self):
-        ret, frame = self.cap.read()
-        if not ret:
+        captured = self.grabber.latest()
+        if captured is None:
             return
+        frame_time, frame = captured
+
+        # Recognition gets its own copy; if it is still busy the previous
+        # pending frame is dropped
+        self.worker.submit(frame.copy(), frame_time)
+        results, _, _ = self.worker.results()
+
+        with metrics.time("ui_frame"):
+            recognizer.draw_results(frame, results)
+            if self.metrics_checkbox.isChecked():
+                self.draw_metrics(frame)
 
-        # Run face recognition
-        frame = recognizer.detect_and_recognize(frame, self.send_alert_gui)
+            rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            h, w, ch = rgb_image.shape
+            bytes_per_line = ch * w
+            qt_image = QImage(rgb_image.data, w, h, bytes_per_line, QImage.Format_RGB888)
+            pixmap = QPixmap.fromImage(qt_image)
 
-        rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        h, w, ch = rgb_image.shape
-        bytes_per_line = ch * w
-        qt_image = QImage(rgb_image.data, w, h, bytes_per_line, QImage.Format_RGB888)
-        pixmap = QPixmap.fromImage(qt_image)
+            self.feed_label.setPixmap(pixmap)
+        metrics.mark("display_fps")
 
-        self.feed_label.setPixmap(pixmap)
+    def toggle_metrics(self, checked):
+        metrics.enabled = checked or METRICS_ENABLED or bool(METRICS_PORT or METRICS_DUMP_PATH)
+
+    def draw_metrics(self, frame):
+        for i, line in enumerate(metrics.overlay_lines()):
+            y = 20 + 18 * i
+            cv2.putText(frame, line, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 3)
+            cv2.putText(frame, line, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
 
     def send_alert_gui(self, name, image_path):
         print(f"[ALERT] {name} detected! Image saved at {image_path}")
 
+    def stop(self):
+        self.timer.stop()
+        self.worker.stop()
+        self.grabber.stop()
+        self.worker.join(timeout=2)
+        self.grabber.join(timeout=2)
+        self.alerts.stop()
+
     def closeEvent(self, event):
-        self.cap.release()
+        self.stop()
+
+# -----------------------
+# Multi-camera Tab
+# -----------------------
+class MultiCameraTab(QWidget):
+    # Grid view over several sources; each runs in its own worker process
+    def __init__(self, sources):
+        super().__init__()
+        self.manager = MultiCameraManager(sources, unknown_dir=UNKNOWN_DIR)
+        self.manager.start()
+        self.alerts = build_alert_dispatcher(self.send_alert_gui)
+
+        grid = QGridLayout()
+        columns = math.ceil(math.sqrt(len(sources)))
+        self.feed_labels = []
+        for i, source in enumerate(sources):
+            label = QLabel(f"Camera {source}")
+            label.setAlignment(Qt.AlignCenter)
+            label.setMinimumSize(160, 120)
+            grid.addWidget(label, i // columns, i % columns)
+            self.feed_labels.append(label)
+        self.setLayout(grid)
+        self.last_seqs = [0] * len(sources)
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.update_frames)
+        self.timer.start(30)
+
+    def update_frames(self):
+        for i, label in enumerate(self.feed_labels):
+            latest = self.manager.latest_frame(i, self.last_seqs[i])
+            if latest is None:
+                continue
+            self.last_seqs[i], frame = latest
+            draw_results(frame, self.manager.latest_results(i))
+
+            rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            h, w, ch = rgb_image.shape
+            qt_image = QImage(rgb_image.data, w, h, ch * w, QImage.Format_RGB888)
+            label.setPixmap(QPixmap.fromImage(qt_image).scaled(label.size(), Qt.KeepAspectRatio))
+
+        for camera, _, name, image_path in self.manager.drain_alerts():
+            self.alerts(name, image_path, camera=camera)
+
+    def send_alert_gui(self, name, image_path):
+        print(f"[ALERT] {name} detected! Image saved at {image_path}")
+
+    def stop(self):
+        self.timer.stop()
+        self.manager.stop()
+        self.alerts.stop()
+
+    def closeEvent(self, event):
+        self.stop()
 
 # -----------------------
 # Known Faces Tab
 # -----------------------
+class KnownFacesModel(QAbstractTableModel):
+    # Search results paged in from the full-text index as the view scrolls;
+    # photos load on a thread pool like the unknown-face thumbnails.
+    COLUMNS = ("Name", "Contact", "Occupation", "Photo")
+
+    def __init__(self, page_size=200, thumb_size=60, parent=None):
+        super().__init__(parent)
+        self.page_size = page_size
+        self.thumb_size = thumb_size
+        self.query = ""
+        self.total = 0
+        self.rows = []  # (id, name, contact, occupation, image_path)
+        self.row_of = {}
+        self.icons = {}
+        self.pending = set()
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self.signals = ThumbnailSignals()
+        self.signals.loaded.connect(self.on_thumbnail_loaded)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and len(self.rows) < self.total
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        page = search_known_faces(self.query, self.page_size, len(self.rows))
+        if not page:
+            self.total = len(self.rows)
+            return
+        start = len(self.rows)
+        self.beginInsertRows(QModelIndex(), start, start + len(page) - 1)
+        for i, row in enumerate(page, start):
+            self.row_of[row[0]] = i
+        self.rows.extend(page)
+        self.endInsertRows()
+
+    def search(self, query):
+        # Runs the query (count plus first page); returns seconds taken
+        started = time.perf_counter()
+        self.beginResetModel()
+        self.query = query
+        self.total = count_known_faces(query)
+        self.rows, self.row_of = [], {}
+        self.endResetModel()
+        if self.canFetchMore():
+            self.fetchMore()
+        return time.perf_counter() - started
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        face_id, name, contact, occupation, path = self.rows[index.row()]
+        column = index.column()
+        if role == Qt.DisplayRole and column < 3:
+            return (name, contact, occupation)[column] or ""
+        if role == Qt.DecorationRole and column == 3:
+            icon = self.icons.get(face_id)
+            if icon is None:
+                self.request_thumbnail(face_id, path)
+            return icon
+        return None
+
+    def request_thumbnail(self, face_id, path):
+        if face_id in self.pending:
+            return
+        self.pending.add(face_id)
+        self.pool.start(ThumbnailJob(face_id, path, self.thumb_size, self.signals))
+
+    def on_thumbnail_loaded(self, face_id, image):
+        self.pending.discard(face_id)
+        self.icons[face_id] = QIcon(QPixmap.fromImage(image))
+        row = self.row_of.get(face_id)
+        if row is not None:
+            index = self.index(row, 3)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
 class KnownFacesTab(QWidget):
-    def __init__(self, db_connection):
+    SEARCH_DELAY_MS = 250
+
+    def __init__(self):
         super().__init__()
-        self.db_connection = db_connection
-        self.cursor = self.db_connection.cursor()
         self.setup_ui()
         self.load_known_faces()
 
     def setup_ui(self):
         layout = QVBoxLayout()
         self.search_bar = QLineEdit()
-        self.search_bar.setPlaceholderText("Search by name...")
-        self.search_bar.textChanged.connect(self.search_faces)
+        self.search_bar.setPlaceholderText("Search name, contact or occupation...")
+
+        # Typing restarts the timer; the query runs once input pauses
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(self.load_known_faces)
+        self.search_bar.textChanged.connect(self.search_timer.start)
 
-        self.table = QTableWidget()
-        self.table.setColumnCount(4)
-        self.table.setHorizontalHeaderLabels(["Name", "Contact", "Occupation", "Photo"])
+        self.status_label = QLabel()
+
+        self.model = KnownFacesModel(parent=self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
         self.table.horizontalHeader().setStretchLastSection(True)
-        self.table.setSortingEnabled(True)
+        self.table.verticalHeader().setDefaultSectionSize(self.model.thumb_size + 4)
+        self.table.setIconSize(QSize(self.model.thumb_size, self.model.thumb_size))
+        self.table.setSelectionBehavior(QTableView.SelectRows)
 
         layout.addWidget(self.search_bar)
+        layout.addWidget(self.status_label)
         layout.addWidget(self.table)
         self.setLayout(layout)
 
     def load_known_faces(self):
-        self.cursor.execute("SELECT id, name, image_path FROM known_faces")
-        self.known_faces = self.cursor.fetchall()
-        self.display_faces(self.known_faces)
-
-    def search_faces(self, query):
-        filtered = [face for face in self.known_faces if query.lower() in face[1].lower()]
-        self.display_faces(filtered)
-
-    def display_faces(self, faces):
-        self.table.setRowCount(0)
-        for row_index, (face_id, name, image_path) in enumerate(faces):
-            self.table.insertRow(row_index)
-            self.table.setItem(row_index, 0, QTableWidgetItem(name))
-
-            image_label = QLabel()
-            pixmap = QPixmap(image_path)
-            image_label.setPixmap(pixmap.scaled(60, 60, Qt.KeepAspectRatio))
-            self.table.setCellWidget(row_index, 1, image_label)
-
-            details_button = QPushButton("View")
-            promote_button = QPushButton("Promote")
-
-            # Optional: Connect button slots for details/promote
-            self.table.setCellWidget(row_index, 2, details_button)
-            self.table.setCellWidget(row_index, 3, promote_button)
+        # (Re)runs the current search; also called after a face is promoted
+        self.search_timer.stop()
+        seconds = self.model.search(self.search_bar.text())
+        total = self.model.total
+        self.status_label.setText(f"{total} result{'' if total == 1 else 's'} in {seconds * 1000:.1f} ms")
 
 # -----------------------
 # Main Window
 # -----------------------
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, sources=(0,)):
         super().__init__()
         self.setWindowTitle("Smart Security GUI")
         self.setGeometry(100, 100, 1000, 700)
 
         tabs = QTabWidget()
-        tabs.addTab(LiveFeedTab(), "Live Feed")
+        if len(sources) > 1:
+            self.live_feed_tab = MultiCameraTab(sources)
+        else:
+            self.live_feed_tab = LiveFeedTab(sources[0])
+        tabs.addTab(self.live_feed_tab, "Live Feed")
         
-        self.known_faces_tab = KnownFacesTab(connect_db())
+        self.known_faces_tab = KnownFacesTab()
         tabs.addTab(UnknownFacesTab(self.known_faces_tab), "Unknown Faces")
         tabs.addTab(self.known_faces_tab, "Known Faces")
 
         self.setCentralWidget(tabs)
 
+    def closeEvent(self, event):
+        self.live_feed_tab.stop()
+        recognizer.close()
+        super().closeEvent(event)
+
 # -----------------------
 # Run the App
 # -----------------------
 if __name__ == '__main__':
+    # Usage: python face_gui.py [source ...]  (camera index, video file or stream URL)
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    init_db()
+    metrics.enabled = METRICS_ENABLED or bool(METRICS_PORT or METRICS_DUMP_PATH)
+    recognizer = FaceRecognizerDL([], [], UNKNOWN_DIR, metrics=metrics)
+    if METRICS_PORT:
+        MetricsServer(metrics, port=METRICS_PORT).start()
+    if METRICS_DUMP_PATH:
+        MetricsDumper(metrics, METRICS_DUMP_PATH).start()
+
     app = QApplication(sys.argv)
-    window = MainWindow()
+    window = MainWindow(sys.argv[1:] or [0])
     window.show()
     sys.exit(app.exec_())
@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import os
+import queue
+import threading
+
+import cv2
+
+log = logging.getLogger(__name__)
+
+
+class ImageStore:
+    # Content-addressed store for face crops. The name is a hash of the
+    # pixels, so two crops never collide and identical crops are stored once.
+    # Files live in hash-sharded subdirectories (root/ab/cd/<hash>.jpg) and
+    # are JPEG-encoded and written by a background thread; put() only hashes
+    # and queues. Callers keep the returned path and go through open_path(),
+    # read() and delete() instead of touching the file directly, so lookups
+    # also work while a write is still pending. Legacy flat paths pass
+    # through unchanged. With a ThumbnailCache, thumbnails of every written
+    # image are made from the pixels in memory.
+    def __init__(self, root, quality=90, ext=".jpg", shard_depth=2, max_pending=256, thumbnails=None):
+        self.root = root
+        self.thumbnails = thumbnails
+        self.quality = quality
+        self.ext = ext
+        self.shard_depth = shard_depth
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pending = {}  # path -> image not yet on disk
+        self._lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        self.written = 0
+        os.makedirs(root, exist_ok=True)
+
+    def key_for(self, image):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str(image.shape).encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def path_for(self, key):
+        shards = [key[2 * i:2 * i + 2] for i in range(self.shard_depth)]
+        return os.path.join(self.root, *shards, key + self.ext)
+
+    def put(self, image):
+        path = self.path_for(self.key_for(image))
+        with self._lock:
+            if path in self._pending or os.path.exists(path):
+                return path
+            self._pending[path] = image.copy()
+        # Blocks only if the writer is max_pending images behind
+        self._queue.put(path)
+        return path
+
+    def _encode(self, path, image):
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality] if self.ext.lower() in (".jpg", ".jpeg") else []
+        ok, data = cv2.imencode(self.ext, image, params)
+        if not ok:
+            raise IOError(f"Could not encode image for {path}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data.tobytes())
+        os.replace(tmp_path, path)
+
+    def _write(self, path):
+        with self._lock:
+            image = self._pending.get(path)
+        if image is None:
+            return
+        try:
+            self._encode(path, image)
+            self.written += 1
+            if self.thumbnails is not None:
+                self.thumbnails.put(path, image)
+        except Exception as e:
+            log.error("Failed to save %s: %s", path, e)
+        with self._lock:
+            self._pending.pop(path, None)
+
+    def _write_loop(self):
+        while True:
+            path = self._queue.get()
+            try:
+                if path is None:
+                    return
+                self._write(path)
+            finally:
+                self._queue.task_done()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def open_path(self, path):
+        # Filesystem path for readers that need a file (QPixmap, imread);
+        # a still-pending image is written first
+        with self._lock:
+            is_pending = path in self._pending
+        if is_pending:
+            self._write(path)
+        return path
+
+    def read(self, path):
+        with self._lock:
+            image = self._pending.get(path)
+        if image is not None:
+            return image.copy()
+        return cv2.imread(path) if path and os.path.exists(path) else None
+
+    def exists(self, path):
+        with self._lock:
+            if path in self._pending:
+                return True
+        return bool(path) and os.path.exists(path)
+
+    def delete(self, path):
+        with self._lock:
+            self._pending.pop(path, None)
+        if self.thumbnails is not None and path:
+            self.thumbnails.discard(path)
+        try:
+            if path and os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            log.error("Error deleting image: %s", e)
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
@@ -0,0 +1,262 @@
+import bisect
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Histogram bucket upper bounds in seconds, 50us .. ~20s, about 20% apart
+BUCKETS = tuple(5e-5 * 1.2 ** i for i in range(72))
+
+
+class Histogram:
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.5) * 1000, 3),
+            "p95_ms": round(self.quantile(0.95) * 1000, 3),
+            "p99_ms": round(self.quantile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class _StageTimer:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    # Stage timings (histograms), counters, event rates and gauges for the
+    # hot path. A disabled instance hands out a shared no-op timer and
+    # returns straight away from every other call, so instrumented code
+    # costs one attribute check when metrics are off. Gauges are callables
+    # evaluated only when a snapshot is taken.
+    def __init__(self, enabled=True, rate_window=5.0):
+        self.enabled = enabled
+        self.rate_window = rate_window
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+        self._events = {}
+        self._gauges = {}
+
+    def time(self, stage):
+        return _StageTimer(self, stage) if self.enabled else NULL_TIMER
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            hist = self._stages.get(stage)
+            if hist is None:
+                hist = self._stages[stage] = Histogram()
+            hist.observe(seconds)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def mark(self, name):
+        # Records an event for rate (per second) reporting, e.g. frames shown
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            events = self._events.get(name)
+            if events is None:
+                events = self._events[name] = deque()
+            events.append(now)
+            while events[0] < now - self.rate_window:
+                events.popleft()
+
+    def gauge(self, name, fn):
+        self._gauges[name] = fn
+
+    def _rate(self, events, now):
+        while events and events[0] < now - self.rate_window:
+            events.popleft()
+        if len(events) < 2:
+            return 0.0
+        return round((len(events) - 1) / max(now - events[0], 1e-6), 2)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            stages = {name: hist.summary() for name, hist in self._stages.items()}
+            counters = dict(self._counters)
+            rates = {name: self._rate(events, now) for name, events in self._events.items()}
+        gauges = {}
+        for name, fn in list(self._gauges.items()):
+            try:
+                gauges[name] = fn()
+            except Exception as e:
+                gauges[name] = f"error: {e}"
+        return {
+            "time": round(time.time(), 3),
+            "uptime_s": round(time.time() - self.started, 1),
+            "enabled": self.enabled,
+            "stages": stages,
+            "counters": counters,
+            "rates": rates,
+            "gauges": gauges,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self._events.clear()
+
+    def overlay_lines(self, stages=None):
+        # Short text lines for drawing on the video
+        snap = self.snapshot()
+        lines = [f"{name}: {rate:.1f}/s" for name, rate in sorted(snap["rates"].items())]
+        for name, summary in sorted(snap["stages"].items()):
+            if stages is None or name in stages:
+                lines.append(f"{name}: p50 {summary['p50_ms']:.1f} p95 {summary['p95_ms']:.1f} ms")
+        for name, value in sorted(snap["gauges"].items()):
+            lines.append(f"{name}: {value}")
+        return lines
+
+
+def to_prometheus(snapshot, prefix="face_app"):
+    lines = []
+    for name, summary in sorted(snapshot["stages"].items()):
+        metric = f"{prefix}_stage_seconds"
+        for q in ("p50", "p95", "p99"):
+            lines.append(f'{metric}{{stage="{name}",quantile="0.{q[1:]}"}} {summary[q + "_ms"] / 1000:.6f}')
+        lines.append(f'{metric}_count{{stage="{name}"}} {summary["count"]}')
+        lines.append(f'{metric}_sum{{stage="{name}"}} {summary["mean_ms"] * summary["count"] / 1000:.6f}')
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append(f"{prefix}_{name}_total {value}")
+    for name, value in sorted(snapshot["rates"].items()):
+        lines.append(f"{prefix}_{name}_per_second {value}")
+    for name, value in sorted(snapshot["gauges"].items()):
+        if isinstance(value, dict):
+            for key, v in sorted(value.items()):
+                lines.append(f'{prefix}_{name}{{key="{key}"}} {v}')
+        elif isinstance(value, (int, float)):
+            lines.append(f"{prefix}_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    # Local HTTP endpoint: GET /metrics returns the JSON snapshot,
+    # /metrics?format=prometheus the text exposition format
+    def __init__(self, metrics, host="127.0.0.1", port=9108):
+        self.metrics = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                url = urlparse(handler.path)
+                if url.path not in ("/", "/metrics"):
+                    handler.send_error(404)
+                    return
+                snapshot = metrics.snapshot()
+                if parse_qs(url.query).get("format") == ["prometheus"]:
+                    body, content_type = to_prometheus(snapshot).encode(), "text/plain; version=0.0.4"
+                else:
+                    body, content_type = json.dumps(snapshot).encode(), "application/json"
+                handler.send_response(200)
+                handler.send_header("Content-Type", content_type)
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsDumper(threading.Thread):
+    # Rewrites path with the latest JSON snapshot every interval seconds
+    def __init__(self, metrics, path, interval=10.0):
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stopping = threading.Event()
+
+    def dump(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.metrics.snapshot(), f)
+        os.replace(tmp_path, self.path)
+
+    def run(self):
+        while not self._stopping.wait(self.interval):
+            self.dump()
+
+    def stop(self):
+        self._stopping.set()
+        self.dump()
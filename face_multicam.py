@@ -0,0 +1,381 @@
+import logging
+import multiprocessing as mp
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+import face_db
+from face_db import decode_encoding, get_known_changes, get_known_encodings, get_known_version
+from face_gallery import KnownGallery
+from face_recognizer import FaceRecognizerDL, FaceResult
+from face_snapshot import ensure_snapshot
+from face_worker import FrameGrabber, RecognitionWorker
+
+log = logging.getLogger(__name__)
+
+MAX_FACES = 32
+
+RESULT_DTYPE = np.dtype([
+    ("frame_time", "f8"),
+    ("count", "i4"),
+    ("boxes", "i4", (MAX_FACES, 4)),
+    # Names travel with the results: camera processes apply known-face
+    # changes on their own, so their label tables can differ
+    ("names", "U64", (MAX_FACES,)),
+    ("distances", "f4", (MAX_FACES,)),
+])
+
+
+class SharedArray:
+    # numpy array backed by a named shared-memory block
+    def __init__(self, shape, dtype, name=None):
+        dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(shape)) * dtype.itemsize)
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        self.spec = (self.shm.name, tuple(shape), dtype.str if not dtype.fields else dtype.descr)
+
+    @classmethod
+    def attach(cls, spec):
+        name, shape, dtype = spec
+        return cls(shape, np.dtype(dtype), name=name)
+
+    def close(self):
+        self.array = None
+        try:
+            self.shm.close()
+        finally:
+            # Unlinked even if a view keeps it mapped here
+            if self.owner:
+                self.shm.unlink()
+
+
+class SharedRing:
+    # Single-writer ring of fixed-shape items in shared memory. Each slot's
+    # sequence number doubles as a seqlock: readers check it before and after
+    # copying and retry if the writer lapped them.
+    def __init__(self, item_shape, dtype, slots=3, specs=None):
+        self.slots = slots
+        if specs is None:
+            self.items = SharedArray((slots,) + tuple(item_shape), dtype)
+            self.seqs = SharedArray((slots + 1,), np.int64)
+            self.seqs.array[:] = 0
+        else:
+            self.items = SharedArray.attach(specs[0])
+            self.seqs = SharedArray.attach(specs[1])
+
+    @property
+    def specs(self):
+        return self.items.spec, self.seqs.spec
+
+    @classmethod
+    def attach(cls, slots, specs):
+        return cls(None, None, slots, specs)
+
+    def write(self, item):
+        seqs = self.seqs.array
+        seq = int(seqs[-1]) + 1
+        slot = seq % self.slots
+        seqs[slot] = -1
+        self.items.array[slot] = item
+        seqs[slot] = seq
+        seqs[-1] = seq
+        return seq
+
+    def read(self, last_seq=0, retries=3):
+        # (seq, copy of the newest item) or None if nothing newer than last_seq
+        seqs = self.seqs.array
+        for _ in range(retries):
+            seq = int(seqs[-1])
+            if seq <= last_seq:
+                return None
+            slot = seq % self.slots
+            if seqs[slot] != seq:
+                continue
+            item = self.items.array[slot].copy()
+            if seqs[slot] == seq:
+                return seq, item
+        return None
+
+    def close(self):
+        self.items.close()
+        self.seqs.close()
+
+
+def load_gallery_arrays():
+    gallery = KnownGallery()
+    version = get_known_version()
+    rows = get_known_encodings()
+    gallery.load([r[0] for r in rows], [r[1] for r in rows], [decode_encoding(r[2]) for r in rows])
+    gallery.version = version
+    return gallery
+
+
+def publish_gallery(gallery):
+    # Copies the known gallery into shared memory once; every camera process
+    # maps the same pages read-only
+    shared = [SharedArray(arr.shape, arr.dtype) for arr in (gallery.matrix, gallery.ids, gallery.label_ids)]
+    for block, arr in zip(shared, (gallery.matrix, gallery.ids, gallery.label_ids)):
+        block.array[:] = arr
+    spec = {"arrays": [block.spec for block in shared], "labels": list(gallery.labels),
+            "version": gallery.version}
+    return shared, spec
+
+
+def wrap_gallery(blocks, labels, version):
+    # A read-only gallery over published blocks, without copying them
+    matrix, ids, label_ids = (block.array for block in blocks)
+    matrix.flags.writeable = False
+    gallery = KnownGallery.from_arrays(ids, label_ids, labels, matrix)
+    gallery.version = version
+    return gallery
+
+
+def attach_gallery(spec):
+    blocks = [SharedArray.attach(s) for s in spec["arrays"]]
+    return wrap_gallery(blocks, spec["labels"], spec["version"]), blocks
+
+
+def close_blocks(blocks):
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            pass  # a view is still alive; the mapping goes with the process
+
+
+def take_published_gallery(recognizer, updates, blocks):
+    # Swaps the recognizer over to the newest gallery the manager published,
+    # if any, and unmaps the one it replaces. Returns the blocks in use.
+    spec = None
+    while True:
+        try:
+            spec = updates.get_nowait()
+        except queue.Empty:
+            break
+    if spec is None:
+        return blocks
+    try:
+        gallery, new_blocks = attach_gallery(spec)
+    except FileNotFoundError:
+        return blocks  # already replaced; the newer spec is queued
+    recognizer.replace_gallery(gallery)
+    close_blocks(blocks)
+    return new_blocks
+
+
+def camera_process(index, source, db_path, gallery_spec, gallery_updates, frame_specs, result_specs, slots,
+                   alerts, stop_event, loop, recognizer_kwargs):
+    face_db.DB_PATH = db_path
+    # Without a spec the recognizer loads the gallery (snapshot or index) itself
+    gallery, blocks = attach_gallery(gallery_spec) if gallery_spec else (None, [])
+    if gallery_spec:
+        # Known-face changes arrive as newly published galleries; syncing
+        # here would copy the shared rows into this process
+        recognizer_kwargs = dict(recognizer_kwargs, known_sync_interval=0)
+    frames = SharedRing.attach(slots, frame_specs)
+    results = SharedRing.attach(slots, result_specs)
+    frame_shape = frames.items.array.shape[1:]
+
+    def send_alert(name, image_path):
+        try:
+            alerts.put_nowait((index, time.time(), name, image_path))
+        except queue.Full:
+            pass
+
+    recognizer = FaceRecognizerDL([], [], gallery=gallery, **recognizer_kwargs)
+    gallery = None  # the recognizer holds the only reference, so swaps can unmap it
+    grabber = FrameGrabber(source, loop=loop)
+    worker = RecognitionWorker(recognizer, send_alert)
+    grabber.start()
+    worker.start()
+
+    last_result_seq = 0
+    record = np.zeros((), dtype=RESULT_DTYPE)
+    try:
+        while not stop_event.is_set() and not grabber.finished.is_set():
+            if gallery_spec:
+                blocks = take_published_gallery(recognizer, gallery_updates, blocks)
+            captured = grabber.frames.take(timeout=0.1)[0]
+            if captured is not None:
+                frame_time, frame = captured
+                if frame.shape != frame_shape:
+                    frame = cv2.resize(frame, (frame_shape[1], frame_shape[0]))
+                frames.write(frame)
+                worker.submit(frame, frame_time)
+
+            faces, seq, frame_time = worker.results()
+            if seq != last_result_seq:
+                last_result_seq = seq
+                faces = faces[:MAX_FACES]
+                record["frame_time"] = frame_time
+                record["count"] = len(faces)
+                for i, face in enumerate(faces):
+                    record["boxes"][i] = face.box
+                    record["names"][i] = face.name
+                    record["distances"][i] = face.distance
+                results.write(record)
+    finally:
+        # Shared blocks are unmapped when the process exits; the manager
+        # owns and unlinks them
+        worker.stop()
+        grabber.stop()
+        worker.join(timeout=2)
+        grabber.join(timeout=2)
+        recognizer.close()
+
+
+class MultiCameraManager:
+    # One capture/recognition process per source. Frames and results come
+    # back through shared-memory rings; alerts through a small queue.
+    def __init__(self, sources, frame_size=(720, 1280), unknown_dir="unknown_faces",
+                 loop_files=True, slots=3, recognizer_kwargs=None):
+        self.sources = list(sources)
+        self.frame_size = frame_size
+        self.loop_files = loop_files
+        self.slots = slots
+        self.recognizer_kwargs = dict(recognizer_kwargs or {}, unknown_dir=unknown_dir)
+        self.ctx = mp.get_context("spawn")
+        self.processes = []
+        self.frame_rings = []
+        self.result_rings = []
+        self._gallery = None
+        self._gallery_blocks = []  # published generations, oldest first
+        self._gallery_updates = []
+        self._publish_thread = None
+        self._last_results = {}
+
+    def start(self):
+        options = self.recognizer_kwargs
+        if options.get("use_snapshot") or options.get("use_quantized") or options.get("use_ann"):
+            # These modes load the gallery in every process: an index cannot
+            # sit on the shared gallery, and the snapshot and the int8
+            # index's exact rows are memory-mapped, so their pages are
+            # shared anyway
+            if options.get("use_snapshot"):
+                # Brought up to date once here; the processes then only map it
+                ensure_snapshot(face_db.DB_PATH)
+            if options.get("use_ann"):
+                log.warning("The IVF index keeps a private copy of the known encodings in each of %d "
+                            "camera processes; use_quantized shares them", len(self.sources))
+            gallery_spec = None
+        else:
+            self._gallery = load_gallery_arrays()
+            gallery_spec = self._publish()
+        self.stop_event = self.ctx.Event()
+        self.alert_queue = self.ctx.Queue(maxsize=1000)
+
+        h, w = self.frame_size
+        for index, source in enumerate(self.sources):
+            frames = SharedRing((h, w, 3), np.uint8, self.slots)
+            results = SharedRing((), RESULT_DTYPE, self.slots)
+            self.frame_rings.append(frames)
+            self.result_rings.append(results)
+            updates = self.ctx.Queue()
+            self._gallery_updates.append(updates)
+            process = self.ctx.Process(
+                target=camera_process,
+                args=(index, source, face_db.DB_PATH, gallery_spec, updates, frames.specs, results.specs,
+                      self.slots, self.alert_queue, self.stop_event, self.loop_files, self.recognizer_kwargs),
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+
+        interval = self.recognizer_kwargs.get("known_sync_interval", 2.0)
+        if gallery_spec and interval:
+            self._publish_stop = threading.Event()
+            self._publish_thread = threading.Thread(target=self._publish_loop, args=(interval,), daemon=True)
+            self._publish_thread.start()
+
+    def _publish(self):
+        # Publishes the manager's gallery as a new shared generation and
+        # re-points the manager at it, so only the shared copy stays resident
+        blocks, spec = publish_gallery(self._gallery)
+        self._gallery = wrap_gallery(blocks, spec["labels"], spec["version"])
+        self._gallery_blocks.append(blocks)
+        # A camera may still be attaching the previous generation
+        while len(self._gallery_blocks) > 2:
+            close_blocks(self._gallery_blocks.pop(0))
+        return spec
+
+    def republish_gallery(self):
+        # Applies known_faces changes and hands every camera process the new
+        # gallery, instead of each process applying them to a private copy.
+        # Returns the change count.
+        changes = get_known_changes(self._gallery.version)
+        if changes is None:
+            # The change log was pruned past our version; start over
+            self._gallery = load_gallery_arrays()
+        elif not changes:
+            return 0
+        else:
+            for face_id, _, name, blob in changes:
+                if blob is None:
+                    self._gallery.remove(face_id)
+                else:
+                    self._gallery.add(face_id, name, decode_encoding(blob))
+            self._gallery.version = max(self._gallery.version, changes[-1][1])
+        spec = self._publish()
+        for updates in self._gallery_updates:
+            updates.put(spec)
+        return len(self._gallery) if changes is None else len(changes)
+
+    def _publish_loop(self, interval):
+        while not self._publish_stop.wait(interval):
+            try:
+                self.republish_gallery()
+            except Exception as e:
+                log.error("Gallery republish failed: %s", e)
+
+    def latest_frame(self, index, last_seq=0):
+        return self.frame_rings[index].read(last_seq)
+
+    def latest_results(self, index):
+        # FaceResult list for the newest recognized frame of this camera
+        read = self.result_rings[index].read()
+        if read is None:
+            return self._last_results.get(index, [])
+        _, record = read
+        faces = []
+        for i in range(int(record["count"])):
+            faces.append(FaceResult(tuple(int(v) for v in record["boxes"][i]), str(record["names"][i]),
+                                    float(record["distances"][i]), None))
+        self._last_results[index] = faces
+        return faces
+
+    def drain_alerts(self):
+        alerts = []
+        while True:
+            try:
+                alerts.append(self.alert_queue.get_nowait())
+            except queue.Empty:
+                return alerts
+
+    def is_alive(self, index):
+        return self.processes[index].is_alive()
+
+    def stop(self):
+        if not self.processes:
+            return
+        self.stop_event.set()
+        if self._publish_thread is not None:
+            self._publish_stop.set()
+            self._publish_thread.join()
+            self._publish_thread = None
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for ring in self.frame_rings + self.result_rings:
+            ring.close()
+        self._gallery = None
+        for blocks in self._gallery_blocks:
+            close_blocks(blocks)
+        self.processes, self.frame_rings, self.result_rings, self._gallery_blocks = [], [], [], []
+        self._gallery_updates = []
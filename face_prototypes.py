@@ -0,0 +1,134 @@
+import numpy as np
+
+from face_gallery import FaceMatch, pairwise_distances, squared_norms
+
+
+def build_prototypes(samples, max_prototypes=4):
+    # Stand-ins for one identity's samples: (vectors, radii, is_sample).
+    # Identities with few samples keep them all (radius 0). Otherwise the
+    # centroid plus max_prototypes - 1 medoids picked by farthest-first
+    # traversal, starting from the sample nearest the centroid so the spread
+    # of poses/lighting is covered. Each sample is assigned to its nearest
+    # prototype; a prototype's radius is the farthest sample it covers.
+    n = len(samples)
+    if n <= max_prototypes:
+        return samples.copy(), np.zeros(n, dtype=np.float32), np.ones(n, dtype=bool)
+    centre = samples.mean(axis=0, dtype=np.float64).astype(np.float32)
+    chosen = [int(np.linalg.norm(samples - centre, axis=1).argmin())]
+    nearest = np.linalg.norm(samples - samples[chosen[0]], axis=1)
+    for _ in range(max_prototypes - 2):
+        pick = int(nearest.argmax())
+        chosen.append(pick)
+        np.minimum(nearest, np.linalg.norm(samples - samples[pick], axis=1), out=nearest)
+
+    vectors = np.vstack([centre[None, :], samples[chosen]])
+    distances = pairwise_distances(samples, vectors)
+    owner = distances.argmin(axis=1)
+    radii = np.zeros(len(vectors), dtype=np.float32)
+    np.maximum.at(radii, owner, distances[np.arange(n), owner])
+    is_sample = np.ones(len(vectors), dtype=bool)
+    is_sample[0] = False
+    return vectors, radii, is_sample
+
+
+class IdentityPrototypes:
+    # Matching layer over a KnownGallery that compares queries with a few
+    # prototypes per identity instead of every enrolled sample. A
+    # prototype's radius bounds the distance to any sample it covers
+    # (triangle inequality), so per identity
+    #   lower = min(d(q, p) - radius)  <=  true best  <=  upper = min d(q, medoid)
+    # Identities whose lower bound cannot beat the tolerance or the best
+    # upper bound are dropped without touching their samples; the full
+    # samples are only scanned when the bounds leave the answer open (a
+    # close call between identities, or a bound straddling the tolerance).
+    # The winner is the identity with the nearest sample, so an identity
+    # with many samples does not outvote one with few.
+    def __init__(self, max_prototypes=4):
+        self.max_prototypes = max_prototypes
+        self._per_label = {}  # label id -> (vectors, radii, is_sample)
+        self._dirty = set()
+        self._all_dirty = True
+        self.queries = 0
+        self.reranked = 0
+
+    def invalidate(self, label_id=None):
+        # None: every identity (e.g. after a reload)
+        if label_id is None:
+            self._all_dirty = True
+        else:
+            self._dirty.add(int(label_id))
+
+    def _refresh(self, gallery):
+        if not self._all_dirty and not self._dirty:
+            return
+        label_ids = gallery.label_ids
+        order = np.argsort(label_ids, kind="stable")
+        labels, starts = np.unique(label_ids[order], return_index=True)
+        bounds = np.append(starts, len(order))
+        self._members = {int(l): order[bounds[i]:bounds[i + 1]] for i, l in enumerate(labels)}
+
+        if self._all_dirty:
+            self._per_label = {}
+        for label in list(self._per_label):
+            if label in self._dirty or label not in self._members:
+                del self._per_label[label]
+        matrix = gallery.matrix
+        for label, rows in self._members.items():
+            if label not in self._per_label:
+                self._per_label[label] = build_prototypes(matrix[rows], self.max_prototypes)
+
+        # One matrix of every prototype, grouped by identity
+        self._labels = np.array(sorted(self._per_label), dtype=np.int64)
+        parts = [self._per_label[int(l)] for l in self._labels]
+        counts = np.array([len(p[0]) for p in parts], dtype=np.int64)
+        self._starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+        if parts:
+            self._matrix = np.ascontiguousarray(np.vstack([p[0] for p in parts]), dtype=np.float32)
+            self._radii = np.concatenate([p[1] for p in parts])
+            self._is_sample = np.concatenate([p[2] for p in parts])
+        else:
+            self._matrix = np.empty((0, gallery.dim), dtype=np.float32)
+            self._radii = np.empty(0, dtype=np.float32)
+            self._is_sample = np.empty(0, dtype=bool)
+        self._sq_norms = squared_norms(self._matrix)
+        self._dirty.clear()
+        self._all_dirty = False
+
+    def _bounds(self, queries):
+        # Per (query, identity) lower and upper bounds on the best distance
+        distances = pairwise_distances(queries, self._matrix, self._sq_norms)
+        lower = np.minimum.reduceat(distances - self._radii, self._starts, axis=1)
+        upper = np.minimum.reduceat(np.where(self._is_sample, distances, np.inf), self._starts, axis=1)
+        return np.maximum(lower, 0.0), upper
+
+    def _exact(self, gallery, query, positions):
+        # Best exact distance to each identity in positions (indexes into
+        # self._labels), scanning their samples only
+        rows = [self._members[int(self._labels[p])] for p in positions]
+        flat = np.concatenate(rows)
+        distances = pairwise_distances(query[None, :], gallery.matrix[flat], gallery.sq_norms[flat])[0]
+        starts = np.concatenate([[0], np.cumsum([len(r) for r in rows])[:-1]])
+        return np.minimum.reduceat(distances, starts)
+
+    def match(self, gallery, queries, tolerance=0.6, k=5):
+        self._refresh(gallery)
+        lower, upper = self._bounds(queries)
+        best_upper = upper.min(axis=1)
+        results = []
+        for q in range(len(queries)):
+            self.queries += 1
+            # Identities that could still hold the nearest sample
+            open_ = np.flatnonzero(lower[q] <= min(tolerance, best_upper[q]))
+            estimate = upper[q].copy()
+            if len(open_) > 1 or (len(open_) == 1 and upper[q, open_[0]] > tolerance):
+                self.reranked += 1
+                estimate[open_] = self._exact(gallery, queries[q], open_)
+
+            nearest = np.argsort(estimate, kind="stable")[:k]
+            candidates = [(gallery.labels[self._labels[p]], float(estimate[p])) for p in nearest]
+            best = nearest[0]
+            if estimate[best] <= tolerance:
+                results.append(FaceMatch(gallery.labels[self._labels[best]], float(estimate[best]), candidates))
+            else:
+                results.append(FaceMatch("Unknown", float(estimate[best]), candidates))
+        return results
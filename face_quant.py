@@ -0,0 +1,306 @@
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+from face_file_lock import load_or_build as load_or_build_index
+from face_gallery import ENCODING_DIM, RowLookup, as_matrix, pairwise_distances, squared_norms, top_k
+
+# Codes are widened to float32 a cache-sized chunk at a time
+SCAN_CHUNK = 1024
+# Below this many rows the quantizer is refit when an added face falls
+# outside its range; larger galleries keep the range and clip outliers
+REFIT_ROWS = 4096
+
+
+def quant_path_for(db_path):
+    # Codes sit next to the database; the exact vectors go in a separate
+    # .npy so they can be memory-mapped
+    return os.path.splitext(db_path)[0] + ".q8.npz"
+
+
+def vectors_path_for(path):
+    return os.path.splitext(path)[0] + ".f32.npy"
+
+
+class ScalarQuantizer:
+    # Per-dimension affine map of float32 values onto int8 codes:
+    # x ~ lo + scale * (code + 128). Trained on the gallery's own range, so
+    # the reconstruction error is at most scale / 2 per dimension.
+    def __init__(self, lo, scale):
+        self.lo = np.asarray(lo, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def train(cls, vectors):
+        lo = vectors.min(axis=0)
+        hi = vectors.max(axis=0)
+        return cls(lo, np.maximum(hi - lo, 1e-6) / 255.0)
+
+    def encode(self, vectors):
+        steps = np.rint((vectors - self.lo) / self.scale)
+        return (np.clip(steps, 0, 255) - 128).astype(np.int8)
+
+    def decode(self, codes):
+        return self.lo + self.scale * (codes.astype(np.float32) + 128.0)
+
+    def covers(self, vectors):
+        return bool(((vectors >= self.lo) & (vectors <= self.lo + 255.0 * self.scale)).all())
+
+
+class QuantizedIndex:
+    # Known encodings as int8 codes (128 bytes per face instead of 512) for
+    # an approximate full scan, plus the exact float32 vectors, memory-mapped
+    # once the index has been saved, for re-ranking. A query scans every
+    # code, keeps the rerank * k nearest by approximate distance, and
+    # returns them ordered by exact distance, so distances near the
+    # tolerance are never decided on the quantized values. Plugs in as
+    # KnownGallery.index like IVFIndex.
+    def __init__(self, rerank=4, dim=ENCODING_DIM):
+        self.rerank = rerank
+        self.dim = dim
+        self.quantizer = None
+        self._set_rows(np.empty((0, dim), np.int8), np.empty(0, np.int64), np.empty((0, dim), np.float32))
+
+    def _set_rows(self, codes, ids, vectors):
+        self.codes = codes
+        self.ids = ids
+        self._base = vectors  # exact vectors of the first len(vectors) rows
+        self._extra = []      # exact vectors of rows added since
+        self._code_sq = self._code_norms(codes)
+        self._live = len(ids)
+        # Removed rows get id -1, so lookups of removed ids miss
+        self._lookup = RowLookup()
+
+    def _rows_of(self, face_ids):
+        return self._lookup.find(self.ids, np.asarray(face_ids, dtype=np.int64).reshape(-1))
+
+    def _code_norms(self, codes):
+        if self.quantizer is None or len(codes) == 0:
+            return np.empty(0, dtype=np.float32)
+        # Decoded a chunk at a time, so loading never holds a float32 copy
+        norms = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), 64 * SCAN_CHUNK):
+            norms[start:start + 64 * SCAN_CHUNK] = squared_norms(self.quantizer.decode(codes[start:start + 64 * SCAN_CHUNK]))
+        return norms
+
+    def __len__(self):
+        return self._live
+
+    @property
+    def is_trained(self):
+        return self.quantizer is not None
+
+    @property
+    def nbytes(self):
+        # Private memory held for scanning (the mapped vectors are not)
+        return self.codes.nbytes + self.ids.nbytes + self._code_sq.nbytes + sum(v.nbytes for v in self._extra)
+
+    def matches(self, ids):
+        return self.is_trained and len(ids) == len(self) and bool((self._rows_of(ids) >= 0).all())
+
+    def build(self, ids, vectors):
+        vectors = as_matrix(vectors, self.dim)
+        self.quantizer = ScalarQuantizer.train(vectors) if len(vectors) else None
+        codes = self.quantizer.encode(vectors) if self.quantizer else np.empty((0, self.dim), np.int8)
+        self._set_rows(codes, np.asarray(ids, dtype=np.int64).copy(), vectors.copy())
+
+    def add(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = as_matrix(vectors, self.dim)
+        self.remove(ids)
+        if not self.is_trained or (len(self) < REFIT_ROWS and not self.quantizer.covers(vectors)):
+            # Fit on the first faces added to an empty index, and refit
+            # while it is small rather than clip new faces to a narrow range
+            live = np.flatnonzero(self.ids >= 0)
+            kept = self._exact_vectors(live) if len(live) else np.empty((0, self.dim), np.float32)
+            self.build(np.concatenate([self.ids[live], ids]), np.concatenate([kept, vectors]))
+            return
+        codes = self.quantizer.encode(vectors)
+        for row, face_id in enumerate(ids, len(self.ids)):
+            self._lookup.place(face_id, row)
+        self.codes = np.concatenate([self.codes, codes])
+        self.ids = np.concatenate([self.ids, ids])
+        self._code_sq = np.concatenate([self._code_sq, self._code_norms(codes)])
+        self._extra.extend(vectors)
+        self._live += len(ids)
+
+    def remove(self, ids):
+        # Rows are only marked dead; save() drops them
+        rows = self._rows_of(ids)
+        rows = np.unique(rows[rows >= 0])
+        for face_id in self.ids[rows]:
+            self._lookup.forget(face_id)
+        self.ids[rows] = -1
+        self._code_sq[rows] = np.inf
+        self._live -= len(rows)
+
+    def _exact_vectors(self, rows):
+        n_base = len(self._base)
+        if not self._extra or rows.max() < n_base:
+            return np.asarray(self._base[rows])
+        return np.stack([self._base[r] if r < n_base else self._extra[r - n_base] for r in rows])
+
+    def approximate_distances(self, queries):
+        # Distances from every query to every decoded code, computed as
+        # |q|^2 + |x|^2 - 2 q.x with q.x = code.(scale*q) + (lo + 128*scale).q
+        scaled = np.ascontiguousarray((queries * self.quantizer.scale).T)
+        offset = queries @ (self.quantizer.lo + 128.0 * self.quantizer.scale)
+        dots = np.empty((len(self.codes), len(queries)), dtype=np.float32)
+        buffer = np.empty((SCAN_CHUNK, self.dim), dtype=np.float32)
+        for start in range(0, len(self.codes), SCAN_CHUNK):
+            chunk = self.codes[start:start + SCAN_CHUNK]
+            widened = buffer[:len(chunk)]
+            widened[...] = chunk
+            np.dot(widened, scaled, out=dots[start:start + len(chunk)])
+        d2 = np.ascontiguousarray(dots.T)
+        d2 += offset[:, None]
+        d2 *= -2.0
+        d2 += squared_norms(queries)[:, None]
+        d2 += self._code_sq[None, :]
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    def search(self, queries, k):
+        # Returns (ids, distances), both (n_queries, k), nearest first by
+        # exact distance; missing slots are padded with id -1 and inf.
+        queries = as_matrix(queries, self.dim)
+        out_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        out_dists = np.full((len(queries), k), np.inf, dtype=np.float32)
+        if not self.is_trained or len(self) == 0:
+            return out_ids, out_dists
+
+        approx = self.approximate_distances(queries)
+        shortlist = top_k(approx, min(len(self), k * self.rerank))
+        for q, rows in enumerate(shortlist):
+            rows = rows[np.isfinite(approx[q, rows])]
+            if len(rows) == 0:
+                continue
+            exact = pairwise_distances(queries[q:q + 1], self._exact_vectors(rows))[0]
+            best = top_k(exact[None, :], k)[0]
+            out_ids[q, :len(best)] = self.ids[rows[best]]
+            out_dists[q, :len(best)] = exact[best]
+        return out_ids, out_dists
+
+    def save(self, path):
+        live = np.flatnonzero(self.ids >= 0)
+        vectors = self._exact_vectors(live) if len(live) else np.empty((0, self.dim), np.float32)
+        vectors_path = vectors_path_for(path)
+        # Per-process temp names: several recognizers may save at once
+        tmp_vectors = f"{vectors_path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_vectors, np.ascontiguousarray(vectors, dtype=np.float32))
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            lo=self.quantizer.lo if self.is_trained else np.empty(0, np.float32),
+            scale=self.quantizer.scale if self.is_trained else np.empty(0, np.float32),
+            codes=self.codes[live],
+            ids=self.ids[live],
+            rerank=self.rerank,
+        )
+        # Vectors first: a reader that sees the new codes also finds them
+        os.replace(tmp_vectors, vectors_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with np.load(path) as data:
+            index = cls(rerank=int(data["rerank"]), dim=data["codes"].shape[1])
+            if len(data["lo"]):
+                index.quantizer = ScalarQuantizer(data["lo"], data["scale"])
+            codes, ids = data["codes"], data["ids"]
+        vectors = np.load(vectors_path_for(path), mmap_mode="r" if mmap else None)
+        if len(vectors) != len(ids):
+            raise ValueError(f"{path}: vectors file does not match the codes")
+        index._set_rows(codes, ids, vectors)
+        return index
+
+
+def load_or_build(ids, vectors, path, **kwargs):
+    def build():
+        index = QuantizedIndex(**kwargs)
+        index.build(ids, vectors)
+        return index
+    return load_or_build_index(QuantizedIndex, ids, build, path)
+
+
+def measure(index, ids, vectors, queries, tolerance=0.6):
+    # Compares the index with an exact scan (the compare_faces rule: a row
+    # matches when its distance is <= tolerance). recall: share of exact
+    # matches found among the returned rows; decision_agreement: queries
+    # where both agree on whether the nearest row is a match, and on which.
+    ids = np.asarray(ids, dtype=np.int64)
+    exact = pairwise_distances(queries, vectors)
+    k = max(1, int((exact <= tolerance).sum(axis=1).max()))
+    found_ids, found_dists = index.search(queries, k)
+    found = expected = agree = 0
+    for q in range(len(queries)):
+        truth = set(ids[exact[q] <= tolerance].tolist())
+        got = set(found_ids[q][found_dists[q] <= tolerance].tolist())
+        found += len(truth & got)
+        expected += len(truth)
+        nearest = exact[q].argmin()
+        if exact[q, nearest] <= tolerance:
+            agree += found_dists[q, 0] <= tolerance and found_ids[q, 0] == ids[nearest]
+        else:
+            agree += found_dists[q, 0] > tolerance
+    return {
+        "tolerance": tolerance,
+        "recall": round(found / expected, 5) if expected else 1.0,
+        "decision_agreement": round(float(agree) / len(queries), 5),
+        "queries": len(queries),
+    }
+
+
+if __name__ == "__main__":
+    import face_db
+    from face_db import decode_encoding, get_known_encodings
+
+    parser = argparse.ArgumentParser(description="Build the int8 known-face index and compare it with exact search.")
+    parser.add_argument("--db", default=face_db.DB_PATH)
+    parser.add_argument("--rerank", type=int, default=4, help="shortlist size as a multiple of k")
+    parser.add_argument("--queries", type=int, default=1000, help="sampled queries for the recall check")
+    parser.add_argument("--noise", type=float, default=0.03, help="per-dimension noise added to sampled queries")
+    parser.add_argument("--synthetic", type=int, default=0, help="measure on N random encodings instead of the database")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        vectors = rng.standard_normal((args.synthetic, ENCODING_DIM), dtype=np.float32) * 0.09
+        ids = np.arange(1, args.synthetic + 1)
+        path = os.path.join(tempfile.gettempdir(), "synthetic.q8.npz")
+    else:
+        face_db.DB_PATH = args.db
+        rows = get_known_encodings()
+        ids = [face_id for face_id, _, _ in rows]
+        vectors = as_matrix([decode_encoding(blob) for _, _, blob in rows]) if rows else np.empty((0, ENCODING_DIM))
+        path = quant_path_for(args.db)
+
+    start = time.perf_counter()
+    index = QuantizedIndex(rerank=args.rerank)
+    index.build(ids, vectors)
+    index.save(path)
+    index = QuantizedIndex.load(path)
+    print(f"[INFO] Quantized {len(index)} encodings in {time.perf_counter() - start:.2f}s -> {path}")
+    print(f"[INFO] float32 matrix {vectors.nbytes / 2**20:.1f} MiB, int8 index {index.nbytes / 2**20:.1f} MiB "
+          f"resident + {os.path.getsize(vectors_path_for(path)) / 2**20:.1f} MiB mapped "
+          f"(peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB)")
+
+    if len(vectors):
+        sample = vectors[rng.integers(0, len(vectors), args.queries)]
+        queries = sample + rng.normal(0, args.noise, sample.shape).astype(np.float32)
+        for batch in (1, 4):
+            start = time.perf_counter()
+            for i in range(0, 64, batch):
+                pairwise_distances(queries[i:i + batch], vectors)
+            exact_ms = (time.perf_counter() - start) / (64 // batch) * 1000
+            start = time.perf_counter()
+            for i in range(0, 64, batch):
+                index.search(queries[i:i + batch], 5)
+            print(f"[INFO] {batch} faces/frame: exact {exact_ms:.2f} ms, "
+                  f"int8 {(time.perf_counter() - start) / (64 // batch) * 1000:.2f} ms")
+        for tolerance in (0.6, 0.5):
+            print(measure(index, ids, vectors, queries, tolerance))
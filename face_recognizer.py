@@ -1,93 +1,449 @@
 import cv2
+import logging
 import os
 import face_recognition
-import datetime
-import pickle
+import threading
 import time
-from face_db import connect_db
+from array import array
+from collections import namedtuple
+import numpy as np
+import face_db
+from face_ann import index_path_for, load_or_build
+from face_db import (
+    decode_encoding, encode_encoding, get_known_changes, get_known_encodings, get_known_version,
+    get_unknown_encodings, iter_known_labels
+)
+from face_file_lock import FileLock, load_matching
+from face_gallery import KnownGallery, UnknownGallery, as_matrix
+from face_image_store import ImageStore
+from face_metrics import Metrics
+from face_quant import QuantizedIndex, load_or_build as load_or_build_quantized, quant_path_for
+from face_prototypes import IdentityPrototypes
+from face_snapshot import ensure_snapshot
+from face_thumbnails import ThumbnailCache
+from face_tracker import FaceTracker
+from face_write_behind import WriteBehindBuffer
+
+log = logging.getLogger(__name__)
+
+# box is (top, right, bottom, left) in frame coordinates; track_id is None
+# when tracking is off
+FaceResult = namedtuple("FaceResult", ["box", "name", "distance", "track_id"])
+
+def draw_results(frame, results):
+    for (top, right, bottom, left), name, _, _ in results:
+        cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+        cv2.putText(frame, name, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+    return frame
 
 class FaceRecognizerDL:
-    def __init__(self, known_encodings, known_names, unknown_dir, cooldown_second=60):
-        self.known_encodings = known_encodings
-        self.known_names = known_names
+    def __init__(self, known_encodings, known_names, unknown_dir, cooldown_second=60,
+                 tolerance=0.6, top_k=5, unknown_tolerance=0.5, unknown_capacity=10000,
+                 use_ann=False, ann_probe=8, use_quantized=False, use_prototypes=False, max_prototypes=4, use_snapshot=False,
+                 detection_scale=1.0, detection_model="hog",
+                 upsample=1, refine_small_faces=False, small_face_px=48,
+                 tracking=False, detect_every=5, gallery=None, image_store=None, image_quality=90,
+                 write_batch=200, write_delay=1.0, record_unknowns=True, metrics=None,
+                 known_sync_interval=2.0):
+        # known_encodings/known_names are accepted for compatibility only;
+        # the gallery is the one copy of the known faces (see the properties)
         self.unknown_dir = unknown_dir
         self.cooldown_second = cooldown_second
+        self.tolerance = tolerance
+        self.top_k = top_k
         self.PAD_FRAC = 0.2
+        self.unknown_tolerance = unknown_tolerance
+        self.use_ann = use_ann
+        self.ann_probe = ann_probe
+        # int8 codes scanned in RAM, exact vectors memory-mapped for re-ranking
+        self.use_quantized = use_quantized
+        self.index_dirty = False
+        self.index_path = None
+        # Known encodings are memory-mapped from a snapshot file next to the
+        # database instead of decoded from SQLite; every process on the host
+        # shares its pages (see face_snapshot)
+        self.use_snapshot = use_snapshot
+        # Detection runs on a copy scaled by detection_scale (<1 is faster but
+        # misses small faces). With refine_small_faces, boxes smaller than
+        # small_face_px are re-detected at full resolution around the hit.
+        self.detection_scale = detection_scale
+        self.detection_model = detection_model
+        self.upsample = upsample
+        self.refine_small_faces = refine_small_faces
+        self.small_face_px = small_face_px
+        # With tracking, full detection runs every detect_every frames
+        self.tracker = FaceTracker() if tracking else None
+        self.detect_every = detect_every
+        self.frame_index = 0
+        # Without record_unknowns (e.g. searching archives) unknown faces are
+        # reported but no crops, rows or alerts are produced for them
+        self.record_unknowns = record_unknowns
+        # Held while recognizing and while the galleries change, so a worker
+        # thread and the GUI can share one recognizer
+        self.lock = threading.RLock()
+        # Stage timings; a disabled Metrics costs next to nothing
+        self.metrics = metrics or Metrics(enabled=False)
+        # A prebuilt gallery (e.g. one shared between camera processes) skips
+        # loading known_faces from the database
+        self.shared_gallery = gallery is not None
+        # With only the int8 index, the gallery keeps ids and labels and the
+        # exact rows stay in the index's memory-mapped file. Prototypes and
+        # snapshots bring their own float32 rows.
+        keep_vectors = not use_quantized or use_prototypes or use_snapshot
+        self.gallery = gallery if gallery is not None else KnownGallery(keep_vectors=keep_vectors)
+        # Identities with many samples are matched through a few prototypes
+        # each; the nearest identity wins instead of the largest vote
+        if use_prototypes:
+            self.gallery.prototypes = IdentityPrototypes(max_prototypes)
+        self.unknowns = UnknownGallery(unknown_capacity)
         os.makedirs(self.unknown_dir, exist_ok=True)
+        # Pre-scaled thumbnails for the GUI, made when crops are saved
+        self.thumbnails = ThumbnailCache(os.path.join(self.unknown_dir, ".thumbs"))
+        self.image_store = image_store or ImageStore(self.unknown_dir, quality=image_quality,
+                                                     thumbnails=self.thumbnails)
+        # New unknowns and sightings are written in batches off the frame loop
+        self.writer = WriteBehindBuffer(max_rows=write_batch, max_delay=write_delay, metrics=self.metrics)
+        self.metrics.gauge("unknown_rows_pending", self.writer.pending)
+        self.metrics.gauge("image_writes_pending", self.image_store.pending)
 
-        self.load_known_faces()
+        if not self.shared_gallery:
+            self.load_known_faces()
+        # Known-face edits made anywhere (GUI, scripts, other processes) are
+        # picked up from the change log and applied as deltas
+        self.known_sync_interval = known_sync_interval
+        self._sync_stop = threading.Event()
+        self._sync_thread = None
+        if known_sync_interval:
+            self._sync_thread = threading.Thread(target=self._sync_loop, daemon=True)
+            self._sync_thread.start()
+        if self.record_unknowns:
+            self.load_unknown_faces()
         self.cooldowns = {}  # Map: encoding_id -> last alert time
 
     def load_known_faces(self):
-        self.known_encodings.clear()
-        self.known_names.clear()
+        with self.lock:
+            self.gallery.index = None
 
-        conn = connect_db()
-        c = conn.cursor()
-        c.execute("SELECT name, encoding FROM known_faces")
-        for name, enc_blob in c.fetchall():
-            self.known_names.append(name)
-            self.known_encodings.append(pickle.loads(enc_blob))
-        conn.close()
+            if self.use_snapshot:
+                self._borrow_snapshot(ensure_snapshot(face_db.DB_PATH))
+            elif not self.gallery.keep_vectors:
+                self._load_quantized_only()
+                return
+            else:
+                # Version first: changes racing with the read are replayed later
+                version = get_known_version()
+                ids, names, encodings = [], [], []
+                for face_id, name, enc_blob in get_known_encodings():
+                    ids.append(face_id)
+                    names.append(name)
+                    encodings.append(decode_encoding(enc_blob))
+                self.gallery.load(ids, names, encodings)
+                self.gallery.version = version
 
-    def detect_and_recognize(self, frame, send_alert):
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        facelocs = face_recognition.face_locations(rgb, model="hog")
-        encodings = face_recognition.face_encodings(rgb, facelocs)
-
-        for (top, right, bottom, left), encoding in zip(facelocs, encodings):
-            matches = face_recognition.compare_faces(self.known_encodings, encoding)
-            name = "Unknown"
-
-            if True in matches:
-                matchedIdxs = [i for (i, b) in enumerate(matches) if b]
-                counts = {}
-                for i in matchedIdxs:
-                    name = self.known_names[i]
-                    counts[name] = counts.get(name, 0) + 1
-                name = max(counts, key=counts.get)
-
-            fw = right - left
-            fh = bottom - top
-            pad_x = int(fw * self.PAD_FRAC)
-            pad_y = int(fh * self.PAD_FRAC)
-
-            h, w = frame.shape[:2]
-            left_p = max(left - pad_x, 0)
-            top_p = max(top - pad_y, 0)
-            right_p = min(right + pad_x, w)
-            bottom_p = min(bottom + pad_y, h)
-
-            if name == "Unknown":
-                self.handle_unknown_face(frame, encoding, top_p, right_p, bottom_p, left_p, send_alert)
-
-            cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-            cv2.putText(frame, name, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+            if self.use_ann:
+                self.index_path = index_path_for(face_db.DB_PATH)
+                self.gallery.index = load_or_build(self.gallery.ids, self.gallery.matrix,
+                                                   self.index_path, n_probe=self.ann_probe)
+                self.index_dirty = False
+            elif self.use_quantized:
+                self.index_path = quant_path_for(face_db.DB_PATH)
+                self.gallery.index = load_or_build_quantized(self.gallery.ids, self.gallery.matrix, self.index_path)
+                self.index_dirty = False
+
+    def _load_quantized_only(self):
+        # Ids and names come from the database; encodings are only decoded
+        # when the saved int8 index is missing or stale, to rebuild it, and
+        # are dropped once it is saved
+        version = get_known_version()
+        self.index_path = quant_path_for(face_db.DB_PATH)
+        ids, label_ids, labels = array("q"), array("q"), {}
+        for face_id, name in iter_known_labels():
+            ids.append(face_id)
+            label_ids.append(labels.setdefault(name, len(labels)))
+        ids, label_ids = np.frombuffer(ids, dtype=np.int64), np.frombuffer(label_ids, dtype=np.int64)
+        index = load_matching(QuantizedIndex, self.index_path, ids)
+        if index is None:
+            rows = get_known_encodings()
+            vectors = as_matrix([decode_encoding(blob) for _, _, blob in rows])
+            index = load_or_build_quantized([face_id for face_id, _, _ in rows], vectors, self.index_path)
+            # Rows that changed between the two reads are in the change log
+            # after version and get replayed by the next sync
+            del rows, vectors
+        self.gallery.borrow(ids, label_ids, list(labels), np.empty((len(ids), 0), dtype=np.float32),
+                            np.zeros(len(ids), dtype=np.float32))
+        self.gallery.index = index
+        self.gallery.version = version
+        self.index_dirty = False
+
+    def _borrow_snapshot(self, snapshot):
+        self.gallery.borrow(snapshot.ids, snapshot.label_ids, snapshot.labels, snapshot.matrix, snapshot.sq_norms)
+        self.gallery.version = snapshot.version
+
+    @property
+    def known_encodings(self):
+        # (n, 128) view of the gallery rows, in gallery order
+        return self.gallery.matrix
+
+    @property
+    def known_names(self):
+        return self.gallery.names
+
+    def add_known_face(self, face_id, name, encoding):
+        # Callers have written the row already. A snapshot gallery takes it
+        # through the snapshot, so its rows stay mapped instead of copied.
+        if self.use_snapshot and not self.shared_gallery:
+            self._sync_from_snapshot()
+            return
+        with self.lock:
+            self.gallery.add(face_id, name, encoding)
+            self.index_dirty = self.gallery.index is not None
+
+    def sync_known_faces(self):
+        # Applies known_faces changes newer than the gallery's version. The
+        # query and decoding run without the lock; only the row updates
+        # themselves wait for the frame in progress. Returns the change count.
+        if self.use_snapshot and not self.shared_gallery:
+            return self._sync_from_snapshot()
+        changes = get_known_changes(self.gallery.version)
+        if changes is None:
+            return self._reload_known_faces()
+        if not changes:
+            return 0
+        decoded = [(face_id, name, decode_encoding(blob) if blob is not None else None)
+                   for face_id, _, name, blob in changes]
+        with self.lock, self.metrics.time("known_sync"):
+            for face_id, name, encoding in decoded:
+                if encoding is None:
+                    self.gallery.remove(face_id)
+                else:
+                    self.gallery.add(face_id, name, encoding)
+            self.gallery.version = max(self.gallery.version, changes[-1][1])
+            self.index_dirty = self.gallery.index is not None
+        return len(changes)
+
+    def _sync_from_snapshot(self):
+        # Brings the snapshot up to date (the first process to notice the
+        # change rewrites it, the others wait and map the result) and swaps
+        # the gallery over to it, so the rows stay shared instead of being
+        # copied into this process by add()/remove()
+        version = self.gallery.version
+        changes = get_known_changes(version)
+        if changes is None:
+            return self._reload_known_faces()
+        if not changes:
+            return 0
+        snapshot = ensure_snapshot(face_db.DB_PATH)
+        # Read after the snapshot, so it covers every change the snapshot holds
+        changes = get_known_changes(version)
+        if changes is None:
+            return self._reload_known_faces()
+        with self.lock, self.metrics.time("known_sync"):
+            index = self.gallery.index
+            self._borrow_snapshot(snapshot)
+            if index is not None:
+                # Re-add whatever changed at the snapshot's row values
+                changed = [face_id for face_id, _, _, _ in changes]
+                index.remove(changed)
+                rows = self.gallery.rows_of(changed)
+                rows = rows[rows >= 0]
+                if len(rows):
+                    index.add(self.gallery.ids[rows], self.gallery.matrix[rows])
+                self.index_dirty = True
+        return len(changes)
+
+    def _reload_known_faces(self):
+        # The change log no longer reaches back to the gallery's version
+        # (see face_db.prune_known_changes); returns the new row count
+        log.info("Known-face changes since version %d were pruned; reloading", self.gallery.version)
+        self.load_known_faces()
+        return len(self.gallery)
+
+    def replace_gallery(self, gallery):
+        # Swaps in a newly published gallery (see face_multicam); prototypes
+        # carry over and are rebuilt for the new rows
+        with self.lock:
+            gallery.prototypes = self.gallery.prototypes
+            gallery._invalidate()
+            self.gallery = gallery
+
+    def _sync_loop(self):
+        while not self._sync_stop.wait(self.known_sync_interval):
+            try:
+                self.sync_known_faces()
+            except Exception as e:
+                log.error("Known-face sync failed: %s", e)
+
+    def remove_known_face(self, face_id):
+        if self.use_snapshot and not self.shared_gallery:
+            self._sync_from_snapshot()
+            return
+        with self.lock:
+            if self.gallery.remove(face_id):
+                self.index_dirty = self.gallery.index is not None
+
+    def forget_unknown(self, face_id):
+        with self.lock:
+            self.unknowns.remove(face_id)
+            self.cooldowns.pop(face_id, None)
+        self.writer.discard(face_id)
+
+    def close(self):
+        # Persists the ANN index and finishes pending image and row writes
+        self._sync_stop.set()
+        self.save_index()
+        self.image_store.close()
+        self.thumbnails.close()
+        self.writer.close()
 
+    def save_index(self):
+        with self.lock:
+            self._save_index()
+
+    def _save_index(self):
+        if self.gallery.index is not None and self.index_dirty:
+            with FileLock(self.index_path):
+                self.gallery.index.save(self.index_path)
+            self.index_dirty = False
+
+    def load_unknown_faces(self):
+        # Only the most recent unknowns are kept resident
+        rows = get_unknown_encodings(self.unknowns.capacity)
+
+        # Oldest first, so the newest rows end up most recently seen
+        self.unknowns.load(
+            (uid, decode_encoding(enc_blob), image_path, float(age))
+            for age, (uid, enc_blob, image_path) in enumerate(reversed(rows))
+        )
+
+    def detect_faces(self, rgb):
+        scale = self.detection_scale
+        if scale >= 1.0:
+            return face_recognition.face_locations(rgb, self.upsample, self.detection_model)
+
+        small = cv2.resize(rgb, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        h, w = rgb.shape[:2]
+        boxes = []
+        for box in face_recognition.face_locations(small, self.upsample, self.detection_model):
+            top, right, bottom, left = (int(round(v / scale)) for v in box)
+            box = (max(top, 0), min(right, w), min(bottom, h), max(left, 0))
+            if self.refine_small_faces and box[2] - box[0] < self.small_face_px:
+                box = self._refine_box(rgb, box)
+            boxes.append(box)
+        return boxes
+
+    def _refine_box(self, rgb, box):
+        # Full-resolution pass over a window around a small face; keeps the
+        # rescaled box if nothing better is found.
+        top, right, bottom, left = box
+        h, w = rgb.shape[:2]
+        margin = max(bottom - top, right - left)
+        y0, y1 = max(top - margin, 0), min(bottom + margin, h)
+        x0, x1 = max(left - margin, 0), min(right + margin, w)
+        found = face_recognition.face_locations(rgb[y0:y1, x0:x1], self.upsample, self.detection_model)
+        if not found:
+            return box
+        cy, cx = (top + bottom) / 2 - y0, (left + right) / 2 - x0
+        t, r, b, l = min(found, key=lambda f: ((f[0] + f[2]) / 2 - cy) ** 2 + ((f[1] + f[3]) / 2 - cx) ** 2)
+        return (t + y0, r + x0, b + y0, l + x0)
+
+    def detect_and_recognize(self, frame, send_alert):
+        results = self.recognize(frame, send_alert)
+        self.draw_results(frame, results)
         return frame
 
-    def handle_unknown_face(self, frame, encoding, top_p, right_p, bottom_p, left_p, send_alert):
-        conn = connect_db()
-        c = conn.cursor()
+    def recognize(self, frame, send_alert):
+        # Returns a FaceResult per face; does not draw on the frame
+        with self.lock, self.metrics.time("recognize"):
+            results = self._recognize(frame, send_alert)
+        self.metrics.mark("recognized_fps")
+        self.metrics.count("faces", len(results))
+        return results
+
+    def _recognize(self, frame, send_alert):
+        if self.tracker is not None:
+            return self._recognize_tracked(frame, send_alert)
+
+        metrics = self.metrics
+        with metrics.time("bgr_to_rgb"):
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        with metrics.time("detect"):
+            facelocs = self.detect_faces(rgb)
+        # Encodings always come from the full-resolution frame
+        with metrics.time("encode"):
+            encodings = face_recognition.face_encodings(rgb, facelocs)
 
-        c.execute("SELECT id, encoding FROM unknown_faces")
-        unknowns = c.fetchall()
-        conn.close()
+        # Match every face in the frame against the gallery in one call
+        with metrics.time("match_known"):
+            matches = self.gallery.match(encodings, self.tolerance, self.top_k)
 
-        min_dist = float("inf")
-        min_id = None
+        results = []
+        for box, encoding, match in zip(facelocs, encodings, matches):
+            if match.name == "Unknown":
+                with metrics.time("handle_unknown"):
+                    self._handle_unknown_box(frame, box, encoding, send_alert)
+            results.append(FaceResult(box, match.name, match.distance, None))
+        return results
 
-        for uid, enc_blob in unknowns:
-            stored_encoding = pickle.loads(enc_blob)
-            dist = face_recognition.face_distance([stored_encoding], encoding)[0]
-            if dist < min_dist:
-                min_dist = dist
-                min_id = uid
+    def _recognize_tracked(self, frame, send_alert):
+        # Full detection every detect_every frames; in between, tracks follow
+        # optical flow and keep their identity. Only tracks that are new,
+        # re-acquired, drifting or stale are re-encoded.
+        metrics = self.metrics
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        detect = self.frame_index % self.detect_every == 0 or not self.tracker.tracks
+        self.frame_index += 1
+
+        if not detect:
+            with metrics.time("track"):
+                self.tracker.propagate(gray)
+        else:
+            with metrics.time("bgr_to_rgb"):
+                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            with metrics.time("detect"):
+                boxes = self.detect_faces(rgb)
+            with metrics.time("track"):
+                stale = self.tracker.update(gray, boxes)
+            if stale:
+                with metrics.time("encode"):
+                    encodings = face_recognition.face_encodings(rgb, [t.box for t in stale])
+                with metrics.time("match_known"):
+                    matches = self.gallery.match(encodings, self.tolerance, self.top_k)
+                for track, encoding, match in zip(stale, encodings, matches):
+                    track.observe(encoding, match.name, match.distance)
+                    if track.name == "Unknown" and not track.unknown_handled:
+                        track.unknown_handled = True
+                        with metrics.time("handle_unknown"):
+                            self._handle_unknown_box(frame, track.box, encoding, send_alert)
+
+        return [FaceResult(t.box, t.name, t.distance, t.id)
+                for t in self.tracker.tracks if t.votes]
+
+    def _handle_unknown_box(self, frame, box, encoding, send_alert):
+        if not self.record_unknowns:
+            return
+        top, right, bottom, left = box
+        fw = right - left
+        fh = bottom - top
+        pad_x = int(fw * self.PAD_FRAC)
+        pad_y = int(fh * self.PAD_FRAC)
+
+        h, w = frame.shape[:2]
+        left_p = max(left - pad_x, 0)
+        top_p = max(top - pad_y, 0)
+        right_p = min(right + pad_x, w)
+        bottom_p = min(bottom + pad_y, h)
+        self.handle_unknown_face(frame, encoding, top_p, right_p, bottom_p, left_p, send_alert)
+
+    def draw_results(self, frame, results):
+        return draw_results(frame, results)
+
+    def handle_unknown_face(self, frame, encoding, top_p, right_p, bottom_p, left_p, send_alert):
+        ids, dists = self.unknowns.nearest([encoding])
+        min_id, min_dist = int(ids[0]), dists[0]
 
-        TOLERANCE = 0.5
         now = time.time()
 
-        if min_dist > TOLERANCE or not unknowns:
+        if min_dist > self.unknown_tolerance:
             # New unknown face
             face_crop = frame[top_p:bottom_p, left_p:right_p]
             try:
@@ -95,33 +451,25 @@ class FaceRecognizerDL:
             except:
                 passport = face_crop
 
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"unknown_{timestamp}.jpg"
-            image_path = os.path.join(self.unknown_dir, filename)
-            cv2.imwrite(image_path, passport)
+            # Encoded and written in the background by the image store
+            image_path = self.image_store.put(passport)
 
-            conn = connect_db()
-            c = conn.cursor()
-            c.execute("INSERT INTO unknown_faces (image_path, encoding, date_detected) VALUES (?, ?, ?)",
-                      (image_path, pickle.dumps(encoding), datetime.datetime.now().isoformat()))
-            conn.commit()
-            conn.close()
+            # The id is final right away; the row itself is written with the
+            # next batch, and the gallery matches against it in the meantime
+            face_id = self.writer.add_unknown(image_path, encode_encoding(encoding))
+            self.unknowns.add(face_id, encoding, image_path, now)
 
             send_alert("Unknown", image_path)
 
         else:
-            # Existing face, check cooldown
+            # Existing face, keep it hot and check cooldown
+            self.unknowns.touch(min_id, now)
+            self.writer.add_sighting(min_id)
             if min_id not in self.cooldowns or (now - self.cooldowns[min_id] > self.cooldown_second):
                 self.cooldowns[min_id] = now
 
-                conn = connect_db()
-                c = conn.cursor()
-                c.execute("SELECT image_path FROM unknown_faces WHERE id = ?", (min_id,))
-                row = c.fetchone()
-                conn.close()
-
-                if row:
-                    send_alert("Unknown", row[0])
+                image_path = self.unknowns.image_path(min_id)
+                if image_path:
+                    send_alert("Unknown", image_path)
             else:
-                print("[INFO] Skipped duplicate within cooldown")
-
+                log.debug("Skipped duplicate within cooldown")
@@ -0,0 +1,152 @@
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import face_db
+from face_file_lock import FileLock
+from face_gallery import ENCODING_DIM, KnownGallery, squared_norms
+
+log = logging.getLogger(__name__)
+
+# matrix is a read-only memory map; version is the known_faces_changes
+# version the rows reflect
+Snapshot = namedtuple("Snapshot", ["ids", "label_ids", "labels", "matrix", "sq_norms", "version"])
+
+
+def snapshot_path_for(db_path):
+    # Sidecar with ids, labels, norms and version; the matrix lives in
+    # <base>.gallery.<version>.npy next to it
+    return os.path.splitext(db_path)[0] + ".gallery.npz"
+
+
+def _matrix_path(path, version):
+    return f"{os.path.splitext(path)[0]}.{version}.npy"
+
+
+def load_snapshot(path, retries=3):
+    # Maps the current snapshot, or returns None if there is none (or it is
+    # unreadable). A rebuild may delete the matrix between reading the
+    # sidecar and mapping it; the sidecar is then re-read.
+    for _ in range(retries):
+        try:
+            with np.load(path) as meta:
+                version = int(meta["version"])
+                ids, label_ids, sq_norms = meta["ids"], meta["label_ids"], meta["sq_norms"]
+                labels = meta["labels"].tolist()
+            matrix = np.load(_matrix_path(path, version), mmap_mode="r")
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("Ignoring unreadable gallery snapshot %s: %s", path, e)
+            return None
+        if matrix.shape != (len(ids), ENCODING_DIM):
+            log.warning("Ignoring gallery snapshot %s: matrix does not match its sidecar", path)
+            return None
+        return Snapshot(ids, label_ids, labels, matrix, sq_norms, version)
+    return None
+
+
+def _read_all():
+    # (ids, names, matrix, version) straight from known_faces. Version first:
+    # changes racing with the read are replayed by the next update.
+    version = face_db.get_known_version()
+    rows = face_db.get_known_encodings()
+    matrix = np.empty((len(rows), ENCODING_DIM), dtype=np.float32)
+    for i, (_, _, blob) in enumerate(rows):
+        matrix[i] = face_db.decode_encoding(blob)
+    return np.array([r[0] for r in rows], dtype=np.int64), [r[1] for r in rows], matrix, version
+
+
+def _apply_changes(base):
+    # The base snapshot with every known_faces change since its version
+    # applied: changed or deleted rows dropped, current ones appended. Costs
+    # a copy of the matrix, not a decode of every row.
+    changes = face_db.get_known_changes(base.version)
+    if not changes:
+        return None  # pruned past the base (or nothing to do): rebuild
+    changed = np.array([face_id for face_id, _, _, _ in changes], dtype=np.int64)
+    keep = ~np.isin(base.ids, changed)
+    current = [(face_id, name, blob) for face_id, _, name, blob in changes if blob is not None]
+    added = np.empty((len(current), ENCODING_DIM), dtype=np.float32)
+    for i, (_, _, blob) in enumerate(current):
+        added[i] = face_db.decode_encoding(blob)
+    ids = np.concatenate([base.ids[keep], np.array([c[0] for c in current], dtype=np.int64)])
+    names = [base.labels[i] for i in base.label_ids[keep]] + [c[1] for c in current]
+    matrix = np.concatenate([base.matrix[keep], added])
+    return ids, names, matrix, max(base.version, changes[-1][1])
+
+
+def write_snapshot(path, ids, names, matrix, version):
+    labels, label_ids = np.unique(np.asarray(names, dtype=str), return_inverse=True) if len(names) else \
+        (np.empty(0, dtype=str), np.empty(0, dtype=np.int64))
+    matrix_path = _matrix_path(path, version)
+    tmp_matrix = f"{matrix_path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_matrix, np.ascontiguousarray(matrix, dtype=np.float32))
+    os.replace(tmp_matrix, matrix_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, ids=ids, label_ids=label_ids.astype(np.int64), labels=labels,
+             sq_norms=squared_norms(np.asarray(matrix, dtype=np.float32)), version=version)
+    os.replace(tmp_path, path)
+    # Older matrices stay readable by processes that still map them
+    for old in glob.glob(f"{os.path.splitext(path)[0]}.*.npy"):
+        if old != matrix_path and not old.endswith(".tmp.npy"):
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+def ensure_snapshot(db_path=None):
+    # The snapshot of known_faces as it is now: mapped as-is when its
+    # version is current, otherwise brought up to date first (from the old
+    # snapshot plus the change log, or from scratch) and then mapped.
+    path = snapshot_path_for(db_path or face_db.DB_PATH)
+    snapshot = load_snapshot(path)
+    if snapshot is not None and snapshot.version == face_db.get_known_version():
+        return snapshot
+    with FileLock(path):
+        # Another process may have finished the rebuild while we waited
+        snapshot = load_snapshot(path)
+        if snapshot is not None and snapshot.version == face_db.get_known_version():
+            return snapshot
+        start = time.perf_counter()
+        rows = _apply_changes(snapshot) if snapshot is not None else None
+        how = "updated"
+        if rows is None:
+            rows, how = _read_all(), "built"
+        write_snapshot(path, *rows)
+        log.info("Gallery snapshot %s: %d encodings at version %d in %.2fs",
+                 how, len(rows[0]), rows[3], time.perf_counter() - start)
+    return load_snapshot(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or refresh the memory-mapped known-face snapshot.")
+    parser.add_argument("--db", default=face_db.DB_PATH)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s", stream=sys.stderr)
+    face_db.DB_PATH = args.db
+    face_db.init_db()
+    ensure_snapshot(args.db)
+    # What a starting recognizer pays for a ready gallery: decoding every
+    # row vs mapping the file
+    start = time.perf_counter()
+    ids, names, matrix, _ = _read_all()
+    KnownGallery().load(ids, names, matrix)
+    decoded = time.perf_counter() - start
+    start = time.perf_counter()
+    snapshot = load_snapshot(snapshot_path_for(args.db))
+    KnownGallery.from_arrays(snapshot.ids, snapshot.label_ids, snapshot.labels, snapshot.matrix, snapshot.sq_norms)
+    mapped = time.perf_counter() - start
+    print(f"{len(snapshot.ids)} encodings at version {snapshot.version}: "
+          f"database load {decoded * 1000:.1f} ms, snapshot map {mapped * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
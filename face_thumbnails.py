@@ -0,0 +1,152 @@
+import hashlib
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+THUMB_SIZES = (60, 100, 250)
+
+
+def scale_to_fit(image, size):
+    h, w = image.shape[:2]
+    scale = size / max(h, w)
+    if scale >= 1.0:
+        return image
+    return cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+class ThumbnailCache:
+    # Pre-scaled BGR thumbnails of face images, in memory (LRU bounded by
+    # bytes) and on disk as raw .npy arrays, so showing one never decodes a
+    # JPEG. Entries are keyed by source path and mtime: a replaced file gets
+    # new thumbnails. Every configured size is made from one decode of the
+    # source; put() does it from pixels already in memory (e.g. a crop that
+    # was just saved) on a background thread.
+    def __init__(self, root, sizes=THUMB_SIZES, max_bytes=64 * 1024 * 1024, max_pending=256):
+        self.root = root
+        self.sizes = tuple(sizes)
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()  # (path, mtime, size) -> array
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._worker = threading.Thread(target=self._work_loop, daemon=True)
+        self._worker.start()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+
+    def _disk_path(self, path, mtime, size):
+        digest = hashlib.blake2b(f"{os.path.abspath(path)}|{mtime}".encode(), digest_size=16).hexdigest()
+        return os.path.join(self.root, str(size), digest[:2], digest + ".npy")
+
+    def _remember(self, key, thumb):
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._memory[key] = thumb
+            self._bytes += thumb.nbytes
+            while self._bytes > self.max_bytes and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def _write(self, path, mtime, image):
+        # Makes and stores every size; returns {size: thumbnail}
+        thumbs = {}
+        for size in self.sizes:
+            thumb = np.ascontiguousarray(scale_to_fit(image, size))
+            thumbs[size] = thumb
+            self._remember((path, mtime, size), thumb)
+            disk_path = self._disk_path(path, mtime, size)
+            try:
+                os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+                tmp_path = f"{disk_path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    np.save(f, thumb)
+                os.replace(tmp_path, disk_path)
+            except OSError as e:
+                log.error("Could not store thumbnail for %s: %s", path, e)
+        return thumbs
+
+    def get(self, path, size):
+        # Thumbnail no larger than size x size (nearest configured size at or
+        # above it), or None if the source cannot be read
+        size = next((s for s in self.sizes if s >= size), self.sizes[-1])
+        mtime = self._mtime(path)
+        if mtime is None:
+            return None
+        key = (path, mtime, size)
+        with self._lock:
+            thumb = self._memory.get(key)
+            if thumb is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return thumb
+        self.misses += 1
+        try:
+            thumb = np.load(self._disk_path(path, mtime, size))
+            self._remember(key, thumb)
+            return thumb
+        except (OSError, ValueError):
+            pass
+        image = cv2.imread(path)
+        if image is None:
+            return None
+        return self._write(path, mtime, image)[size]
+
+    def put(self, path, image):
+        # Queues thumbnail generation for a freshly written source file
+        try:
+            self._queue.put_nowait((path, image))
+        except queue.Full:
+            pass  # made on first get() instead
+
+    def _work_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                path, image = item
+                mtime = self._mtime(path)
+                if mtime is not None:
+                    self._write(path, mtime, image)
+            except Exception as e:
+                log.error("Thumbnail generation failed: %s", e)
+            finally:
+                self._queue.task_done()
+
+    def discard(self, path):
+        # Call before the source is deleted (the key needs its mtime)
+        mtime = self._mtime(path)
+        with self._lock:
+            for key in [k for k in self._memory if k[0] == path]:
+                self._bytes -= self._memory.pop(key).nbytes
+        if mtime is None:
+            return
+        for size in self.sizes:
+            try:
+                os.remove(self._disk_path(path, mtime, size))
+            except OSError:
+                pass
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._worker.join()
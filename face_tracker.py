@@ -0,0 +1,169 @@
+from collections import Counter, deque
+from itertools import count
+
+import cv2
+import numpy as np
+
+# Boxes use face_recognition's (top, right, bottom, left) order throughout.
+
+
+def iou_matrix(boxes_a, boxes_b):
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top = np.maximum(a[:, None, 0], b[None, :, 0])
+    right = np.minimum(a[:, None, 1], b[None, :, 1])
+    bottom = np.minimum(a[:, None, 2], b[None, :, 2])
+    left = np.maximum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    area_a = (a[:, 1] - a[:, 3]) * (a[:, 2] - a[:, 0])
+    area_b = (b[:, 1] - b[:, 3]) * (b[:, 2] - b[:, 0])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-6), 0.0)
+
+
+def greedy_assign(iou, threshold):
+    # Highest-IoU pairs first; each row and column is used at most once
+    pairs = []
+    if iou.size == 0:
+        return pairs
+    order = np.dstack(np.unravel_index(np.argsort(-iou, axis=None), iou.shape))[0]
+    used_rows, used_cols = set(), set()
+    for row, col in order:
+        if iou[row, col] < threshold:
+            break
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        pairs.append((int(row), int(col)))
+    return pairs
+
+
+class Track:
+    _ids = count(1)
+
+    def __init__(self, box, vote_window):
+        self.id = next(Track._ids)
+        self.box = tuple(int(v) for v in box)
+        self.encoding = None
+        self.distance = float("inf")
+        self.votes = deque(maxlen=vote_window)
+        self.misses = 0
+        self.frames_since_encode = 0
+        self.needs_encoding = True
+        self.unknown_handled = False
+
+    @property
+    def name(self):
+        # Majority over the recent per-encoding results
+        if not self.votes:
+            return "Unknown"
+        return Counter(self.votes).most_common(1)[0][0]
+
+    def observe(self, encoding, name, distance):
+        self.encoding = encoding
+        self.distance = distance
+        self.votes.append(name)
+        self.frames_since_encode = 0
+        self.needs_encoding = False
+
+
+class FaceTracker:
+    # Keeps face identities across frames. Detections are associated to
+    # tracks by IoU; between detections, boxes follow sparse optical flow.
+    # A track asks for a new encoding when it is new, was re-acquired after
+    # being lost, drifted away from its detection, or has not been encoded
+    # for reencode_every detection rounds.
+    def __init__(self, iou_threshold=0.3, drift_iou=0.5, max_misses=2, vote_window=7,
+                 reencode_every=30, min_flow_points=4):
+        self.iou_threshold = iou_threshold
+        self.drift_iou = drift_iou
+        self.max_misses = max_misses
+        self.vote_window = vote_window
+        self.reencode_every = reencode_every
+        self.min_flow_points = min_flow_points
+        self.tracks = []
+        self._prev_gray = None
+
+    def reset(self):
+        self.tracks = []
+        self._prev_gray = None
+
+    def update(self, gray, boxes):
+        # Detection frame: associate, spawn and retire tracks. Returns the
+        # tracks that need a fresh encoding.
+        boxes = [tuple(int(v) for v in b) for b in boxes]
+        iou = iou_matrix([t.box for t in self.tracks], boxes)
+        pairs = greedy_assign(iou, self.iou_threshold)
+
+        matched_tracks = set()
+        matched_boxes = set()
+        for t_idx, b_idx in pairs:
+            track = self.tracks[t_idx]
+            if iou[t_idx, b_idx] < self.drift_iou or track.misses:
+                track.needs_encoding = True
+            track.box = boxes[b_idx]
+            track.misses = 0
+            matched_tracks.add(t_idx)
+            matched_boxes.add(b_idx)
+
+        survivors = []
+        for t_idx, track in enumerate(self.tracks):
+            if t_idx not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    continue
+            survivors.append(track)
+        for b_idx, box in enumerate(boxes):
+            if b_idx not in matched_boxes:
+                survivors.append(Track(box, self.vote_window))
+        self.tracks = survivors
+
+        for track in self.tracks:
+            track.frames_since_encode += 1
+            if track.frames_since_encode >= self.reencode_every:
+                track.needs_encoding = True
+        self._prev_gray = gray
+        return [t for t in self.tracks if t.needs_encoding and not t.misses]
+
+    def propagate(self, gray):
+        # In-between frame: shift every box by the median flow of the
+        # corners found inside it. Tracks that lose their points are missed.
+        prev, self._prev_gray = self._prev_gray, gray
+        if prev is None or not self.tracks:
+            return
+
+        h, w = gray.shape[:2]
+        points, owners = [], []
+        for t_idx, track in enumerate(self.tracks):
+            top, right, bottom, left = track.box
+            roi = prev[max(top, 0):min(bottom, h), max(left, 0):min(right, w)]
+            if roi.size == 0:
+                continue
+            corners = cv2.goodFeaturesToTrack(roi, maxCorners=30, qualityLevel=0.01, minDistance=3)
+            if corners is None:
+                continue
+            corners = corners.reshape(-1, 2) + (max(left, 0), max(top, 0))
+            points.append(corners)
+            owners.append(np.full(len(corners), t_idx))
+
+        moved = set()
+        if points:
+            points = np.concatenate(points).astype(np.float32)
+            owners = np.concatenate(owners)
+            new_points, status, _ = cv2.calcOpticalFlowPyrLK(prev, gray, points.reshape(-1, 1, 2), None)
+            ok = status.reshape(-1) == 1
+            shift = new_points.reshape(-1, 2) - points
+            for t_idx in np.unique(owners[ok]):
+                mine = ok & (owners == t_idx)
+                if mine.sum() < self.min_flow_points:
+                    continue
+                dx, dy = (int(v) for v in np.rint(np.median(shift[mine], axis=0)))
+                top, right, bottom, left = self.tracks[t_idx].box
+                self.tracks[t_idx].box = (top + dy, right + dx, bottom + dy, left + dx)
+                moved.add(int(t_idx))
+
+        for t_idx, track in enumerate(self.tracks):
+            if t_idx not in moved:
+                track.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
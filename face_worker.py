@@ -0,0 +1,154 @@
+import logging
+import os
+import threading
+import time
+
+import cv2
+
+log = logging.getLogger(__name__)
+
+
+class LatestSlot:
+    # Single-item mailbox: put() overwrites whatever has not been taken yet,
+    # so consumers always see the newest item and stale ones are dropped.
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._seq = 0
+        self._taken = 0
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._seq += 1
+            self._cond.notify_all()
+            return self._seq
+
+    def peek(self):
+        with self._cond:
+            return self._item, self._seq
+
+    def take(self, timeout=None):
+        # Waits for an item newer than the last one taken
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._item is not None, timeout):
+                return None, self._taken
+            item, self._item = self._item, None
+            self._taken = self._seq
+            return item, self._seq
+
+    def pending(self):
+        with self._cond:
+            return 0 if self._item is None else 1
+
+
+def parse_source(source):
+    # "0" -> camera index 0; anything else is a file path or stream URL
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+
+class FrameGrabber(threading.Thread):
+    # Capture stage: reads the source as fast as it delivers frames and keeps
+    # only the newest one. Live sources are reopened after a failed read;
+    # video files are played back at their own frame rate and either looped
+    # or finished.
+    def __init__(self, source=0, reconnect_delay=1.0, loop=False):
+        super().__init__(daemon=True)
+        self.source = parse_source(source)
+        self.reconnect_delay = reconnect_delay
+        self.loop = loop
+        self.is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+        self.frames = LatestSlot()
+        self.finished = threading.Event()
+        self._stopping = threading.Event()
+        self.cap = None
+
+    def run(self):
+        self.cap = cv2.VideoCapture(self.source)
+        frame_interval = 0.0
+        if self.is_file:
+            frame_interval = 1.0 / (self.cap.get(cv2.CAP_PROP_FPS) or 25.0)
+        next_frame = time.perf_counter()
+
+        while not self._stopping.is_set():
+            ret, frame = self.cap.read()
+            if not ret:
+                if self.is_file:
+                    if not self.loop:
+                        break
+                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                self._stopping.wait(self.reconnect_delay)
+                self.cap.release()
+                self.cap = cv2.VideoCapture(self.source)
+                continue
+
+            if frame_interval:
+                next_frame += frame_interval
+                self._stopping.wait(max(0.0, next_frame - time.perf_counter()))
+            self.frames.put((time.time(), frame))
+        self.cap.release()
+        self.finished.set()
+
+    def latest(self):
+        # (timestamp, frame) captured since the last call, or None
+        item, _ = self.frames.take(timeout=0)
+        return item
+
+    def stop(self):
+        self._stopping.set()
+
+
+class RecognitionWorker(threading.Thread):
+    # Recognition stage: runs recognizer.recognize() on the newest submitted
+    # frame. Frames submitted while it is busy replace each other, so the
+    # queue depth is at most one and latency never accumulates.
+    def __init__(self, recognizer, send_alert):
+        super().__init__(daemon=True)
+        self.recognizer = recognizer
+        self.send_alert = send_alert
+        self.frames = LatestSlot()
+        self._results_lock = threading.Lock()
+        self._results = []
+        self._results_seq = 0
+        self._results_time = 0.0
+        self._stopping = threading.Event()
+        self.last_duration = 0.0
+        self.processed = 0
+
+    def submit(self, frame, frame_time=None):
+        return self.frames.put((frame_time or time.time(), frame))
+
+    @property
+    def dropped(self):
+        return self.frames.dropped
+
+    def results(self):
+        # (results, frame sequence number, capture time of that frame)
+        with self._results_lock:
+            return self._results, self._results_seq, self._results_time
+
+    def run(self):
+        while not self._stopping.is_set():
+            item, seq = self.frames.take(timeout=0.2)
+            if item is None:
+                continue
+            frame_time, frame = item
+            start = time.perf_counter()
+            try:
+                results = self.recognizer.recognize(frame, self.send_alert)
+            except Exception as e:
+                log.error("Recognition failed: %s", e)
+                continue
+            self.last_duration = time.perf_counter() - start
+            self.processed += 1
+            with self._results_lock:
+                self._results, self._results_seq, self._results_time = results, seq, frame_time
+
+    def stop(self):
+        self._stopping.set()
@@ -0,0 +1,142 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+
+from face_db import reserve_unknown_ids, write_unknown_batch
+from face_metrics import Metrics
+
+log = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    # Collects unknown-face rows and sightings from the recognition thread and
+    # writes them in one transaction per batch, from a background thread,
+    # once max_rows are buffered or the oldest row is max_delay seconds old.
+    # Ids are handed out from blocks reserved in the database up front, so a
+    # caller gets the final id immediately and can use it before the flush.
+    # Sightings of the same face closer than sighting_interval are collapsed.
+    def __init__(self, max_rows=200, max_delay=1.0, id_block=100, sighting_interval=1.0, metrics=None):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.id_block = id_block
+        self.sighting_interval = sighting_interval
+        self.metrics = metrics or Metrics(enabled=False)
+        self._unknowns = {}  # id -> (id, image_path, encoding_blob, date_detected)
+        self._sightings = []
+        self._last_seen = {}  # id -> monotonic time of the last recorded sighting
+        self._oldest = None
+        self._next_id = 0
+        self._last_id = -1
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopping = False
+        self.flushed = 0
+        self.failed_flushes = 0
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _allocate_id(self):
+        if self._next_id > self._last_id:
+            with self.metrics.time("db_reserve_ids"):
+                self._next_id = reserve_unknown_ids(self.id_block)
+            self._last_id = self._next_id + self.id_block - 1
+        face_id = self._next_id
+        self._next_id += 1
+        return face_id
+
+    def _buffered(self):
+        # Wakes the flusher so it can start the delay timer or flush a full batch
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        self._cond.notify()
+
+    def add_unknown(self, image_path, encoding_blob, detected_at=None):
+        detected_at = detected_at or datetime.now().isoformat()
+        with self._cond:
+            face_id = self._allocate_id()
+            self._unknowns[face_id] = (face_id, image_path, encoding_blob, detected_at)
+            self._sightings.append((face_id, detected_at))
+            self._last_seen[face_id] = time.monotonic()
+            self._buffered()
+        return face_id
+
+    def add_sighting(self, unknown_id, seen_at=None):
+        now = time.monotonic()
+        with self._cond:
+            if now - self._last_seen.get(unknown_id, -self.sighting_interval) < self.sighting_interval:
+                return
+            self._last_seen[unknown_id] = now
+            self._sightings.append((unknown_id, seen_at or datetime.now().isoformat()))
+            self._buffered()
+
+    def discard(self, unknown_id):
+        # Drops buffered rows for an unknown that was deleted or promoted
+        # before it reached the database. Waits out a flush in progress so
+        # the row cannot be written after the caller deletes it.
+        with self._flush_lock, self._cond:
+            self._unknowns.pop(unknown_id, None)
+            self._last_seen.pop(unknown_id, None)
+            self._sightings = [s for s in self._sightings if s[0] != unknown_id]
+
+    def pending(self):
+        with self._cond:
+            return len(self._unknowns) + len(self._sightings)
+
+    def _take(self):
+        with self._cond:
+            unknowns, sightings = list(self._unknowns.values()), self._sightings
+            self._unknowns, self._sightings, self._oldest = {}, [], None
+            cutoff = time.monotonic() - self.sighting_interval
+            self._last_seen = {k: t for k, t in self._last_seen.items() if t > cutoff}
+            return unknowns, sightings
+
+    def flush(self):
+        with self._flush_lock:
+            unknowns, sightings = self._take()
+            if not unknowns and not sightings:
+                return
+            try:
+                with self.metrics.time("db_flush"):
+                    write_unknown_batch(unknowns, sightings)
+                self.flushed += len(unknowns) + len(sightings)
+                self.metrics.count("db_rows_written", len(unknowns) + len(sightings))
+            except Exception as e:
+                # Put the rows back and try again with the next batch
+                self.failed_flushes += 1
+                log.error("Unknown-face batch write failed: %s", e)
+                with self._cond:
+                    for row in unknowns:
+                        self._unknowns.setdefault(row[0], row)
+                    self._sightings[:0] = sightings
+                    if self._oldest is None:
+                        self._oldest = time.monotonic()
+
+    def _due(self):
+        if self._oldest is None:
+            return False
+        full = len(self._unknowns) + len(self._sightings) >= self.max_rows
+        return full or time.monotonic() - self._oldest >= self.max_delay
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._stopping and not self._due():
+                    timeout = None if self._oldest is None else self._oldest + self.max_delay - time.monotonic()
+                    self._cond.wait(timeout if timeout is None else max(timeout, 0.01))
+                if self._stopping:
+                    return
+            self.flush()
+
+    def close(self):
+        # Writes whatever is still buffered; safe to call more than once
+        with self._cond:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush()
+        atexit.unregister(self.close)
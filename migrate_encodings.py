@@ -0,0 +1,44 @@
+import argparse
+import sqlite3
+
+from face_db import DB_PATH, decode_encoding, encode_encoding, is_legacy_encoding
+
+TABLES = ("known_faces", "unknown_faces")
+
+def migrate_table(conn, table, batch_size=1000):
+    # Rewrites pickled encodings in place; rows already in the new format are left alone
+    read = conn.cursor()
+    write = conn.cursor()
+    read.execute(f"SELECT id, encoding FROM {table}")
+    converted = 0
+    while True:
+        rows = read.fetchmany(batch_size)
+        if not rows:
+            break
+        updates = [(encode_encoding(decode_encoding(blob)), face_id)
+                   for face_id, blob in rows if is_legacy_encoding(blob)]
+        write.executemany(f"UPDATE {table} SET encoding = ? WHERE id = ?", updates)
+        converted += len(updates)
+    return converted
+
+def migrate_db(db_path=DB_PATH, batch_size=1000, vacuum=True):
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            counts = {table: migrate_table(conn, table, batch_size) for table in TABLES}
+        if vacuum and any(counts.values()):
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert pickled face encodings to the raw float32 format.")
+    parser.add_argument("db_path", nargs="?", default=DB_PATH)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--no-vacuum", action="store_true", help="skip reclaiming space afterwards")
+    args = parser.parse_args()
+
+    counts = migrate_db(args.db_path, args.batch_size, not args.no_vacuum)
+    for table, count in counts.items():
+        print(f"[INFO] {table}: converted {count} encodings")
@@ -1,10 +1,15 @@
-import sys, os, cv2, pickle
+import sys, os, cv2
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import QPixmap, QImage
 from PyQt5.QtCore import Qt
-from face_db import connect_db, init_db
+from face_db import init_db, encode_encoding, image_in_use, list_unknown_faces, promote_unknown_face
 import face_recognition
-from datetime import datetime
+from face_image_store import ImageStore
+from face_thumbnails import ThumbnailCache
+
+UNKNOWN_DIR = "unknown_faces"
+thumbnails = ThumbnailCache(os.path.join(UNKNOWN_DIR, ".thumbs"))
+image_store = ImageStore(UNKNOWN_DIR, thumbnails=thumbnails)
 
 class PromoteGUI(QWidget):
     def __init__(self):
@@ -38,11 +43,7 @@ class PromoteGUI(QWidget):
 
     def load_unknowns(self):
         self.image_list.clear()
-        conn = connect_db()
-        c = conn.cursor()
-        c.execute("SELECT id, image_path FROM unknown_faces")
-        self.unknown_faces = c.fetchall()
-        conn.close()
+        self.unknown_faces = [(face_id, path) for face_id, path, _ in list_unknown_faces()]
 
         for row in self.unknown_faces:
             self.image_list.addItem(f"{row[0]} - {os.path.basename(row[1])}")
@@ -51,14 +52,14 @@ class PromoteGUI(QWidget):
         index = self.image_list.currentRow()
         self.selected_id, self.selected_img_path = self.unknown_faces[index]
 
-        image = cv2.imread(self.selected_img_path)
+        image = thumbnails.get(image_store.open_path(self.selected_img_path), 250)
         if image is None:
             self.image_label.setText("Image not found.")
             return
         image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         h, w, ch = image.shape
         qt_image = QImage(image.data, w, h, ch * w, QImage.Format_RGB888)
-        self.image_label.setPixmap(QPixmap.fromImage(qt_image).scaled(300, 300, Qt.KeepAspectRatio))
+        self.image_label.setPixmap(QPixmap.fromImage(qt_image))
 
     def promote(self):
         name = self.name_input.text().strip()
@@ -67,27 +68,19 @@ class PromoteGUI(QWidget):
             return
 
         # Load encoding
-        image = face_recognition.load_image_file(self.selected_img_path)
+        image = face_recognition.load_image_file(image_store.open_path(self.selected_img_path))
         encodings = face_recognition.face_encodings(image)
 
         if not encodings:
             QMessageBox.warning(self, "Face Error", "No face encoding found in image.")
             return
 
-        encoding_blob = pickle.dumps(encodings[0])
-        conn = connect_db()
-        c = conn.cursor()
-
-        c.execute("INSERT INTO known_faces (name, encoding, date_added) VALUES (?, ?, ?)",
-                  (name, encoding_blob, datetime.now().isoformat()))
-        c.execute("DELETE FROM unknown_faces WHERE id = ?", (self.selected_id,))
-        conn.commit()
-        conn.close()
+        encoding_blob = encode_encoding(encodings[0])
+        promote_unknown_face(self.selected_id, name, encoding_blob, image_path=None)
 
-        try:
-            os.remove(self.selected_img_path)
-        except:
-            pass
+        # Identical crops share a file; keep it while another row uses it
+        if not image_in_use(self.selected_img_path):
+            image_store.delete(self.selected_img_path)
 
         QMessageBox.information(self, "Success", f"{name} promoted!")
         self.name_input.clear()
@@ -1,9 +1,6 @@
 import sys
-import sqlite3
-import pickle
 import cv2
 import os
-from datetime import datetime
 
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel, QVBoxLayout,
@@ -15,7 +12,11 @@ from PyQt5.QtGui import QPixmap, QImage, QIcon
 from PyQt5.QtCore import Qt, QTimer
 
 from face_recognizer import FaceRecognizerDL
-from face_db import connect_db, init_db
+from face_worker import FrameGrabber, RecognitionWorker
+from face_db import (
+    init_db, decode_encoding, list_known_faces, list_unknown_faces, promote_unknown_face,
+    get_known_face, update_known_face, delete_known_face
+)
 
 # -- Constants --
 DB_PATH = 'face_records.db'
@@ -29,6 +30,13 @@ known_encodings = []
 known_names = []
 recognizer = FaceRecognizerDL(known_encodings, known_names, UNKNOWN_DIR)
 
+def thumbnail_pixmap(path, size):
+    thumb = recognizer.thumbnails.get(recognizer.image_store.open_path(path), size)
+    if thumb is None:
+        return QPixmap()
+    h, w = thumb.shape[:2]
+    return QPixmap.fromImage(QImage(thumb.data, w, h, 3 * w, QImage.Format_RGB888).rgbSwapped())
+
 # -----------------------
 # Unknown Faces Tab
 # -----------------------
@@ -43,15 +51,11 @@ class UnknownFacesTab(QWidget):
         content = QWidget()
         self.grid = QGridLayout()
 
-        conn = connect_db()
-        c = conn.cursor()
-        c.execute("SELECT id, image_path, encoding FROM unknown_faces ORDER BY date_detected DESC")
-        self.faces = c.fetchall()
-        conn.close()
+        self.faces = list_unknown_faces()
 
         for i, (face_id, path, encoding_blob) in enumerate(self.faces):
             btn = QPushButton()
-            pixmap = QPixmap(path).scaled(100, 100, Qt.KeepAspectRatio)
+            pixmap = thumbnail_pixmap(path, 100)
             btn.setIcon(QIcon(pixmap))
             btn.setIconSize(pixmap.size())
             btn.setFixedSize(120, 120)
@@ -69,7 +73,7 @@ class UnknownFacesTab(QWidget):
         layout = QVBoxLayout()
 
         image_label = QLabel()
-        pixmap = QPixmap(image_path).scaled(250, 250, Qt.KeepAspectRatio)
+        pixmap = thumbnail_pixmap(image_path, 250)
         image_label.setPixmap(pixmap)
         layout.addWidget(image_label)
 
@@ -105,18 +109,13 @@ class UnknownFacesTab(QWidget):
                 QMessageBox.warning(dialog, "Error", "Name is required!")
                 return
 
-            conn = connect_db()
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO known_faces (name, contact, age, gender, address, occupation, image_path, encoding, date_added)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                name, contact, age, gender, address, occupation, image_path, encoding_blob,
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            ))
-            cursor.execute("DELETE FROM unknown_faces WHERE id = ?", (face_id,))
-            conn.commit()
-            conn.close()
+            known_id = promote_unknown_face(
+                face_id, name, encoding_blob, contact=contact, age=age, gender=gender,
+                address=address, occupation=occupation, image_path=image_path
+            )
+            recognizer.forget_unknown(face_id)
+            if known_id is not None:
+                recognizer.add_known_face(known_id, name, decode_encoding(encoding_blob))
 
             QMessageBox.information(dialog, "Success", "Promoted to known faces!")
             
@@ -138,15 +137,11 @@ class UnknownFacesTab(QWidget):
                 widget.deleteLater()
 
         # Reload faces from database
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT id, image_path, encoding FROM unknown_faces ORDER BY date_detected DESC")
-        self.faces = c.fetchall()
-        conn.close()
+        self.faces = list_unknown_faces()
 
         for i, (face_id, path, encoding_blob) in enumerate(self.faces):
             btn = QPushButton()
-            pixmap = QPixmap(path).scaled(100, 100, Qt.KeepAspectRatio)
+            pixmap = thumbnail_pixmap(path, 100)
             btn.setIcon(QIcon(pixmap))
             btn.setIconSize(pixmap.size())
             btn.setFixedSize(120, 120)
@@ -170,18 +165,28 @@ class LiveFeedTab(QWidget):
 
         self.setLayout(self.layout)
 
-        self.cap = cv2.VideoCapture(0)
+        # Capture and recognition run on their own threads; the GUI thread
+        # only shows the newest frame with the latest recognition overlays
+        self.grabber = FrameGrabber(0)
+        self.worker = RecognitionWorker(recognizer, self.send_alert_gui)
+        self.grabber.start()
+        self.worker.start()
+
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_frame)
         self.timer.start(30)
 
     def update_frame(self):
-        ret, frame = self.cap.read()
-        if not ret:
+        captured = self.grabber.latest()
+        if captured is None:
             return
+        frame_time, frame = captured
 
-        # Run face recognition
-        frame = recognizer.detect_and_recognize(frame, self.send_alert_gui)
+        # Recognition gets its own copy; if it is still busy the previous
+        # pending frame is dropped
+        self.worker.submit(frame.copy(), frame_time)
+        results, _, _ = self.worker.results()
+        recognizer.draw_results(frame, results)
 
         rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         h, w, ch = rgb_image.shape
@@ -194,17 +199,22 @@ class LiveFeedTab(QWidget):
     def send_alert_gui(self, name, image_path):
         print(f"[ALERT] {name} detected! Image saved at {image_path}")
 
+    def stop(self):
+        self.timer.stop()
+        self.worker.stop()
+        self.grabber.stop()
+        self.worker.join(timeout=2)
+        self.grabber.join(timeout=2)
+
     def closeEvent(self, event):
-        self.cap.release()
+        self.stop()
 
 # -----------------------
 # Known Faces Tab
 # -----------------------
 class KnownFacesTab(QWidget):
-    def __init__(self, db_connection):
+    def __init__(self):
         super().__init__()
-        self.db_connection = db_connection
-        self.cursor = self.db_connection.cursor()
         self.setup_ui()
         self.load_known_faces()
 
@@ -224,8 +234,7 @@ class KnownFacesTab(QWidget):
         self.setLayout(layout)
 
     def load_known_faces(self):
-        self.cursor.execute("SELECT id, name, contact, occupation, image_path FROM known_faces")
-        self.known_faces = self.cursor.fetchall()
+        self.known_faces = list_known_faces()
         self.display_faces(self.known_faces)
 
     def search_faces(self, query):
@@ -244,8 +253,8 @@ class KnownFacesTab(QWidget):
 
             image_label = QLabel()
 
-            if image_path and os.path.exists(image_path):
-                pixmap = QPixmap(image_path).scaled(60, 60, Qt.KeepAspectRatio)
+            if recognizer.image_store.exists(image_path):
+                pixmap = thumbnail_pixmap(image_path, 60)
             else:
                 pixmap = QPixmap('placeholder.png').scaled(60, 60, Qt.KeepAspectRatio)
             image_label.setPixmap(pixmap)
@@ -261,11 +270,7 @@ class KnownFacesTab(QWidget):
             self.table.setCellWidget(row_index, 3, promote_button)
 
     def open_edit_dialog(self, face_id):
-        conn = connect_db()
-        c = conn.cursor()
-        c.execute("SELECT name, contact, occupation, image_path FROM known_faces WHERE id = ?", (face_id,))
-        result = c.fetchone()
-        conn.close()
+        result = get_known_face(face_id)
 
         if not result:
             QMessageBox.warning(self, "Error", "Face not found!")
@@ -302,15 +307,7 @@ class KnownFacesTab(QWidget):
             new_contact = contact_input.text()
             new_occupation = occupation_input.text()
 
-            conn = connect_db()
-            c = conn.cursor()
-            c.execute("""
-                UPDATE known_faces
-                SET name = ?, contact = ?, occupation = ?
-                WHERE id = ?
-            """, (new_name, new_contact, new_occupation, face_id))
-            conn.commit()
-            conn.close()
+            update_known_face(face_id, new_name, new_contact, new_occupation)
 
             QMessageBox.information(dialog, "Success", "Face information updated!")
             self.load_known_faces()
@@ -320,18 +317,11 @@ class KnownFacesTab(QWidget):
             confirm = QMessageBox.question(dialog, "Confirm Delete", "Are you sure you want to delete this face?", 
                                         QMessageBox.Yes | QMessageBox.No)
             if confirm == QMessageBox.Yes:
-                conn = connect_db()
-                c = conn.cursor()
-                c.execute("DELETE FROM known_faces WHERE id = ?", (face_id,))
-                conn.commit()
-                conn.close()
+                delete_known_face(face_id)
+                recognizer.remove_known_face(face_id)
 
                 # Optionally also delete the image file from disk
-                try:
-                    if os.path.exists(image_path):
-                        os.remove(image_path)
-                except Exception as e:
-                    print(f"Error deleting image: {e}")
+                recognizer.image_store.delete(image_path)
 
                 QMessageBox.information(dialog, "Deleted", "Face deleted successfully!")
                 self.load_known_faces()
@@ -355,14 +345,20 @@ class MainWindow(QMainWindow):
         self.setGeometry(100, 100, 1000, 700)
 
         tabs = QTabWidget()
-        tabs.addTab(LiveFeedTab(), "Live Feed")
+        self.live_feed_tab = LiveFeedTab()
+        tabs.addTab(self.live_feed_tab, "Live Feed")
         
-        self.known_faces_tab = KnownFacesTab(connect_db())
+        self.known_faces_tab = KnownFacesTab()
         tabs.addTab(UnknownFacesTab(self.known_faces_tab), "Unknown Faces")
         tabs.addTab(self.known_faces_tab, "Known Faces")
 
         self.setCentralWidget(tabs)
 
+    def closeEvent(self, event):
+        self.live_feed_tab.stop()
+        recognizer.close()
+        super().closeEvent(event)
+
 # -----------------------
 # Run the App
 # -----------------------
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("face_recognition")
+
+import face_db
+from face_recognizer import FaceRecognizerDL
+
+
+@pytest.mark.parametrize("mode", ["use_ann", "use_quantized"])
+def test_index_starts_empty_then_syncs(tmp_path, monkeypatch, mode):
+    # An index built from an empty known_faces table takes the first
+    # synced faces and stays in step with the gallery
+    monkeypatch.setattr(face_db, "DB_PATH", str(tmp_path / "faces.db"))
+    face_db.init_db()
+    recognizer = FaceRecognizerDL([], [], str(tmp_path / "unknown"), known_sync_interval=0, **{mode: True})
+    assert len(recognizer.gallery) == 0
+
+    rng = np.random.default_rng(0)
+    first, second = (rng.normal(0, 0.1, 128).astype(np.float32) for _ in range(2))
+    ann = face_db.insert_known_face("Ann", face_db.encode_encoding(first))
+    assert recognizer.sync_known_faces() == 1
+    bob = face_db.insert_known_face("Bob", face_db.encode_encoding(second))
+    assert recognizer.sync_known_faces() == 1
+    assert recognizer.sync_known_faces() == 0
+
+    assert ann in recognizer.gallery and bob in recognizer.gallery
+    assert len(recognizer.gallery.index) == 2
+    assert [m.name for m in recognizer.gallery.match([first, second])] == ["Ann", "Bob"]
+    recognizer.close()